@@ -1,5 +1,6 @@
 import logging
 
+from django_redis import get_redis_connection
 from rest_framework import exceptions, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
 from rest_framework.exceptions import APIException
@@ -92,9 +93,42 @@ class APISessionAuthentication(SessionAuthentication):
 
 class OrgUserRateThrottle(ScopedRateThrottle):
     """
-    Throttle class which rate limits at an org level or user level for staff users
+    Throttle class which rate limits at an org level or user level for staff users. Each of those has a token bucket in
+    redis which holds up to the burst size of tokens, is refilled at the scope's rate, and from which each request takes
+    a token. Buckets are updated by an atomic script so a request costs the same regardless of the rate. The script
+    reads the time from redis so that buckets don't depend on the clocks of web hosts agreeing.
     """
 
+    cache_format = "api_throttle:%(scope)s:%(ident)s"
+    stats_key = "api_throttle_stats"
+
+    # KEYS: bucket, stats ARGV: burst size, tokens per second, scope
+    script = """
+local burst, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens, ts = tonumber(bucket[1]), tonumber(bucket[2])
+if tokens == nil then
+    tokens, ts = burst, now
+end
+
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+
+local allowed, wait = 0, (1 - tokens) / rate
+if tokens >= 1 then
+    allowed, wait, tokens = 1, 0, tokens - 1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", string.format("%.6f", now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+redis.call("HINCRBY", KEYS[2], ARGV[3] .. (allowed == 1 and ":allowed" or ":throttled"), 1)
+
+return {allowed, tostring(wait)}
+"""
+
+    _registered_script = None
+
     def get_org_rate(self, request, by_token: bool):
         default_rates = settings.REST_FRAMEWORK.get("DEFAULT_THROTTLE_RATES", {})
         org_rates = {}
@@ -102,6 +136,15 @@ class OrgUserRateThrottle(ScopedRateThrottle):
             org_rates = request.org.api_rates
         return {**default_rates, **org_rates}.get(self.scope)
 
+    def get_org_burst(self, request, by_token: bool) -> int:
+        """
+        Gets the burst size for this scope, which defaults to the number of requests allowed in the rate's duration
+        """
+        org_bursts = {}
+        if request.user.is_authenticated and by_token:
+            org_bursts = request.org.api_bursts
+        return {**settings.API_THROTTLE_BURSTS, **org_bursts}.get(self.scope) or self.num_requests
+
     def allow_request(self, request, view):
         by_token = isinstance(request.auth, APIToken)
 
@@ -114,8 +157,47 @@ class OrgUserRateThrottle(ScopedRateThrottle):
         # Determine the allowed request rate considering the org config
         self.rate = self.get_org_rate(request, by_token)
         self.num_requests, self.duration = self.parse_rate(self.rate)
+        self._wait = None
+
+        if self.rate is None:
+            return True
 
-        return super(ScopedRateThrottle, self).allow_request(request, view)
+        allowed, wait = self.get_script()(
+            keys=[self.get_cache_key(request, view), self.stats_key],
+            args=[self.get_org_burst(request, by_token), self.num_requests / self.duration, self.scope],
+        )
+
+        self._wait = float(wait)
+        return bool(allowed)
+
+    def wait(self):
+        return self._wait
+
+    @classmethod
+    def get_script(cls):
+        """
+        Gets the bucket script, registering it with redis on first use
+        """
+        if cls._registered_script is None:
+            cls._registered_script = get_redis_connection().register_script(cls.script)
+        return cls._registered_script
+
+    @classmethod
+    def pop_stats(cls) -> dict:
+        """
+        Gets and resets the counts of allowed and throttled requests by scope
+        """
+        pipe = get_redis_connection().pipeline()
+        pipe.hgetall(cls.stats_key)
+        pipe.delete(cls.stats_key)
+        counts = pipe.execute()[0]
+
+        stats = {}
+        for field, count in counts.items():
+            scope, decision = field.decode().rsplit(":", 1)
+            stats.setdefault(scope, {"allowed": 0, "throttled": 0})[decision] = int(count)
+
+        return stats
 
     def get_cache_key(self, request, view):
         org = request.org
@@ -1,11 +1,12 @@
-from django.conf import settings
 from django.utils import timezone
 
 from temba.api.models import APIToken
-from temba.utils import chunk_list
+from temba.utils import analytics
 from temba.utils.crons import cron_task
+from temba.utils.models import RetentionPolicy
 
 from .models import WebHookEvent
+from .support import OrgUserRateThrottle
 
 
 @cron_task()
@@ -28,12 +29,23 @@ def trim_webhook_events():
     Trims old webhook events
     """
 
-    num_deleted = 0
+    return RetentionPolicy("webhookevent", WebHookEvent, "created_on").apply()
 
-    if settings.RETENTION_PERIODS["webhookevent"]:
-        trim_before = timezone.now() - settings.RETENTION_PERIODS["webhookevent"]
-        event_ids = WebHookEvent.objects.filter(created_on__lte=trim_before).values_list("id", flat=True)
-        for batch in chunk_list(event_ids, 1000):
-            num_deleted, _ = WebHookEvent.objects.filter(id__in=batch).delete()
 
-    return {"deleted": num_deleted}
+@cron_task()
+def report_api_throttle_stats():
+    """
+    Reports the numbers of API requests allowed and throttled in each scope since the last report
+    """
+
+    stats = OrgUserRateThrottle.pop_stats()
+    gauges = {}
+    for scope, counts in stats.items():
+        name = scope.replace(".", "_")
+        gauges[f"temba.api_requests_allowed_{name}"] = counts["allowed"]
+        gauges[f"temba.api_requests_throttled_{name}"] = counts["throttled"]
+
+    if gauges:
+        analytics.gauges(gauges)
+
+    return stats
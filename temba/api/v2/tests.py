@@ -7,16 +7,18 @@ from unittest.mock import call, patch
 from urllib.parse import quote_plus
 
 import iso8601
+from django_redis import get_redis_connection
 from rest_framework import serializers
 
 from django.conf import settings
 from django.contrib.gis.geos import GEOSGeometry
-from django.core.cache import cache
 from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 from temba.api.models import APIToken, Resthook, WebHookEvent
+from temba.api.support import OrgUserRateThrottle
+from temba.api.tasks import report_api_throttle_stats
 from temba.archives.models import Archive
 from temba.campaigns.models import Campaign, CampaignEvent
 from temba.channels.models import ChannelEvent
@@ -500,8 +502,14 @@ class EndpointsTest(APITest):
         self.assertEqual(200, response.status_code)
         self.assertEqual(str(self.org.id), response["X-Temba-Org"])
 
+        r = get_redis_connection()
+        bucket_key = f"api_throttle:v2:{self.org.id}"
+
+        def set_bucket_tokens(tokens: int):
+            r.hset(bucket_key, mapping={"tokens": tokens, "ts": time.time() + 60})  # no refill until ts
+
         # simulate the admin user exceeding the rate limit for the v2 scope
-        cache.set(f"throttle_v2_{self.org.id}", [time.time() for r in range(10000)])
+        set_bucket_tokens(0)
 
         # next request they make using a token will be rejected
         response = request_by_token(fields_url, token1.key)
@@ -526,15 +534,32 @@ class EndpointsTest(APITest):
         # are allowed to access if we have not reached the configured org api rates
         self.org.api_rates = {"v2": "15000/hour"}
         self.org.save(update_fields=("api_rates",))
+        set_bucket_tokens(1)
 
         response = request_by_basic_auth(fields_url, self.admin.username, token1.key)
         self.assertEqual(response.status_code, 200)
 
-        cache.set(f"throttle_v2_{self.org.id}", [time.time() for r in range(15000)])
+        set_bucket_tokens(0)
 
-        # next request they make using a token will be rejected
+        # next request they make using a token will be rejected, and told when to retry
         response = request_by_token(fields_url, token1.key)
         self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+        OrgUserRateThrottle.pop_stats()
+
+        # a new bucket is full, holding the org's burst size of tokens
+        self.org.api_rates = {"v2": "10/hour"}
+        self.org.api_bursts = {"v2": 2}
+        self.org.save(update_fields=("api_rates", "api_bursts"))
+        r.delete(bucket_key)
+
+        self.assertEqual(request_by_token(fields_url, token1.key).status_code, 200)
+        self.assertEqual(request_by_token(fields_url, token1.key).status_code, 200)
+        self.assertEqual(request_by_token(fields_url, token1.key).status_code, 429)
+
+        self.assertEqual({"v2": {"allowed": 2, "throttled": 1}}, report_api_throttle_stats())
+        self.assertEqual({}, OrgUserRateThrottle.pop_stats())
 
         # if user is demoted to a role that can't use tokens, tokens shouldn't work for them
         self.org.add_user(self.admin, OrgRole.VIEWER)
@@ -0,0 +1,147 @@
+import mmap
+import os
+import shutil
+import tempfile
+import time
+
+from django_redis import get_redis_connection
+
+from django.conf import settings
+
+from temba.utils import s3
+
+STATS_KEY = "archive_cache_stats"
+
+
+class ArchiveCache:
+    """
+    Local on-disk cache of archive files. Archives are content addressed by their hash so cached files never go stale.
+    When the total size of cached files exceeds the budget, the least recently used files are evicted, as are files
+    which haven't been used for longer than the max age. The cache is per host, so removing a file only removes it from
+    this host's cache, and copies on other hosts are left to be evicted by age.
+    """
+
+    def __init__(self, directory: str, max_size: int, max_age: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, archive):
+        """
+        Opens the given archive as a memory-mapped file, downloading it into the cache first if necessary
+        """
+        r = get_redis_connection()
+
+        # open rather than check for the file first, as another process could evict it in between
+        try:
+            f = open(self._path(archive.hash), "rb")
+        except FileNotFoundError:
+            bucket, key = archive.get_storage_location()
+            s3_obj = s3.client().get_object(Bucket=bucket, Key=key)
+            f = open(self.put(archive.hash, s3_obj["Body"]), "rb")
+            r.hincrby(STATS_KEY, "misses", 1)
+        else:
+            os.utime(f.fileno())  # mark as recently used
+            r.hincrby(STATS_KEY, "hits", 1)
+            r.hincrby(STATS_KEY, "bytes_saved", archive.size)
+
+        # the mapping remains valid even if the file is evicted while it's being read
+        with f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def put(self, hash: str, stream) -> str:
+        """
+        Adds the contents of the given stream to the cache, evicting other files if necessary, and returns its path
+        """
+        # write to a temp file first so other processes never see partially written files
+        with self.temp_file() as f:
+            shutil.copyfileobj(stream, f)
+
+        return self.add(hash, f.name)
+
+    def temp_file(self):
+        """
+        Creates a temp file in the cache directory which can be written to and then added with `add`
+        """
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+
+    def add(self, hash: str, temp_path: str) -> str:
+        """
+        Moves a completely written temp file into the cache, evicting other files if necessary, and returns its path
+        """
+        path = self._path(hash)
+
+        os.replace(temp_path, path)
+
+        self.evict(keep=path)
+        return path
+
+    def remove(self, hash: str):
+        """
+        Removes the file with the given hash from the cache if it's there
+        """
+        self._remove_path(self._path(hash))
+
+    def evict(self, keep: str = None):
+        """
+        Evicts files which haven't been used within the max age, and then least recently used files until the cache is
+        within its size budget
+        """
+        expired_before = time.time() - self.max_age
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".jsonl.gz"):
+                stat = entry.stat()
+                if stat.st_mtime < expired_before and entry.path != keep:
+                    self._remove_path(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(e[1] for e in entries)
+
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path != keep:
+                self._remove_path(path)
+                total_size -= size
+
+    @staticmethod
+    def pop_stats() -> dict:
+        """
+        Gets and resets the hits, misses and bytes saved of the caches of all hosts since the last pop
+        """
+        pipe = get_redis_connection().pipeline()
+        pipe.hgetall(STATS_KEY)
+        pipe.delete(STATS_KEY)
+        stats = {k.decode(): int(v) for k, v in pipe.execute()[0].items()}
+        hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if (hits + misses) else 0.0,
+            "bytes_saved": stats.get("bytes_saved", 0),
+        }
+
+    def _path(self, hash: str) -> str:
+        return os.path.join(self.directory, f"{hash}.jsonl.gz")
+
+    @staticmethod
+    def _remove_path(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # removed by another process
+            pass
+
+
+def get_archive_cache():
+    """
+    Gets the archive cache if one has been configured
+    """
+    if settings.ARCHIVE_CACHE_DIR:
+        return ArchiveCache(settings.ARCHIVE_CACHE_DIR, settings.ARCHIVE_CACHE_SIZE, settings.ARCHIVE_CACHE_MAX_AGE)
+    return None
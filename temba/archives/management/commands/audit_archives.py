@@ -15,6 +15,11 @@ S3_RECORD_MAX_CHARS = 1_048_576
 MAX_PATH_LEN = 500
 
 
+def trim_path(record: dict) -> dict:
+    record["path"] = record["path"][:MAX_PATH_LEN]
+    return record
+
+
 class Command(BaseCommand):  # pragma: no cover
     help = "Audits archives"
 
@@ -35,6 +40,7 @@ class Command(BaseCommand):  # pragma: no cover
 
         s3_client = s3.client()
         flow_run_counts = defaultdict(int)
+        to_fix = []
 
         for archive in Archive._get_covering_period(org, archive_type):
             bucket, key = archive.get_storage_location()
@@ -63,7 +69,10 @@ class Command(BaseCommand):  # pragma: no cover
                 self.stdout.write(f"   ⚠️ record count mismatch, db={archive.record_count} file={num_records}")
 
             if num_too_long > 0 and archive_type == Archive.TYPE_FLOWRUN and fix:
-                self.fix_run_archive(archive)
+                to_fix.append(archive)
+
+        if to_fix:
+            self.fix_run_archives(org, to_fix)
 
         if archive_type == Archive.TYPE_FLOWRUN and run_counts:
             flows = org.flows.filter(is_active=True, is_system=False)
@@ -83,24 +92,14 @@ class Command(BaseCommand):  # pragma: no cover
                         f"squashed={squashed_count} db={db_count} archives={archive_count}"
                     )
 
-    def fix_run_archive(self, archive):
-        self.stdout.write("    🔧 fixing run archive...")
-
-        bucket, key = archive.get_storage_location()
-
-        progress = {"records": 0}
-
-        def trim_path(record) -> dict:
-            record["path"] = record["path"][:MAX_PATH_LEN]
-            progress["records"] += 1
-
-            if progress["records"] % 100_000 == 0:
-                percent = 100 * progress["records"] // archive.record_count
-                self.stdout.write(f"    ⏳ {percent}%")
-
-            return record
-
-        archive.rewrite(trim_path, delete_old=True)
-        bucket, new_key = archive.get_storage_location()
+    def fix_run_archives(self, org, archives: list):
+        # archives are rewritten in parallel by tasks, and the job is checkpointed so running this again after an
+        # interruption only queues the archives which weren't completed
+        num_queued = Archive.rewrite_all(
+            archives,
+            "temba.archives.management.commands.audit_archives.trim_path",
+            job=f"trim-run-paths:{org.id}",
+            delete_old=True,
+        )
 
-        self.stdout.write(f"    ✅️ {key} replaced by {new_key}")
+        self.stdout.write(f"🔧 queued {num_queued} of {len(archives)} run archives for fixing")
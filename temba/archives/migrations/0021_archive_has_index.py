@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("archives", "0020_squashed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archive",
+            name="has_index",
+            field=models.BooleanField(db_default=False),
+        ),
+    ]
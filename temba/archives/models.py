@@ -2,26 +2,41 @@ import base64
 import gzip
 import hashlib
 import io
+import os
+import queue
 import re
-import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import date, datetime
 from gettext import gettext as _
 
+import iso8601
 from dateutil.relativedelta import relativedelta
+from django_redis import get_redis_connection
 
 from django.core.files.storage import storages
 from django.db import models
 from django.db.models import Q
 from django.utils import timezone
 
-from temba.utils import json, s3, sizeof_fmt
+from temba.utils import chunk_list, json, s3, sizeof_fmt
 from temba.utils.s3 import EventStreamReader
+from temba.utils.s3.select import LOOKUPS, match_record
+
+from .cache import get_archive_cache
 
 KEY_PATTERN = re.compile(r"^(?P<org>\d+)/(?P<type>run|message)_(?P<period>(D|M)\d+)_(?P<hash>[0-9a-f]{32})\.jsonl\.gz$")
 
 
 class Archive(models.Model):
     DOWNLOAD_EXPIRES = 60 * 60 * 24  # Up to 24 hours
+    PREFETCH = 3  # number of archives read concurrently when iterating across archives
+    INDEX_BLOCK_SIZE = 1000  # number of records in each independently compressed block of indexed archives
+    REWRITE_PART_SIZE = 16 * 1024 * 1024  # size of parts uploaded when rewriting large archives
+    REWRITE_JOB_KEY = "archive_rewrite"  # redis hashes of the progress of rewrite jobs
+    REWRITE_JOB_EXPIRES = 60 * 60 * 24 * 7
 
     TYPE_MSG = "message"
     TYPE_FLOWRUN = "run"
@@ -65,6 +80,9 @@ class Archive(models.Model):
     # when this archive's records where deleted (if any)
     deleted_on = models.DateTimeField(null=True)
 
+    # whether this archive has a sidecar index file and is written as independently compressed blocks
+    has_index = models.BooleanField(db_default=False)
+
     @classmethod
     def storage(cls):
         return storages["archives"]
@@ -78,6 +96,13 @@ class Archive(models.Model):
         """
         return s3.split_url(self.url)
 
+    def get_index_location(self) -> tuple:
+        """
+        Returns a tuple of the storage bucket and key of this archive's sidecar index file
+        """
+        bucket, key = self.get_storage_location()
+        return bucket, key.replace(".jsonl.gz", ".index.json.gz")
+
     def get_end_date(self):
         """
         Gets the date this archive ends non-inclusive
@@ -90,7 +115,8 @@ class Archive(models.Model):
     @classmethod
     def delete_for_org(cls, org):
         """
-        Deletes all the archives for an org and any additional archive files in storage.
+        Deletes all the archives for an org and any additional archive files in storage. Deleting each archive also
+        removes it from this host's archive cache.
         """
 
         for archive in Archive.objects.filter(org=org):
@@ -154,11 +180,19 @@ class Archive(models.Model):
 
     @classmethod
     def iter_all_records(
-        cls, org, archive_type: str, after: datetime = None, before: datetime = None, where: dict = None
+        cls,
+        org,
+        archive_type: str,
+        after: datetime = None,
+        before: datetime = None,
+        where: dict = None,
+        prefetch: int = None,
     ):
         """
-        Creates a record iterator across archives of the given type for records which match the given criteria
+        Creates a record iterator across archives of the given type for records which match the given criteria. Records
+        are returned in archive order but up to `prefetch` archives are read ahead concurrently.
         """
+        prefetch = cls.PREFETCH if prefetch is None else prefetch
 
         if not where:
             where = {}
@@ -169,6 +203,9 @@ class Archive(models.Model):
 
         archives = cls._get_covering_period(org, archive_type, after, before)
 
+        if prefetch > 1:
+            return iter(PrefetchingReader(archives, where=where, prefetch=prefetch))
+
         def generator():
             for archive in archives:
                 for record in archive.iter_records(where=where):
@@ -183,7 +220,10 @@ class Archive(models.Model):
 
         s3_client = s3.client()
 
-        if where:
+        if where and self.has_index and "__raw__" not in where:
+            return self._iter_indexed(where)
+
+        elif where:
             bucket, key = self.get_storage_location()
             response = s3_client.select_object_content(
                 Bucket=bucket,
@@ -201,46 +241,232 @@ class Archive(models.Model):
             return generator()
 
         else:
-            bucket, key = self.get_storage_location()
-            s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
-            return jsonlgz_iterate(s3_obj["Body"])
 
-    def rewrite(self, transform, delete_old=False):
-        s3_client = s3.client()
+            def generator():
+                # close the file once iteration ends, whether that's because it's finished or the generator is closed
+                with closing(self._open()) as f:
+                    yield from jsonlgz_iterate(f)
+
+            return generator()
+
+    def _iter_indexed(self, where: dict):
+        """
+        Iterates over the records matching the given conditions by only reading the blocks which the index says might
+        contain matches, using ranged reads
+        """
         bucket, key = self.get_storage_location()
+        index_bucket, index_key = self.get_index_location()
+        s3_client = s3.client()
+        cache = get_archive_cache()
+
+        index_obj = s3_client.get_object(Bucket=index_bucket, Key=index_key)
+        index = ArchiveIndex.from_json(json.loads(gzip.decompress(index_obj["Body"].read())))
+
+        def generator():
+            local_file = cache.open(self) if cache else None
+            try:
+                for start, end in index.get_ranges(where):
+                    if local_file:
+                        data = local_file[start:end]
+                    else:
+                        s3_obj = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+                        data = s3_obj["Body"].read()
+
+                    for line in gzip.decompress(data).splitlines():
+                        record = json.loads(line.decode("utf-8"))
+                        if match_record(record, where):
+                            yield record
+            finally:
+                if local_file:
+                    local_file.close()
 
-        s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
-        old_file = s3_obj["Body"]
+        return generator()
 
-        new_file = tempfile.TemporaryFile()
-        new_hash, new_size = jsonlgz_rewrite(old_file, new_file, transform)
+    def _open(self):
+        """
+        Opens this archive's file for reading, from the local archive cache if one is configured
+        """
+        cache = get_archive_cache()
+        if cache:
+            return cache.open(self)
 
-        new_file.seek(0)
+        bucket, key = self.get_storage_location()
+        s3_obj = s3.client().get_object(Bucket=bucket, Key=key)
+        return s3_obj["Body"]
 
+    def rewrite(self, transform, delete_old=False):
+        """
+        Rewrites this archive using the given transform function. The file is streamed from storage, transformed,
+        recompressed and uploaded in parts as it's written, so memory use is bounded regardless of archive size.
+        """
+        s3_client = s3.client()
+        bucket, key = self.get_storage_location()
         match = KEY_PATTERN.match(key)
+        cache = get_archive_cache()
+
+        old_hash = self.hash
+        old_file = self._open()
+        old_index_key = self.get_index_location()[1] if self.has_index else None
+
+        # we don't know the new hash until we've written the file, so large files are uploaded to a temporary key
+        # derived from the old hash, which a retry of the same rewrite will overwrite
+        temp_key = f"{self.org.id}/{match.group('type')}_{match.group('period')}_{self.hash}.rewrite"
+        upload = s3.MultipartUpload(
+            s3_client,
+            bucket,
+            temp_key,
+            part_size=self.REWRITE_PART_SIZE,
+            ContentType="application/json",
+            ContentEncoding="gzip",
+            ACL="private",
+        )
+        cache_file = cache.temp_file() if cache else None
+
+        new_index = ArchiveIndex()
+        try:
+            new_hash, new_size = jsonlgz_rewrite(
+                old_file,
+                [upload, cache_file] if cache_file else [upload],
+                transform,
+                index=new_index,
+                block_size=self.INDEX_BLOCK_SIZE,
+            )
+            if upload.is_multipart:
+                upload.complete()
+        except Exception:
+            upload.abort()
+            if cache_file:
+                cache_file.close()
+                os.remove(cache_file.name)
+            raise
+        finally:
+            old_file.close()
+
         new_key = f"{self.org.id}/{match.group('type')}_{match.group('period')}_{new_hash.hexdigest()}.jsonl.gz"
         new_url = f"https://{bucket}.s3.amazonaws.com/{new_key}"
         new_hash_base64 = base64.standard_b64encode(new_hash.digest()).decode()
 
+        # write the index first so that the archive is never visible without it
         s3_client.put_object(
             Bucket=bucket,
-            Key=new_key,
-            Body=new_file,
+            Key=new_key.replace(".jsonl.gz", ".index.json.gz"),
+            Body=gzip.compress(json.dumps(new_index.as_json()).encode("utf-8")),
             ContentType="application/json",
             ContentEncoding="gzip",
             ACL="private",
-            ContentMD5=new_hash_base64,
-            Metadata={"md5chksum": new_hash_base64},
         )
 
+        if upload.is_multipart:
+            s3_client.copy(
+                {"Bucket": bucket, "Key": temp_key},
+                bucket,
+                new_key,
+                ExtraArgs={
+                    "ContentType": "application/json",
+                    "ContentEncoding": "gzip",
+                    "ACL": "private",
+                    "Metadata": {"md5chksum": new_hash_base64},
+                    "MetadataDirective": "REPLACE",
+                },
+            )
+            s3_client.delete_object(Bucket=bucket, Key=temp_key)
+        else:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=new_key,
+                Body=upload.getvalue(),
+                ContentType="application/json",
+                ContentEncoding="gzip",
+                ACL="private",
+                ContentMD5=new_hash_base64,
+                Metadata={"md5chksum": new_hash_base64},
+            )
+
         self.url = new_url
         self.hash = new_hash.hexdigest()
         self.size = new_size
-        self.save(update_fields=("url", "hash", "size"))
+        self.has_index = True
+        self.save(update_fields=("url", "hash", "size", "has_index"))
+
+        # the rewritten file is likely to be read again so add it to the cache
+        if cache_file:
+            cache_file.close()
+            cache.add(self.hash, cache_file.name)
 
         if delete_old:
             s3_client.delete_object(Bucket=bucket, Key=key)
 
+            if old_index_key:
+                s3_client.delete_object(Bucket=bucket, Key=old_index_key)
+
+            # the old file may contain records that the rewrite removed so don't leave it in the local cache either
+            if cache:
+                cache.remove(old_hash)
+
+    @classmethod
+    def rewrite_all(cls, archives, transform: str, *, job: str, delete_old: bool = False) -> int:
+        """
+        Rewrites the given archives in parallel by queueing a task for each one. The transform is given as the import
+        path of a function so that it can be passed to tasks. Progress is checkpointed under the given job name so
+        that calling this again for an interrupted job only queues archives which haven't been completed.
+        """
+        from .tasks import rewrite_archive
+
+        done = {int(i) for i, s in cls._get_rewrite_states(job).items() if s["status"] == "done"}
+        num_queued = 0
+
+        for archive in archives:
+            if archive.id not in done:
+                rewrite_archive.delay(archive.id, transform, job, delete_old)
+                num_queued += 1
+
+        return num_queued
+
+    def rewrite_for_job(self, transform, job: str, delete_old: bool = False) -> bool:
+        """
+        Rewrites this archive as part of the given job, returning false if that was already done. Before rewriting we
+        record which file we're rewriting from, so if we were interrupted after the new file was saved we can tell
+        from the changed hash and just finish cleaning up the old file.
+        """
+        r = get_redis_connection()
+        states_key = f"{self.REWRITE_JOB_KEY}:{job}"
+        state = self._get_rewrite_states(job).get(str(self.id))
+
+        if state and state["status"] == "done":
+            return False
+
+        if state and state["from"] != self.hash:
+            if delete_old:
+                s3_client = s3.client()
+                s3_client.delete_object(Bucket=state["bucket"], Key=state["key"])
+                if state["index_key"]:
+                    s3_client.delete_object(Bucket=state["bucket"], Key=state["index_key"])
+
+                cache = get_archive_cache()
+                if cache:
+                    cache.remove(state["from"])
+        else:
+            bucket, key = self.get_storage_location()
+            state = {
+                "status": "started",
+                "from": self.hash,
+                "bucket": bucket,
+                "key": key,
+                "index_key": self.get_index_location()[1] if self.has_index else None,
+            }
+            r.hset(states_key, str(self.id), json.dumps(state))
+            r.expire(states_key, self.REWRITE_JOB_EXPIRES)
+
+            self.rewrite(transform, delete_old=delete_old)
+
+        r.hset(states_key, str(self.id), json.dumps({**state, "status": "done"}))
+        return True
+
+    @classmethod
+    def _get_rewrite_states(cls, job: str) -> dict:
+        states = get_redis_connection().hgetall(f"{cls.REWRITE_JOB_KEY}:{job}")
+        return {k.decode(): json.loads(v) for k, v in states.items()}
+
     def delete(self):
         # detach us from our rollups
         Archive.objects.filter(rollup=self).update(rollup=None)
@@ -250,6 +476,14 @@ class Archive(models.Model):
             bucket, key = self.get_storage_location()
             s3.client().delete_object(Bucket=bucket, Key=key)
 
+            if self.has_index:
+                s3.client().delete_object(Bucket=bucket, Key=self.get_index_location()[1])
+
+            # and from this host's local cache
+            cache = get_archive_cache()
+            if cache:
+                cache.remove(self.hash)
+
         # and lastly delete ourselves
         super().delete()
 
@@ -257,6 +491,76 @@ class Archive(models.Model):
         unique_together = ("org", "archive_type", "start_date", "period")
 
 
+class PrefetchingReader:
+    """
+    Iterates over the records of a sequence of archives in order, with up to `prefetch` archives being downloaded,
+    decompressed and parsed concurrently by a pool of threads. Each archive being read ahead buffers at most
+    `buffer_size` batches of records so memory use is bounded regardless of archive sizes.
+    """
+
+    END = object()
+
+    def __init__(self, archives, *, where: dict = None, prefetch: int, batch_size: int = 1000, buffer_size: int = 4):
+        self.archives = archives
+        self.where = where
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+
+    def __iter__(self):
+        pending = iter(list(self.archives))
+        buffers = deque()
+        stop = threading.Event()
+
+        with ThreadPoolExecutor(max_workers=self.prefetch, thread_name_prefix="archive-reader") as executor:
+
+            def read_next():
+                archive = next(pending, None)
+                if archive:
+                    buffer = queue.Queue(maxsize=self.buffer_size)
+                    executor.submit(self._read, archive, buffer, stop)
+                    buffers.append(buffer)
+
+            try:
+                for _ in range(self.prefetch):
+                    read_next()
+
+                while buffers:
+                    buffer = buffers.popleft()
+
+                    while (batch := buffer.get()) is not self.END:
+                        if isinstance(batch, Exception):
+                            raise batch
+
+                        yield from batch
+
+                    read_next()
+            finally:
+                # if iteration is abandoned early, signal the readers to give up
+                stop.set()
+
+    def _read(self, archive, buffer, stop):
+        try:
+            for batch in chunk_list(archive.iter_records(where=self.where), self.batch_size):
+                if not self._put(buffer, batch, stop):
+                    return
+
+            self._put(buffer, self.END, stop)
+        except Exception as e:
+            self._put(buffer, e, stop)
+
+    @staticmethod
+    def _put(buffer, item, stop) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:  # pragma: no cover
+                pass
+
+        return False
+
+
 def jsonlgz_iterate(in_file):
     """
     Iterates over a records in a gzipped JSONL stream
@@ -271,20 +575,35 @@ def jsonlgz_iterate(in_file):
     return generator()
 
 
-def jsonlgz_rewrite(in_file, out_file, transform) -> tuple:
+def jsonlgz_rewrite(in_file, out_files, transform, *, index=None, block_size: int = 1000) -> tuple:
     """
-    Rewrites a stream of gzipped JSONL using a transformation function and returns the new MD5 hash and size
+    Rewrites a stream of gzipped JSONL to one or more output streams using a transformation function and returns the
+    new MD5 hash and size. Records are written in blocks which are separate gzip members, and if an index is provided,
+    those blocks are added to it.
     """
-    out_wrapped = FileAndHash(out_file)
-    out_stream = gzip.GzipFile(fileobj=out_wrapped, mode="w")
+    out_wrapped = FileAndHash(*(out_files if isinstance(out_files, (list, tuple)) else (out_files,)))
+
+    def transformed():
+        for record in jsonlgz_iterate(in_file):
+            record = transform(record)
+            if record is not None:
+                yield record
 
-    for record in jsonlgz_iterate(in_file):
-        record = transform(record)
-        if record is not None:
-            new_line = (json.dumps(record) + "\n").encode("utf-8")
-            out_stream.write(new_line)
+    for block in chunk_list(transformed(), block_size):
+        offset = out_wrapped.size
+        out_stream = gzip.GzipFile(fileobj=out_wrapped, mode="w")
 
-    out_stream.close()
+        for record in block:
+            out_stream.write((json.dumps(record) + "\n").encode("utf-8"))
+
+        out_stream.close()
+
+        if index is not None:
+            index.add_block(offset, out_wrapped.size - offset, block)
+
+    # if no records remain, still write a valid (empty) gzip file
+    if out_wrapped.size == 0:
+        gzip.GzipFile(fileobj=out_wrapped, mode="w").close()
 
     return out_wrapped.hash, out_wrapped.size
 
@@ -302,23 +621,133 @@ def jsonlgz_encode(records: list) -> tuple:
     return stream, wrapper.hash.hexdigest(), wrapper.size
 
 
+class ArchiveIndex:
+    """
+    Columnar index of the blocks of an archive file, where each block is an independently compressed gzip member. For
+    each block we record its offset and length, its range of created_on values, and the distinct values of the fields
+    that exports filter on, so that readers can skip blocks which can't contain matching records.
+    """
+
+    VALUE_COLUMNS = {
+        "visibility": ("visibility",),
+        "direction": ("direction",),
+        "status": ("status",),
+        "contact__uuid": ("contact", "uuid"),
+    }
+
+    def __init__(self, columns: dict = None):
+        self.columns = columns or {
+            "offset": [],
+            "length": [],
+            "records": [],
+            "created_on": [],
+            "labels": [],
+            **{c: [] for c in self.VALUE_COLUMNS},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["columns"])
+
+    def as_json(self) -> dict:
+        return {"version": 1, "columns": self.columns}
+
+    def add_block(self, offset: int, length: int, records: list):
+        created_ons = sorted(iso8601.parse_date(r["created_on"]) for r in records if r.get("created_on"))
+
+        self.columns["offset"].append(offset)
+        self.columns["length"].append(length)
+        self.columns["records"].append(len(records))
+        self.columns["created_on"].append(
+            [created_ons[0].isoformat(), created_ons[-1].isoformat()] if created_ons else None
+        )
+        self.columns["labels"].append(sorted({lb["uuid"] for r in records for lb in r.get("labels") or []}))
+
+        for column, path in self.VALUE_COLUMNS.items():
+            values = set()
+            for record in records:
+                value = record
+                for part in path:
+                    value = value.get(part) if isinstance(value, dict) else None
+                values.add(value)
+            self.columns[column].append(sorted(values, key=lambda v: (v is not None, v)))
+
+    def get_ranges(self, where: dict) -> list:
+        """
+        Gets the byte ranges (start inclusive, end exclusive) of blocks which might contain records matching the given
+        conditions, with adjacent blocks merged into single ranges
+        """
+        ranges = []
+
+        for i, (offset, length) in enumerate(zip(self.columns["offset"], self.columns["length"])):
+            if not self._block_may_match(i, where):
+                continue
+
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], offset + length)
+            else:
+                ranges.append((offset, offset + length))
+
+        return ranges
+
+    def _block_may_match(self, i: int, where: dict) -> bool:
+        for field, val in where.items():
+            lookup = "eq"
+            if "__" in field and field.rsplit("__", 1)[1] in LOOKUPS:
+                field, lookup = field.rsplit("__", 1)
+
+            if field in self.VALUE_COLUMNS:
+                values = set(self.columns[field][i])
+
+                if lookup == "eq" and val not in values:
+                    return False
+                elif lookup == "in" and not values.intersection(val):
+                    return False
+                elif lookup == "ne" and not (values - {val, None}):
+                    return False
+
+            elif field == "labels__uuid" and lookup == "contains":
+                if val not in self.columns["labels"][i]:
+                    return False
+
+            elif field == "created_on" and isinstance(val, datetime):
+                if self.columns["created_on"][i] is None:
+                    return False
+
+                earliest, latest = (iso8601.parse_date(d) for d in self.columns["created_on"][i])
+
+                if (
+                    (lookup == "gt" and latest <= val)
+                    or (lookup == "gte" and latest < val)
+                    or (lookup == "lt" and earliest >= val)
+                    or (lookup == "lte" and earliest > val)
+                    or (lookup == "eq" and not (earliest <= val <= latest))
+                ):
+                    return False
+
+        return True
+
+
 class FileAndHash:
     """
-    Stream which writes to both a child stream and a MD5 hash
+    Stream which writes to one or more child streams and a MD5 hash
     """
 
-    def __init__(self, f):
-        self.f = f
+    def __init__(self, *files):
+        self.files = files
         self.hash = hashlib.md5()
         self.size = 0
 
     def write(self, data):
-        self.f.write(data)
+        for f in self.files:
+            f.write(data)
         self.hash.update(data)
         self.size += len(data)
 
     def flush(self):  # pragma: no cover
-        self.f.flush()
+        for f in self.files:
+            f.flush()
 
     def close(self):  # pragma: no cover
-        self.f.close()
+        for f in self.files:
+            f.close()
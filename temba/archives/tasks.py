@@ -0,0 +1,40 @@
+from celery import shared_task
+from django_redis import get_redis_connection
+
+from django.utils.module_loading import import_string
+
+from temba.utils import analytics
+from temba.utils.crons import cron_task
+
+from .cache import ArchiveCache
+from .models import Archive
+
+REWRITE_LOCK_TIMEOUT = 60 * 60
+
+
+@shared_task
+def rewrite_archive(archive_id: int, transform: str, job: str, delete_old: bool):
+    """
+    Rewrites a single archive as part of a rewrite job
+    """
+    with get_redis_connection().lock(f"archive-rewrite-lock:{archive_id}", timeout=REWRITE_LOCK_TIMEOUT):
+        archive = Archive.objects.select_related("org").get(id=archive_id)
+        archive.rewrite_for_job(import_string(transform), job, delete_old=delete_old)
+
+
+@cron_task()
+def report_archive_cache():
+    """
+    Reports the hit rate of the local archive caches and the bytes they've saved downloading since the last report
+    """
+
+    stats = ArchiveCache.pop_stats()
+
+    analytics.gauges(
+        {
+            "temba.archive_cache_hit_rate": stats["hit_rate"],
+            "temba.archive_cache_bytes_saved": stats["bytes_saved"],
+        }
+    )
+
+    return stats
@@ -2,14 +2,22 @@ import base64
 import gzip
 import hashlib
 import io
+import os
+import tempfile
 from datetime import date, datetime, timezone as tzone
+from unittest.mock import patch
 
+from django_redis import get_redis_connection
+
+from django.test import override_settings
 from django.urls import reverse
 
 from temba.tests import CRUDLTestMixin, TembaTest
-from temba.utils import s3
+from temba.utils import json, s3
 
-from .models import Archive, jsonlgz_rewrite
+from .cache import ArchiveCache
+from .models import Archive, ArchiveIndex, PrefetchingReader, jsonlgz_rewrite
+from .tasks import report_archive_cache
 
 
 class ArchiveTest(TembaTest):
@@ -156,6 +164,233 @@ class ArchiveTest(TembaTest):
             [4, 5],
         )
 
+        # same records in same order whether archives are read sequentially or prefetched
+        for prefetch in (0, 1, 2, 5):
+            assert_records(Archive.iter_all_records(self.org, Archive.TYPE_MSG, prefetch=prefetch), [1, 2, 3, 4, 5, 6])
+
+    def test_prefetching_reader(self):
+        archives = [
+            self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, d), [{"id": d * 100 + i} for i in range(d * 3)])
+            for d in range(1, 8)
+        ]
+        expected = [d * 100 + i for d in range(1, 8) for i in range(d * 3)]
+
+        reader = PrefetchingReader(archives, prefetch=3, batch_size=2, buffer_size=1)
+        self.assertEqual(expected, [r["id"] for r in reader])
+
+        reader = PrefetchingReader(archives, where={"id__gt": 600}, prefetch=2, batch_size=4)
+        self.assertEqual([i for i in expected if i > 600], [r["id"] for r in reader])
+
+        # iteration can be abandoned early
+        records = iter(PrefetchingReader(archives, prefetch=3, batch_size=2, buffer_size=1))
+        self.assertEqual([100, 101, 102], [next(records)["id"] for i in range(3)])
+        records.close()
+
+        # errors reading archives are raised in order
+        orig_iter_records = Archive.iter_records
+
+        def iter_records(archive, *, where=None):
+            if archive.start_date == date(2020, 8, 3):
+                raise ValueError("boom")
+            return orig_iter_records(archive, where=where)
+
+        with patch.object(Archive, "iter_records", iter_records):
+            records = iter(PrefetchingReader(archives, prefetch=3))
+
+            self.assertEqual(3 + 6, len([next(records) for i in range(9)]))
+
+            with self.assertRaises(ValueError):
+                next(records)
+
+    def test_index(self):
+        def msg(id, day, direction, visibility, contact, labels=()):
+            return {
+                "id": id,
+                "created_on": f"2020-08-{day:02}T10:00:00Z",
+                "direction": direction,
+                "visibility": visibility,
+                "status": "handled" if direction == "in" else "sent",
+                "contact": {"uuid": contact, "name": "Bob"},
+                "labels": [{"uuid": lb, "name": "Label"} for lb in labels],
+            }
+
+        archive = self.create_archive(
+            Archive.TYPE_MSG,
+            "M",
+            date(2020, 8, 1),
+            [
+                msg(1, 1, "in", "visible", "C1", ["L1"]),
+                msg(2, 1, "out", "visible", "C1"),
+                msg(3, 2, "in", "archived", "C2"),
+                msg(4, 3, "in", "visible", "C2", ["L2"]),
+                msg(5, 4, "out", "visible", "C3"),
+                msg(6, 5, "out", "visible", "C3"),
+                msg(7, 6, "in", "visible", "C1", ["L1", "L2"]),
+            ],
+        )
+        self.assertFalse(archive.has_index)
+
+        # rewriting an archive writes it as independently compressed blocks with a sidecar index
+        with patch.object(Archive, "INDEX_BLOCK_SIZE", 2):
+            archive.rewrite(lambda r: r, delete_old=True)
+
+        self.assertTrue(archive.has_index)
+        archive.refresh_from_db()
+        self.assertTrue(archive.has_index)
+
+        bucket, index_key = archive.get_index_location()
+        self.assertEqual(f"{self.org.id}/message_M20200801_{archive.hash}.index.json.gz", index_key)
+
+        index_obj = s3.client().get_object(Bucket=bucket, Key=index_key)
+        index = ArchiveIndex.from_json(json.loads(gzip.decompress(index_obj["Body"].read())))
+
+        self.assertEqual([2, 2, 2, 1], index.columns["records"])
+        self.assertEqual([["in", "out"], ["in"], ["out"], ["in"]], index.columns["direction"])
+        self.assertEqual([["L1"], ["L2"], [], ["L1", "L2"]], index.columns["labels"])
+        self.assertEqual(["2020-08-01T10:00:00+00:00", "2020-08-01T10:00:00+00:00"], index.columns["created_on"][0])
+
+        # the whole file is still a valid gzipped JSONL stream
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7], [r["id"] for r in archive.iter_records()])
+
+        def assert_matches(where, ids, num_ranges):
+            self.s3_calls = []
+
+            self.assertEqual(ids, [r["id"] for r in archive.iter_records(where=where)])
+            self.assertEqual(
+                ["GetObject"] + ["GetObject"] * num_ranges, [c[0] for c in self.s3_calls]
+            )  # index then block ranges
+            self.assertEqual(num_ranges, len([c for c in self.s3_calls if "Range" in c[1]]))
+
+        assert_matches({"direction": "in", "visibility": "visible"}, [1, 4, 7], 2)  # blocks 0-1 merged, block 3
+        assert_matches({"labels__uuid__contains": "L2"}, [4, 7], 2)
+        assert_matches({"direction": "out", "contact__uuid": "C3"}, [5, 6], 1)
+        assert_matches({"status__in": ("sent",), "direction__ne": "in"}, [2, 5, 6], 2)
+        assert_matches({"created_on__gte": datetime(2020, 8, 4, 0, 0, 0, 0, tzone.utc)}, [5, 6, 7], 1)
+        assert_matches({"created_on__lt": datetime(2020, 8, 2, 0, 0, 0, 0, tzone.utc)}, [1, 2], 1)
+        assert_matches({"contact__uuid": "C4"}, [], 0)
+
+        # raw conditions can't use the index
+        self.s3_calls = []
+        self.assertEqual([3], [r["id"] for r in archive.iter_records(where={"__raw__": "s.id = 3"})])
+        self.assertEqual(["SelectObjectContent"], [c[0] for c in self.s3_calls])
+
+        # deleting the archive deletes its index too
+        self.s3_calls = []
+        archive.delete()
+
+        self.assertEqual(
+            [("DeleteObject", archive.get_storage_location()[1]), ("DeleteObject", index_key)],
+            [(c[0], c[1]["Key"]) for c in self.s3_calls],
+        )
+
+    def test_cache(self):
+        archive1 = self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 1), [{"id": 1}, {"id": 2}])
+        archive2 = self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 2), [{"id": 3}, {"id": 4}])
+
+        def get_object_calls():
+            return len([c for c in self.s3_calls if c[0] == "GetObject"])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(ARCHIVE_CACHE_DIR=cache_dir, ARCHIVE_CACHE_SIZE=archive1.size + archive2.size):
+                self.assertEqual([{"id": 1}, {"id": 2}], list(archive1.iter_records()))
+                self.assertEqual(1, get_object_calls())
+
+                # second read comes from the cache
+                self.assertEqual([{"id": 1}, {"id": 2}], list(archive1.iter_records()))
+                self.assertEqual(1, get_object_calls())
+                self.assertEqual({f"{archive1.hash}.jsonl.gz"}, set(os.listdir(cache_dir)))
+
+                self.assertEqual([{"id": 3}, {"id": 4}], list(archive2.iter_records()))
+                self.assertEqual(2, get_object_calls())
+                with patch("temba.utils.analytics.gauges") as mock_gauges:
+                    self.assertEqual(
+                        {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "bytes_saved": archive1.size},
+                        report_archive_cache(),
+                    )
+
+                mock_gauges.assert_called_once_with(
+                    {"temba.archive_cache_hit_rate": 1 / 3, "temba.archive_cache_bytes_saved": archive1.size}
+                )
+
+                # reporting resets the stats
+                self.assertEqual({"hits": 0, "misses": 0, "hit_rate": 0.0, "bytes_saved": 0}, ArchiveCache.pop_stats())
+
+                # rewriting reads the old file from the cache, and caches the new file, evicting the least recently
+                # used file to stay within the size budget
+                os.utime(os.path.join(cache_dir, f"{archive2.hash}.jsonl.gz"), (0, 0))
+
+                old_hash = archive1.hash
+                archive1.rewrite(lambda r: r if r["id"] != 1 else None)
+
+                self.assertEqual(2, get_object_calls())
+                self.assertEqual({f"{old_hash}.jsonl.gz", f"{archive1.hash}.jsonl.gz"}, set(os.listdir(cache_dir)))
+
+                self.assertEqual([{"id": 2}], list(archive1.iter_records()))
+                self.assertEqual(2, get_object_calls())
+
+                # files opened from the cache are closed once iteration ends, even if that's early
+                opened = []
+                cache_open = ArchiveCache.open
+
+                def track_open(cache, archive):
+                    opened.append(cache_open(cache, archive))
+                    return opened[-1]
+
+                with patch.object(ArchiveCache, "open", track_open):
+                    list(archive1.iter_records())
+
+                    records = archive2.iter_records()
+                    next(records)
+                    records.close()
+
+                self.assertEqual(2, len(opened))
+                self.assertTrue(all(f.closed for f in opened))
+
+                # rewriting with delete_old also removes the old file from the cache
+                old_hash = archive1.hash
+                self.assertIn(f"{old_hash}.jsonl.gz", os.listdir(cache_dir))
+
+                archive1.rewrite(lambda r: {**r, "redacted": True}, delete_old=True)
+
+                self.assertNotIn(f"{old_hash}.jsonl.gz", os.listdir(cache_dir))
+                self.assertIn(f"{archive1.hash}.jsonl.gz", os.listdir(cache_dir))
+                self.assertEqual([{"id": 2, "redacted": True}], list(archive1.iter_records()))
+
+                # a file evicted by another process between being found and opened is just downloaded again
+                opened_paths = []
+
+                def open_once_evicted(path, mode):
+                    opened_paths.append(path)
+                    if len(opened_paths) == 1:
+                        os.remove(path)
+                        raise FileNotFoundError(path)
+                    return open(path, mode)
+
+                num_get_object_calls = get_object_calls()
+
+                with patch("temba.archives.cache.open", side_effect=open_once_evicted, create=True):
+                    self.assertEqual([{"id": 2, "redacted": True}], list(archive1.iter_records()))
+
+                self.assertEqual(2, len(opened_paths))
+                self.assertEqual(num_get_object_calls + 1, get_object_calls())
+                self.assertIn(f"{archive1.hash}.jsonl.gz", os.listdir(cache_dir))
+
+                # files which haven't been used within the max age are evicted when another file is added
+                os.utime(os.path.join(cache_dir, f"{archive1.hash}.jsonl.gz"), (0, 0))
+                cache = ArchiveCache(cache_dir, archive1.size + archive2.size, max_age=60)
+                cache.put("abc123", io.BytesIO(b"test"))
+
+                self.assertNotIn(f"{archive1.hash}.jsonl.gz", os.listdir(cache_dir))
+                self.assertIn("abc123.jsonl.gz", os.listdir(cache_dir))
+
+                # deleting an archive removes it from the cache
+                list(archive2.iter_records())
+                self.assertIn(f"{archive2.hash}.jsonl.gz", os.listdir(cache_dir))
+
+                archive2.delete()
+
+                self.assertNotIn(f"{archive2.hash}.jsonl.gz", os.listdir(cache_dir))
+
     def test_end_date(self):
         daily = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2018, 2, 1), [], needs_deletion=True)
         monthly = self.create_archive(Archive.TYPE_FLOWRUN, "M", date(2018, 1, 1), [])
@@ -202,6 +437,120 @@ class ArchiveTest(TembaTest):
         self.assertEqual("DeleteObject", self.s3_calls[-1][0])
         self.assertEqual("test-archives", self.s3_calls[-1][1]["Bucket"])
 
+    def test_rewrite_multipart(self):
+        # records of incompressible data which will compress to more than one part
+        records = [{"id": i, "data": base64.b64encode(os.urandom(2_000_000)).decode()} for i in range(1, 6)]
+        archive = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 1), records)
+        bucket, key = archive.get_storage_location()
+        old_hash = archive.hash
+
+        self.s3_calls = []
+
+        with patch.object(Archive, "REWRITE_PART_SIZE", 5 * 1024 * 1024):
+            archive.rewrite(lambda r: r if r["id"] != 3 else None, delete_old=True)
+
+        temp_key = f"{self.org.id}/run_D20200801_{old_hash}.rewrite"
+        calls = [c[0] for c in self.s3_calls]
+
+        self.assertEqual("CreateMultipartUpload", calls[1])
+        self.assertEqual(temp_key, self.s3_calls[1][1]["Key"])
+        self.assertEqual(2, calls.count("UploadPart"))
+        self.assertIn("CompleteMultipartUpload", calls)
+        self.assertIn("CopyObject", calls)
+        self.assertNotIn("AbortMultipartUpload", calls)
+
+        hash_b64 = base64.standard_b64encode(bytes.fromhex(archive.hash)).decode()
+        new_obj = s3.client().head_object(Bucket=bucket, Key=archive.get_storage_location()[1])
+        self.assertEqual({"md5chksum": hash_b64}, new_obj["Metadata"])
+        self.assertEqual(archive.size, new_obj["ContentLength"])
+
+        # temp file and old file have been deleted
+        keys = [o["Key"] for o in s3.client().list_objects_v2(Bucket=bucket, Prefix=f"{self.org.id}/")["Contents"]]
+        self.assertNotIn(temp_key, keys)
+        self.assertNotIn(key, keys)
+
+        self.assertEqual([1, 2, 4, 5], [r["id"] for r in archive.iter_records()])
+        self.assertEqual(records[4], list(archive.iter_records())[3])
+
+        # if the transform fails, the multipart upload is aborted
+        self.s3_calls = []
+
+        def fail_on_5(record):
+            if record["id"] == 5:
+                raise ValueError("boom")
+            return record
+
+        with patch.object(Archive, "REWRITE_PART_SIZE", 5 * 1024 * 1024):
+            with self.assertRaises(ValueError):
+                archive.rewrite(fail_on_5)
+
+        self.assertEqual("AbortMultipartUpload", self.s3_calls[-1][0])
+        self.assertEqual([1, 2, 4, 5], [r["id"] for r in archive.iter_records()])
+
+    def test_rewrite_all(self):
+        def bob_and_jim(day):
+            return [
+                {"id": 1, "created_on": f"2020-08-{day:02}T09:00:00Z", "contact": {"name": "Bob"}},
+                {"id": 2, "created_on": f"2020-08-{day:02}T10:00:00Z", "contact": {"name": "Jim"}},
+            ]
+
+        archive1 = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 1), bob_and_jim(1))
+        archive2 = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 2), bob_and_jim(2))
+        archive3 = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 3), bob_and_jim(3))
+        archive1_key = archive1.get_storage_location()[1]
+        archive2_hash = archive2.hash
+
+        # archive 2 was completed by an earlier run of this job
+        r = get_redis_connection()
+        r.hset("archive_rewrite:purge-jim", str(archive2.id), json.dumps({"status": "done", "from": "123"}))
+
+        # archive 3 was rewritten by an earlier run which was interrupted before it could delete the old file
+        archive3_bucket, archive3_key = archive3.get_storage_location()
+        r.hset(
+            "archive_rewrite:purge-jim",
+            str(archive3.id),
+            json.dumps(
+                {
+                    "status": "started",
+                    "from": archive3.hash,
+                    "bucket": archive3_bucket,
+                    "key": archive3_key,
+                    "index_key": None,
+                }
+            ),
+        )
+        archive3.rewrite(purge_jim)
+
+        num_queued = Archive.rewrite_all(
+            Archive.objects.order_by("id"), "temba.archives.tests.purge_jim", job="purge-jim", delete_old=True
+        )
+        self.assertEqual(2, num_queued)
+
+        archive1.refresh_from_db()
+        archive2.refresh_from_db()
+        archive3.refresh_from_db()
+
+        self.assertEqual([1], [r["id"] for r in archive1.iter_records()])
+        self.assertEqual(archive2_hash, archive2.hash)  # not rewritten
+        self.assertEqual([1], [r["id"] for r in archive3.iter_records()])
+
+        keys = [o["Key"] for o in s3.client().list_objects_v2(Bucket=archive3_bucket)["Contents"]]
+        self.assertNotIn(archive1_key, keys)
+        self.assertNotIn(archive3_key, keys)
+        self.assertIn(archive3.get_storage_location()[1], keys)
+
+        states = Archive._get_rewrite_states("purge-jim")
+        self.assertEqual({"done"}, {s["status"] for s in states.values()})
+
+        # running the job again doesn't queue anything
+        self.assertEqual(
+            0, Archive.rewrite_all(Archive.objects.all(), "temba.archives.tests.purge_jim", job="purge-jim")
+        )
+
+
+def purge_jim(record):
+    return record if record["contact"]["name"] != "Jim" else None
+
 
 class ArchiveCRUDLTest(TembaTest, CRUDLTestMixin):
     def test_empty_list(self):
@@ -1,11 +1,10 @@
 from datetime import timedelta
 
-from django.conf import settings
 from django.utils import timezone
 
 from temba.campaigns.models import EventFire
 from temba.utils.crons import cron_task
-from temba.utils.models import delete_in_batches
+from temba.utils.models import RetentionPolicy, delete_in_batches
 
 
 @cron_task()
@@ -20,10 +19,13 @@ def trim_event_fires():
         EventFire.objects.filter(fired=None, event__is_active=False), post_delete=can_continue
     )
 
+    result = {"deleted": num_deleted, "bytes": 0}
+
     # secondly (if we have time left) delete any fired fires that are older than the retention period
     if can_continue():
-        trim_before = timezone.now() - settings.RETENTION_PERIODS["eventfire"]
+        retention = RetentionPolicy("eventfire", EventFire, "fired", inclusive=False, post_delete=can_continue)
+        trimmed = retention.apply()
 
-        num_deleted += delete_in_batches(EventFire.objects.filter(fired__lt=trim_before), post_delete=can_continue)
+        result = {**trimmed, "deleted": num_deleted + trimmed["deleted"]}
 
-    return {"deleted": num_deleted}
+    return result
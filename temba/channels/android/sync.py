@@ -1,7 +1,17 @@
+import time
+from collections import defaultdict
 from datetime import datetime, timezone as tzone
 
+from django_redis import get_redis_connection
+
 from temba.msgs.models import Msg
 
+OUTBOX_KEY = "android_outbox"
+OUTBOX_EXPIRES = 60 * 60 * 24
+OUTBOX_RESEND_INTERVAL = 60 * 5  # seconds between passes over the whole outbox
+OUTBOX_MAX_MSGS = 500  # max number of messages in a single sync payload
+OUTBOX_MAX_BYTES = 100_000  # max approximate size of the messages in a single sync payload
+
 
 def get_sync_commands(msgs):
     """
@@ -9,11 +19,15 @@ def get_sync_commands(msgs):
     messages which are being sent to tel URNs. This will return an array of dicts that look like:
             dict(cmd="mt_bcast", to=[dict(phone=msg.contact.tel, id=msg.pk) for msg in msgs], msg=broadcast.text))
     """
+    return _group_sync_commands(msgs.values("id", "text", "contact_urn__path").order_by("created_on"))
+
+
+def _group_sync_commands(rows) -> list[dict]:
     commands = []
     current_text = None
     contact_id_pairs = []
 
-    for m in msgs.values("id", "text", "contact_urn__path").order_by("created_on"):
+    for m in rows:
         if m["text"] != current_text and contact_id_pairs:
             commands.append(dict(cmd="mt_bcast", to=contact_id_pairs, msg=current_text))
             contact_id_pairs = []
@@ -29,47 +43,121 @@ def get_sync_commands(msgs):
 
 def get_channel_commands(channel, commands, sync_event=None):
     """
-    Generates sync commands for all queued messages on the given channel
+    Generates sync commands for queued messages on the given channel. Rather than every queued message being fetched on
+    every sync, a cursor of the last message sent to the channel is kept in redis so that a sync only fetches messages
+    queued since. Outboxes larger than the payload caps are paged across consecutive syncs, and a pass over the whole
+    outbox is started again periodically so that messages which are still queued get resent.
     """
-
-    msgs = Msg.objects.filter(status__in=Msg.STATUS_QUEUED, channel=channel, direction=Msg.DIRECTION_OUT)
-
+    r = get_redis_connection()
+    key = f"{OUTBOX_KEY}:{channel.id}"
+    now = time.time()
+
+    cursor = {k.decode(): v.decode() for k, v in r.hgetall(key).items()}
+    if cursor and (cursor["more"] == "1" or now - float(cursor["started_on"]) < OUTBOX_RESEND_INTERVAL):
+        last_id, started_on = int(cursor["last_id"]), float(cursor["started_on"])
+    else:
+        last_id, started_on = 0, now
+
+    rows = list(
+        Msg.objects.filter(status__in=Msg.STATUS_QUEUED, channel=channel, direction=Msg.DIRECTION_OUT, id__gt=last_id)
+        .values("id", "text", "contact_urn__path")
+        .order_by("id")[:OUTBOX_MAX_MSGS]
+    )
+    more = len(rows) == OUTBOX_MAX_MSGS
+
+    # cap the size of the payload, leaving the rest of this page for the next sync
+    size = 0
+    for i, row in enumerate(rows):
+        size += len(row["text"] or "") + len(row["contact_urn__path"] or "")
+        if size > OUTBOX_MAX_BYTES and i > 0:
+            rows, more = rows[:i], True
+            break
+
+    if rows:
+        last_id = rows[-1]["id"]
+
+    r.hset(key, mapping={"last_id": last_id, "started_on": started_on, "more": int(more)})
+    r.expire(key, OUTBOX_EXPIRES)
+
+    # don't include messages the device already has
     if sync_event:
-        pending_msgs = sync_event.get_pending_messages()
-        retry_msgs = sync_event.get_retry_messages()
-        msgs = msgs.exclude(id__in=pending_msgs).exclude(id__in=retry_msgs)
+        exclude = {*sync_event.get_pending_messages(), *sync_event.get_retry_messages()}
+        rows = [row for row in rows if row["id"] not in exclude]
 
-    commands += get_sync_commands(msgs=msgs)
+    commands += _group_sync_commands(rows)
 
     return commands
 
 
-def update_message(msg, cmd):
+def reset_channel_outbox(channel):
+    """
+    Resets the outbox cursor of the given channel so that its next sync starts a new pass over all queued messages
+    """
+    get_redis_connection().delete(f"{OUTBOX_KEY}:{channel.id}")
+
+
+def update_messages(org, cmds: list[dict]) -> list[bool]:
+    """
+    Updates messages according to the provided client commands, fetching all of the messages at once and saving them
+    with one update per status. Returns whether each command was handled.
+    """
+
+    def get_msg_id(cmd):
+        # make sure the negative ids are converted to long
+        return cmd["msg_id"] + 4294967296 if cmd["msg_id"] < 0 else cmd["msg_id"]
+
+    msgs = (
+        Msg.objects.filter(org=org).only("id", "direction", "status", "sent_on").in_bulk([get_msg_id(c) for c in cmds])
+    )
+
+    handled = []
+    updated = {}
+
+    for cmd in cmds:
+        msg = msgs.get(get_msg_id(cmd))
+        if not msg:
+            handled.append(False)
+        elif msg.direction != Msg.DIRECTION_OUT:
+            handled.append(True)
+        elif update_message(msg, cmd):
+            handled.append(True)
+            updated[msg.id] = msg
+        else:
+            handled.append(False)
+
+    by_status = defaultdict(list)
+    for msg in updated.values():
+        by_status[msg.status].append(msg)
+
+    for status_msgs in by_status.values():
+        Msg.objects.bulk_update(status_msgs, ("status", "sent_on"))
+
+    return handled
+
+
+def update_message(msg, cmd) -> bool:
     """
-    Updates a message according to the provided client command
+    Updates a message according to the provided client command, without saving it
     """
 
     date = datetime.fromtimestamp(int(cmd["ts"]) // 1000).replace(tzinfo=tzone.utc)
     keyword = cmd["cmd"]
-    handled = False
 
     if keyword == "mt_error":
         msg.status = Msg.STATUS_ERRORED
-        handled = True
 
     elif keyword == "mt_fail":
         msg.status = Msg.STATUS_FAILED
-        handled = True
 
     elif keyword == "mt_sent":
         msg.status = Msg.STATUS_SENT
         msg.sent_on = date
-        handled = True
 
     elif keyword == "mt_dlvd":
         msg.status = Msg.STATUS_DELIVERED
         msg.sent_on = msg.sent_on or date
-        handled = True
 
-    msg.save(update_fields=("status", "sent_on"))
-    return handled
+    else:
+        return False
+
+    return True
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.urls import reverse
 
 from temba.channels.models import Channel
@@ -5,7 +7,7 @@ from temba.msgs.models import Msg
 from temba.tests import TembaTest
 from temba.utils import json
 
-from .sync import get_sync_commands
+from .sync import get_channel_commands, get_sync_commands, reset_channel_outbox
 
 
 class AndroidTest(TembaTest):
@@ -93,3 +95,54 @@ class AndroidTest(TembaTest):
                 {"cmd": "mt_bcast", "to": [{"phone": "321", "id": msg5.id}], "msg": "Hello, we heard from you."},
             ],
         )
+
+    def test_get_channel_commands(self):
+        channel = self.create_channel("A", "Android", "+250785551212", secret="sesame", config={"FCM_ID": "123"})
+        joe = self.create_contact("Joe Blow", phone="123")
+        frank = self.create_contact("Frank Blow", phone="321")
+
+        def sent_ids():
+            return [pair["id"] for cmd in get_channel_commands(channel, []) for pair in cmd["to"]]
+
+        msg1 = self.create_outgoing_msg(joe, "Hello", channel=channel, status="Q")
+        msg2 = self.create_outgoing_msg(frank, "Hello", channel=channel, status="Q")
+        msg3 = self.create_outgoing_msg(frank, "Bye", channel=channel, status="Q")
+        self.create_outgoing_msg(frank, "Sent", channel=channel, status="S")
+
+        self.assertEqual([msg1.id, msg2.id, msg3.id], sent_ids())
+
+        # next sync only includes messages queued since
+        self.assertEqual([], sent_ids())
+
+        msg4 = self.create_outgoing_msg(joe, "Again", channel=channel, status="Q")
+
+        self.assertEqual([msg4.id], sent_ids())
+        self.assertEqual([], sent_ids())
+
+        # once the resend interval has passed, messages which are still queued are sent again
+        msg1.status = "S"
+        msg1.save(update_fields=("status",))
+
+        with patch("temba.channels.android.sync.OUTBOX_RESEND_INTERVAL", 0):
+            self.assertEqual([msg2.id, msg3.id, msg4.id], sent_ids())
+
+        # as they are after a reset
+        reset_channel_outbox(channel)
+        self.assertEqual([msg2.id, msg3.id, msg4.id], sent_ids())
+
+        # large outboxes are paged across syncs, and a new pass doesn't start until the last page is sent
+        reset_channel_outbox(channel)
+
+        with patch("temba.channels.android.sync.OUTBOX_MAX_MSGS", 2):
+            with patch("temba.channels.android.sync.OUTBOX_RESEND_INTERVAL", 0):
+                self.assertEqual([msg2.id, msg3.id], sent_ids())
+                self.assertEqual([msg4.id], sent_ids())
+                self.assertEqual([msg2.id, msg3.id], sent_ids())
+
+        reset_channel_outbox(channel)
+
+        with patch("temba.channels.android.sync.OUTBOX_MAX_BYTES", 10):
+            self.assertEqual([msg2.id], sent_ids())
+            self.assertEqual([msg3.id], sent_ids())
+            self.assertEqual([msg4.id], sent_ids())
+            self.assertEqual([], sent_ids())
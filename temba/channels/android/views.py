@@ -14,14 +14,13 @@ from django.views.decorators.csrf import csrf_exempt
 from temba import mailroom
 from temba.apks.models import Apk
 from temba.channels.models import ChannelEvent
-from temba.msgs.models import Msg
 from temba.notifications.incidents.builtin import ChannelOutdatedAppIncidentType
 from temba.notifications.models import Incident
 from temba.utils import analytics, json
 
 from ..models import Channel, SyncEvent
 from .claim import UnsupportedAndroidChannelError, get_or_create_channel
-from .sync import get_channel_commands, update_message
+from .sync import get_channel_commands, reset_channel_outbox, update_messages
 
 
 @csrf_exempt
@@ -111,79 +110,53 @@ def sync(request, channel_id):
     elif not channel.org:
         return JsonResponse({"error_id": 4, "error": "Can't sync unclaimed channel", "cmds": []}, status=401)
 
+    timings = {"temba.relayer_sync_auth": time.time() - start}
+    phase_start = time.time()
+
     # get latest app version to allow us to check if user's app is outdated
     latest_app = Apk.objects.filter(apk_type=Apk.TYPE_RELAYER).order_by("created_on").last()
     latest_app_version = latest_app.version if latest_app else None
 
+    results = {}  # index of each command which might be acked to whether it was handled and any extra ack data
+    status_cmds, msg_cmds, call_cmds = [], [], []
     unique_calls = set()
 
-    for cmd in cmds:
-        handled = False
-        extra = None
-
+    for i, cmd in enumerate(cmds):
         if "cmd" in cmd:
             keyword = cmd["cmd"]
 
-            # catchall for commands that deal with a single message
+            # catchall for commands that deal with a single message, which are all updated together below
             if "msg_id" in cmd:
-                # make sure the negative ids are converted to long
-                msg_id = cmd["msg_id"]
-                if msg_id < 0:
-                    msg_id = 4294967296 + msg_id
-
-                msg = Msg.objects.filter(id=msg_id, org=channel.org).first()
-                if msg:
-                    if msg.direction == Msg.DIRECTION_OUT:
-                        handled = update_message(msg, cmd)
-                    else:
-                        handled = True
+                status_cmds.append(i)
 
-            # creating a new message
+            # creating a new message, which are all sent to mailroom together below or before a reset
             elif keyword == "mo_sms":
-                text = cmd.get("msg")
-                date = datetime.fromtimestamp(int(cmd["ts"]) // 1000).replace(tzinfo=tzone.utc)
-                phone = cmd["phone"]
+                if cmd["phone"] and cmd.get("msg"):
+                    msg_cmds.append(i)
 
-                if phone and text:
-                    try:
-                        msg_id = mailroom.get_client().android_message(
-                            channel.org, channel, phone, text, received_on=date
-                        )
-                        extra = dict(msg_id=msg_id)
-                    except mailroom.URNValidationException:
-                        pass
-
-                handled = True
+                results[i] = (True, None)
 
             # phone event
             elif keyword == "call":
                 phone = cmd["phone"]
                 call_tuple = (cmd["ts"], cmd["type"], phone)
-                date = datetime.fromtimestamp(int(cmd["ts"]) // 1000).replace(tzinfo=tzone.utc)
-                duration = cmd.get("dur", 0)
 
                 # Android sometimes will pass us a call from an 'unknown number', which is null
                 # ignore these events on our side as they have no purpose and break a lot of our
                 # assumptions
                 if phone and call_tuple not in unique_calls and ChannelEvent.is_valid_type(cmd["type"]):
-                    try:
-                        mailroom.get_client().android_event(
-                            channel.org,
-                            channel,
-                            phone,
-                            cmd["type"],
-                            extra={"duration": duration},
-                            occurred_on=date,
-                        )
-                    except mailroom.URNValidationException:  # pragma: no cover
-                        pass
-
+                    call_cmds.append(i)
                     unique_calls.add(call_tuple)
-                handled = True
+
+                results[i] = (True, None)
 
             elif keyword == "fcm":
                 # update our fcm and uuid
 
+                # a new install of the app won't have any of the messages we've already sent
+                if channel.uuid != cmd.get("uuid", None):
+                    reset_channel_outbox(channel)
+
                 config = channel.config
                 config.update({Channel.CONFIG_FCM_ID: cmd["fcm_id"]})
                 channel.config = config
@@ -191,15 +164,19 @@ def sync(request, channel_id):
                 channel.save(update_fields=["uuid", "config"])
 
                 # no acking the fcm
-                handled = False
 
             elif keyword == "reset":
+                # handle the commands that came before the reset before the channel is released
+                _update_statuses(channel, cmds, status_cmds, results)
+                _send_to_mailroom(channel, cmds, msg_cmds, call_cmds, results)
+                status_cmds, msg_cmds, call_cmds = [], [], []
+
                 # release this channel
                 channel.release(channel.modified_by, trigger_sync=False)
                 channel.save()
 
                 # ack that things got handled
-                handled = True
+                results[i] = (True, None)
 
             elif keyword == "status":
                 sync_event = SyncEvent.create(channel, cmd, cmds)
@@ -219,9 +196,24 @@ def sync(request, channel_id):
                             incident.end()
 
                 # we don't ack status messages since they are always included
-                handled = False
 
-        # is this something we can ack?
+    timings["temba.relayer_sync_commands"] = time.time() - phase_start
+    phase_start = time.time()
+
+    _update_statuses(channel, cmds, status_cmds, results)
+
+    timings["temba.relayer_sync_statuses"] = time.time() - phase_start
+    phase_start = time.time()
+
+    _send_to_mailroom(channel, cmds, msg_cmds, call_cmds, results)
+
+    timings["temba.relayer_sync_mailroom"] = time.time() - phase_start
+    phase_start = time.time()
+
+    # ack the commands we handled
+    for i, cmd in enumerate(cmds):
+        handled, extra = results.get(i, (False, None))
+
         if "p_id" in cmd and handled:
             ack = dict(p_id=cmd["p_id"], cmd="ack")
             if extra:
@@ -236,7 +228,54 @@ def sync(request, channel_id):
         sync_event.outgoing_command_count = len([_ for _ in outgoing_cmds if _["cmd"] != "ack"])
         sync_event.save()
 
-    # keep track of how long a sync takes
-    analytics.gauges({"temba.relayer_sync": time.time() - start})
+    timings["temba.relayer_sync_outbox"] = time.time() - phase_start
+
+    # keep track of how long a sync takes, and how long each phase of it takes
+    analytics.gauges({"temba.relayer_sync": time.time() - start, **timings})
 
     return JsonResponse(result)
+
+
+def _update_statuses(channel, cmds: list, status_cmds: list, results: dict):
+    """
+    Updates the messages of the given status commands as a single batch
+    """
+    if status_cmds:
+        handled = update_messages(channel.org, [cmds[i] for i in status_cmds])
+        results.update({i: (h, None) for i, h in zip(status_cmds, handled)})
+
+
+def _send_to_mailroom(channel, cmds: list, msg_cmds: list, call_cmds: list, results: dict):
+    """
+    Sends the given incoming message and call commands to mailroom, each as a single batch
+    """
+    client = mailroom.get_client()
+
+    if msg_cmds:
+        msg_results = client.android_message_many(
+            channel.org,
+            channel,
+            [dict(phone=cmds[i]["phone"], text=cmds[i]["msg"], received_on=_get_cmd_date(cmds[i])) for i in msg_cmds],
+        )
+        for i, result in zip(msg_cmds, msg_results):
+            if not isinstance(result, mailroom.URNValidationException):
+                results[i] = (True, dict(msg_id=result))
+
+    if call_cmds:
+        client.android_event_many(
+            channel.org,
+            channel,
+            [
+                dict(
+                    phone=cmds[i]["phone"],
+                    event_type=cmds[i]["type"],
+                    extra={"duration": cmds[i].get("dur", 0)},
+                    occurred_on=_get_cmd_date(cmds[i]),
+                )
+                for i in call_cmds
+            ],
+        )
+
+
+def _get_cmd_date(cmd) -> datetime:
+    return datetime.fromtimestamp(int(cmd["ts"]) // 1000).replace(tzinfo=tzone.utc)
@@ -11,7 +11,7 @@ from temba import mailroom
 from temba.orgs.models import Org
 from temba.utils.analytics import track
 from temba.utils.crons import cron_task
-from temba.utils.models import delete_in_batches
+from temba.utils.models import RetentionPolicy
 
 from .models import Channel, ChannelCount, ChannelEvent, ChannelLog, SyncEvent
 from .types.android import AndroidType
@@ -60,11 +60,7 @@ def trim_channel_events():
     Trims old channel events
     """
 
-    trim_before = timezone.now() - settings.RETENTION_PERIODS["channelevent"]
-
-    num_deleted = delete_in_batches(ChannelEvent.objects.filter(created_on__lte=trim_before))
-
-    return {"deleted": num_deleted}
+    return RetentionPolicy("channelevent", ChannelEvent, "created_on").apply()
 
 
 @cron_task()
@@ -102,20 +98,17 @@ def trim_channel_logs():
     Trims old channel logs
     """
 
-    trim_before = timezone.now() - settings.RETENTION_PERIODS["channellog"]
     start = timezone.now()
 
     def can_continue():
         return (timezone.now() - start) < timedelta(hours=1)
 
-    num_deleted = delete_in_batches(ChannelLog.objects.filter(created_on__lte=trim_before), post_delete=can_continue)
-
-    return {"deleted": num_deleted}
+    return RetentionPolicy("channellog", ChannelLog, "created_on", post_delete=can_continue).apply()
 
 
 @cron_task(lock_timeout=7200)
 def squash_channel_counts():
-    ChannelCount.squash()
+    return {"ChannelCount": ChannelCount.schedule_squash()}
 
 
 @cron_task(lock_timeout=7200)
@@ -630,12 +630,33 @@ class ChannelTest(TembaTest, CRUDLTestMixin):
     def test_sync_client_reset(self, mr_mocks):
         android = self.claim_new_android()
 
-        response = self.sync(android, cmds=[{"cmd": "reset"}])
+        date = int(time.time() * 1000)
+        release = Channel.release
+        release_calls = []
+
+        def release_after_mailroom(channel, *args, **kwargs):
+            release_calls.append(len(mr_mocks.calls["android_message_many"]))
+            return release(channel, *args, **kwargs)
+
+        with patch.object(Channel, "release", release_after_mailroom):
+            response = self.sync(
+                android,
+                cmds=[
+                    {"cmd": "mo_sms", "phone": "+250788383383", "msg": "Before reset", "p_id": "1", "ts": date},
+                    {"cmd": "reset", "p_id": "2"},
+                ],
+            )
         self.assertEqual(200, response.status_code)
 
         android.refresh_from_db()
         self.assertFalse(android.is_active)
 
+        # the message that came before the reset was sent to mailroom before the channel was released
+        self.assertEqual([1], release_calls)
+        self.assertEqual(1, len(mr_mocks.calls["android_message_many"]))
+        self.assertTrue(Msg.objects.filter(channel=android, text="Before reset", direction="I").exists())
+        self.assertEqual({"1", "2"}, {c["p_id"] for c in response.json()["cmds"] if c["cmd"] == "ack"})
+
     def test_sync_broadcast_multiple_channels(self):
         channel2 = Channel.create(
             self.org,
@@ -830,6 +851,18 @@ class ChannelTest(TembaTest, CRUDLTestMixin):
         # We should have 3 channel event
         self.assertEqual(3, ChannelEvent.objects.filter(channel=self.tel_channel).count())
 
+        # incoming messages and call events were each sent to mailroom as a single batch
+        self.assertEqual(1, len(mr_mocks.calls["android_message_many"]))
+        self.assertEqual(2, len(mr_mocks.calls["android_message_many"][0].args[2]))
+        self.assertEqual(1, len(mr_mocks.calls["android_event_many"]))
+        self.assertEqual(4, len(mr_mocks.calls["android_event_many"][0].args[2]))
+
+        # and the acks for the incoming messages that were created include their ids
+        acks = {c["p_id"]: c for c in response.json()["cmds"] if c["cmd"] == "ack"}
+        self.assertEqual({"1", "2", "4"}, set(acks.keys()))
+        self.assertEqual(Msg.objects.get(text="This is giving me trouble").id, acks["1"]["extra"]["msg_id"]["id"])
+        self.assertNotIn("extra", acks["4"])
+
         # We should have an incident for the app version
         self.assertEqual(
             1,
@@ -1330,7 +1363,7 @@ class ChannelEventTest(TembaTest):
         )
 
         results = trim_channel_events()
-        self.assertEqual({"deleted": 1}, results)
+        self.assertEqual({"deleted": 1, "bytes": matchers.Int(min=0)}, results)
 
         # should only have one event remaining and should be e2
         self.assertEqual(1, ChannelEvent.objects.all().count())
@@ -1539,7 +1572,7 @@ class ChannelLogTest(TembaTest):
         )
 
         results = trim_channel_logs()
-        self.assertEqual({"deleted": 1}, results)
+        self.assertEqual({"deleted": 1, "bytes": matchers.Int(min=0)}, results)
 
         # should only have one log remaining and should be l2
         self.assertEqual(1, ChannelLog.objects.all().count())
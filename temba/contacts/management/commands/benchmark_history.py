@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from temba.contacts.models import Contact
+from temba.mailroom.events import get_event_time
+from temba.msgs.models import Msg
+
+HISTORY_TYPES = {"contact_field_changed", "contact_language_changed", "contact_name_changed", "contact_urns_changed"}
+
+
+class Command(BaseCommand):
+    help = "Benchmarks fetching pages of a contact's history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("contact_uuid", help="UUID of contact whose history will be fetched")
+        parser.add_argument("--limit", type=int, default=50, help="The number of items in each page")
+        parser.add_argument("--pages", type=int, default=10, help="The number of pages to fetch")
+        parser.add_argument("--seed", type=int, default=0, help="Create this many messages for the contact first")
+
+    def handle(self, contact_uuid: str, limit: int, pages: int, seed: int, *args, **kwargs):
+        contact = Contact.objects.filter(uuid=contact_uuid, is_active=True).select_related("org").first()
+        if not contact:
+            raise CommandError("no such contact")
+
+        if seed:
+            self._seed_msgs(contact, seed)
+
+        self.stdout.write(f"Fetching {pages} pages of {limit} history items for contact {contact.uuid}...")
+
+        before = timezone.now()
+        after = contact.created_on - timedelta(hours=1)
+        total_time, total_queries, total_items = 0.0, 0, 0
+
+        for page in range(pages):
+            start = time.perf_counter()
+
+            with CaptureQueriesContext(connection) as queries:
+                history = contact.get_history(after, before, HISTORY_TYPES, ticket=None, limit=limit)
+
+            elapsed = time.perf_counter() - start
+            total_time += elapsed
+            total_queries += len(queries)
+            total_items += len(history)
+
+            self.stdout.write(f" > page={page + 1} items={len(history)} queries={len(queries)} time={elapsed:.3f}s")
+
+            if len(history) < limit:
+                break
+
+            before = get_event_time(history[-1])
+
+        self.stdout.write(
+            f"Fetched {total_items} items in {total_time:.3f}s ({total_queries} queries, "
+            f"{total_items / total_time if total_time else 0:.0f} items/s)"
+        )
+
+    def _seed_msgs(self, contact, count: int):
+        self.stdout.write(f"Creating {count} messages for contact {contact.uuid}...")
+
+        urn = contact.urns.order_by("-priority").first()
+        now = timezone.now()
+        msgs = [
+            Msg(
+                org=contact.org,
+                contact=contact,
+                contact_urn=urn,
+                channel=urn.channel if urn else None,
+                text=f"Benchmark message {i}",
+                msg_type=Msg.TYPE_TEXT,
+                direction=Msg.DIRECTION_IN,
+                status=Msg.STATUS_HANDLED,
+                visibility=Msg.VISIBILITY_VISIBLE,
+                created_on=now - timedelta(minutes=i),
+                modified_on=now,
+            )
+            for i in range(count)
+        ]
+        Msg.objects.bulk_create(msgs, batch_size=1000)
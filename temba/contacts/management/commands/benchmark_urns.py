@@ -0,0 +1,58 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from temba.contacts.models import URN
+from temba.utils.urns import parse_number
+
+
+class Command(BaseCommand):
+    help = "Benchmarks normalizing URNs one at a time vs in a batch, as done when importing contacts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1_000_000, help="The number of URNs to normalize")
+        parser.add_argument("--country", type=str, default="RW", help="The country code to normalize numbers with")
+        parser.add_argument("--unique", type=float, default=0.9, help="The fraction of URNs which are unique")
+        parser.add_argument("--seed", type=int, default=1, help="The random seed for generating URNs")
+
+    def handle(self, count: int, country: str, unique: float, seed: int, *args, **kwargs):
+        urns = self._generate_urns(count, unique, random.Random(seed))
+
+        self.stdout.write(f"Normalizing {count} URNs for country {country}...")
+
+        parse_number.cache_clear()
+        start = time.perf_counter()
+        single_errors = 0
+        for urn in urns:
+            try:
+                URN.normalize(urn, country)
+            except ValueError:
+                single_errors += 1
+        single_time = time.perf_counter() - start
+
+        self.stdout.write(f" > single: time={single_time:.3f}s errors={single_errors}")
+
+        parse_number.cache_clear()
+        start = time.perf_counter()
+        _, errors = URN.normalize_many(urns, country)
+        batch_time = time.perf_counter() - start
+
+        self.stdout.write(f" > batch: time={batch_time:.3f}s errors={len(errors)}")
+        self.stdout.write(
+            f"Normalized {count} URNs ({count / batch_time if batch_time else 0:.0f} URNs/s, "
+            f"{single_time / batch_time if batch_time else 0:.1f}x)"
+        )
+
+    def _generate_urns(self, count: int, unique: float, rand) -> list[str]:
+        num_unique = max(int(count * unique), 1)
+        formats = (
+            lambda: f"tel:0{rand.randint(780000000, 789999999)}",
+            lambda: f"tel:+250 {rand.randint(780000000, 789999999)}",
+            lambda: f"tel:({rand.randint(200, 999)}) {rand.randint(100, 999)}-{rand.randint(1000, 9999)}",
+            lambda: f"twitter:@User{rand.randint(1, 10_000_000)}",
+            lambda: f"mailto:User{rand.randint(1, 10_000_000)}@Example.com",
+        )
+
+        uniques = [rand.choice(formats)() for i in range(num_unique)]
+        return uniques + [rand.choice(uniques) for i in range(count - num_unique)]
@@ -1,8 +1,14 @@
+import csv
+import gzip
+import heapq
+import io
 import logging
+import os
 from datetime import date, datetime, timedelta, timezone as tzone
 from decimal import Decimal
-from itertools import chain
+from itertools import islice
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
 from typing import Any
 
 import iso8601
@@ -13,10 +19,13 @@ from openpyxl import load_workbook
 from smartmin.models import SmartModel
 
 from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
 from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.core.validators import validate_email
-from django.db import models, transaction
-from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Sum, Value, When
 from django.db.models.functions import Concat, Lower
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -26,15 +35,25 @@ from temba.channels.models import Channel
 from temba.locations.models import AdminBoundary
 from temba.mailroom import ContactSpec, modifiers, queue_populate_dynamic_group
 from temba.orgs.models import DependencyMixin, Export, ExportType, Org, OrgRole, User
-from temba.utils import chunk_list, format_number, on_transaction_commit
-from temba.utils.export import MultiSheetExporter
-from temba.utils.models import JSONField, LegacyUUIDMixin, SquashableModel, TembaModel, delete_in_batches
+from temba.utils import FingerprintSet, chunk_list, format_number, json, on_transaction_commit
+from temba.utils.models import (
+    JSONField,
+    LegacyUUIDMixin,
+    SquashableModel,
+    TembaModel,
+    delete_in_batches,
+    iter_keyset_batches,
+)
 from temba.utils.text import unsnakify
 from temba.utils.urns import ParsedURN, parse_number, parse_urn
 from temba.utils.uuid import uuid4
 
 logger = logging.getLogger(__name__)
 
+NON_ALPHANUMERIC_REGEX = regex.compile(r"[^0-9a-z]", regex.V0)
+NUMERIC_REGEX = regex.compile(r"^[0-9]+$", regex.V0)
+TWITTER_HANDLE_REGEX = regex.compile(r"^[a-zA-Z0-9_]{1,15}$", regex.V0)
+
 
 class URN:
     """
@@ -169,13 +188,13 @@ class URN:
 
         # validate twitter URNs look like handles
         elif scheme == cls.TWITTER_SCHEME:
-            return regex.match(r"^[a-zA-Z0-9_]{1,15}$", path, regex.V0)
+            return TWITTER_HANDLE_REGEX.match(path)
 
         # validate path is a number and display is a handle if present
         elif scheme == cls.TWITTERID_SCHEME:
             valid = path.isdigit()
             if valid and display:
-                valid = regex.match(r"^[a-zA-Z0-9_]{1,15}$", display, regex.V0)
+                valid = TWITTER_HANDLE_REGEX.match(display)
 
             return valid
 
@@ -202,7 +221,7 @@ class URN:
 
         # telegram, whatsapp and instagram use integer ids
         elif scheme in [cls.TELEGRAM_SCHEME, cls.WHATSAPP_SCHEME, cls.INSTAGRAM_SCHEME]:
-            return regex.match(r"^[0-9]+$", path, regex.V0)
+            return NUMERIC_REGEX.match(path)
 
         # validate Viber URNS look right (this is a guess)
         elif scheme == cls.VIBER_SCHEME:  # pragma: needs cover
@@ -255,6 +274,38 @@ class URN:
 
         return cls.from_parts(scheme, norm_path, query, display)
 
+    @classmethod
+    def normalize_many(cls, urns, country_code=None, *, validate: bool = False) -> tuple[list, dict]:
+        """
+        Normalizes (and optionally validates) the given URN strings. Returns a list of the normalized URNs in the same
+        order, with None in place of any that couldn't be normalized, and a dict of the errors for those keyed by index.
+        Identical inputs are only normalized once.
+        """
+        country_code = str(country_code) if country_code else ""
+        results = {}
+        normalized = []
+        errors = {}
+
+        for i, urn in enumerate(urns):
+            result = results.get(urn)
+            if result is None:
+                try:
+                    norm = cls.normalize(urn, country_code)
+                    if validate and not cls.validate(norm, country_code):
+                        raise ValueError(f"Invalid URN: {urn}")
+
+                    result = (norm, None)
+                except ValueError as e:
+                    result = (None, str(e))
+
+                results[urn] = result
+
+            normalized.append(result[0])
+            if result[1]:
+                errors[i] = result[1]
+
+        return normalized, errors
+
     @classmethod
     def normalize_number(cls, number: str, country_code: str):
         """
@@ -270,7 +321,7 @@ class URN:
             normalized = normalized[0:-4].replace(".", "")
 
         # remove non alphanumeric characters
-        normalized = regex.sub(r"[^0-9a-z]", "", normalized, regex.V0)
+        normalized = NON_ALPHANUMERIC_REGEX.sub("", normalized)
 
         parse_as = normalized
 
@@ -550,6 +601,42 @@ class ContactField(TembaModel, DependencyMixin):
         self.save(update_fields=("name", "is_active", "modified_on", "modified_by"))
 
 
+def _iter_newest_first(queryset, time_field: str, page_size: int):
+    """
+    Iterates over the given queryset ordered newest first by the given time field, fetching pages using keyset
+    pagination on (time, id) so that only as many pages are fetched as are consumed
+    """
+    for page in iter_keyset_batches(queryset, (time_field, "id"), batch_size=max(page_size, 1), reverse=True):
+        yield from page
+
+
+def _iter_run_events(runs, after: datetime, before: datetime, page_size: int):
+    """
+    Iterates over the start and exit events in the given time window of the given runs, newest first. Runs are fetched
+    as a single stream ordered by their latest event in the window, and each run's events are held back until no later
+    run can have an event that comes before them.
+    """
+    from temba.flows.models import FlowExit
+
+    exited_in_window = Q(exited_on__gte=after, exited_on__lt=before)
+    runs = runs.filter(Q(created_on__gte=after, created_on__lt=before) | exited_in_window).annotate(
+        history_on=Case(When(exited_in_window, then=F("exited_on")), default=F("created_on"))
+    )
+
+    pending = []  # heap of events of runs already fetched, keyed so that the newest is popped first
+    for run in _iter_newest_first(runs, "history_on", page_size):
+        while pending and pending[0][0] <= -run.history_on.timestamp():
+            yield heapq.heappop(pending)[2]
+
+        if run.exited_on and after <= run.exited_on < before:
+            heapq.heappush(pending, (-run.exited_on.timestamp(), -run.id, FlowExit(run)))
+        if after <= run.created_on < before:
+            heapq.heappush(pending, (-run.created_on.timestamp(), run.id, run))
+
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
 class Contact(LegacyUUIDMixin, SmartModel):
     """
     A contact represents an individual with which we can communicate and collect data
@@ -601,6 +688,10 @@ class Contact(LegacyUUIDMixin, SmartModel):
     # maximum number of contacts to release without using a background task
     BULK_RELEASE_IMMEDIATELY_LIMIT = 50
 
+    # events of ended sessions are cached for history
+    SESSION_EVENTS_CACHE_KEY = "session_events"
+    SESSION_EVENTS_CACHE_TTL = 60 * 60 * 24
+
     @classmethod
     def create(
         cls,
@@ -712,9 +803,9 @@ class Contact(LegacyUUIDMixin, SmartModel):
 
     def get_history(self, after: datetime, before: datetime, include_event_types: set, ticket, limit: int) -> list:
         """
-        Gets this contact's history of messages, calls, runs etc in the given time window
+        Gets this contact's history of messages, calls, runs etc in the given time window. Each source is fetched lazily
+        in pages, newest first, and the sources are merged so that we stop fetching once we have `limit` items.
         """
-        from temba.flows.models import FlowExit
         from temba.ivr.models import Call
         from temba.mailroom.events import get_event_time
         from temba.msgs.models import Msg
@@ -723,47 +814,27 @@ class Contact(LegacyUUIDMixin, SmartModel):
         msgs = (
             self.msgs.filter(created_on__gte=after, created_on__lt=before)
             .exclude(status=Msg.STATUS_PENDING)
-            .order_by("-created_on", "-id")
-            .select_related("channel", "contact_urn", "broadcast", "optin")[:limit]
+            .select_related("channel", "contact_urn", "broadcast", "optin")
         )
 
-        # get all runs start started or ended in this period
-        runs = (
-            self.runs.filter(
-                Q(created_on__gte=after, created_on__lt=before)
-                | Q(exited_on__isnull=False, exited_on__gte=after, exited_on__lt=before)
-            )
-            .exclude(flow__is_system=True)
-            .order_by("-created_on")
-            .select_related("flow")[:limit]
-        )
-        started_runs = [r for r in runs if after <= r.created_on < before]
-        exited_runs = [FlowExit(r) for r in runs if r.exited_on and after <= r.exited_on < before]
+        # runs are included as both started and exited events
+        runs = self.runs.exclude(flow__is_system=True).select_related("flow")
 
-        channel_events = (
-            self.channel_events.filter(created_on__gte=after, created_on__lt=before)
-            .order_by("-created_on")
-            .select_related("channel", "optin")[:limit]
+        channel_events = self.channel_events.filter(created_on__gte=after, created_on__lt=before).select_related(
+            "channel", "optin"
         )
 
-        campaign_events = (
-            self.campaign_fires.filter(fired__gte=after, fired__lt=before)
-            .exclude(fired=None)
-            .order_by("-fired")
-            .select_related("event__campaign", "event__relative_to")[:limit]
+        campaign_events = self.campaign_fires.filter(fired__gte=after, fired__lt=before).select_related(
+            "event__campaign", "event__relative_to"
         )
 
-        calls = (
-            Call.objects.filter(contact=self, created_on__gte=after, created_on__lt=before)
-            .exclude(status__in=[Call.STATUS_PENDING, Call.STATUS_WIRED])
-            .order_by("-created_on")
-            .select_related("channel")[:limit]
+        calls = Call.objects.filter(contact=self, created_on__gte=after, created_on__lt=before).exclude(
+            status__in=[Call.STATUS_PENDING, Call.STATUS_WIRED]
         )
+        calls = calls.select_related("channel")
 
-        ticket_events = (
-            self.ticket_events.filter(created_on__gte=after, created_on__lt=before)
-            .select_related("ticket__topic", "assignee", "created_by")
-            .order_by("-created_on")
+        ticket_events = self.ticket_events.filter(created_on__gte=after, created_on__lt=before).select_related(
+            "ticket__topic", "assignee", "created_by"
         )
 
         if ticket:
@@ -775,47 +846,71 @@ class Contact(LegacyUUIDMixin, SmartModel):
                 event_type__in=[TicketEvent.TYPE_OPENED, TicketEvent.TYPE_CLOSED, TicketEvent.TYPE_REOPENED]
             )
 
-        ticket_events = ticket_events[:limit]
+        transfers = self.airtime_transfers.filter(created_on__gte=after, created_on__lt=before)
 
-        transfers = self.airtime_transfers.filter(created_on__gte=after, created_on__lt=before).order_by("-created_on")[
-            :limit
-        ]
+        session_events = sorted(
+            self.get_session_events(after, before, include_event_types), key=get_event_time, reverse=True
+        )
 
-        session_events = self.get_session_events(after, before, include_event_types)
-
-        # chain all items together, sort by their event time, and slice
-        items = chain(
-            msgs,
-            started_runs,
-            exited_runs,
-            ticket_events,
-            channel_events,
-            campaign_events,
-            calls,
-            transfers,
+        streams = (
+            _iter_newest_first(msgs, "created_on", limit),
+            _iter_run_events(runs, after, before, limit),
+            _iter_newest_first(ticket_events, "created_on", limit),
+            _iter_newest_first(channel_events, "created_on", limit),
+            _iter_newest_first(campaign_events, "fired", limit),
+            _iter_newest_first(calls, "created_on", limit),
+            _iter_newest_first(transfers, "created_on", limit),
             session_events,
         )
 
-        # sort and slice
-        return sorted(items, key=get_event_time, reverse=True)[:limit]
+        # merge the sorted streams, which are only read from as far as they're needed
+        return list(islice(heapq.merge(*streams, key=get_event_time, reverse=True), limit))
 
     def get_session_events(self, after: datetime, before: datetime, types: set) -> list:
         """
-        Extracts events from this contacts sessions that overlap with the given time window
+        Extracts events from this contacts sessions that overlap with the given time window. The events of ended sessions
+        don't change so they're cached by session UUID, which saves fetching and parsing their output.
         """
 
         # limit to 100 sessions at a time to prevent melting when a contact has a lot of sessions
-        sessions = self.sessions.filter(
-            Q(created_on__gte=after, created_on__lt=before) | Q(ended_on__gte=after, ended_on__lt=before)
-        ).order_by("-created_on")[:100]
-        events = []
+        sessions = list(
+            self.sessions.filter(
+                Q(created_on__gte=after, created_on__lt=before) | Q(ended_on__gte=after, ended_on__lt=before)
+            )
+            .order_by("-created_on")
+            .only("id", "uuid", "ended_on", "output", "output_url")[:100]
+        )
+
+        r = get_redis_connection()
+        cache_keys = [f"{self.SESSION_EVENTS_CACHE_KEY}:{s.uuid}" for s in sessions]
+        cached = r.mget(cache_keys) if sessions else []
+        events_by_session = {s.id: json.loads(c) for s, c in zip(sessions, cached) if c is not None}
+
         for session in sessions:
+            if session.id in events_by_session:
+                continue
+
+            session_events = []
             for run in session.output_json.get("runs", []):
                 for event in run.get("events", []):
                     event["session_uuid"] = str(session.uuid)
-                    event_time = iso8601.parse_date(event["created_on"])
-                    if event["type"] in types and after <= event_time < before:
-                        events.append(event)
+                    session_events.append(event)
+
+            events_by_session[session.id] = session_events
+
+            if session.ended_on:
+                r.set(
+                    f"{self.SESSION_EVENTS_CACHE_KEY}:{session.uuid}",
+                    json.dumps(session_events),
+                    ex=self.SESSION_EVENTS_CACHE_TTL,
+                )
+
+        events = []
+        for session in sessions:
+            for event in events_by_session[session.id]:
+                event_time = iso8601.parse_date(event["created_on"])
+                if event["type"] in types and after <= event_time < before:
+                    events.append(event)
 
         return events
 
@@ -1180,6 +1275,44 @@ class Contact(LegacyUUIDMixin, SmartModel):
             urn.org = contact.org
             getattr(contact, "_urns_cache").append(urn)
 
+    @classmethod
+    def bulk_hydrate(cls, org, contacts, *, group_ids=(), using="default") -> list:
+        """
+        Fetches the given queryset of contacts along with their URNs and their memberships of the given groups, all in a
+        single query. URNs are cached on each contact and memberships are set as a `group_ids` list.
+        """
+        urns = ContactURN.objects.filter(contact=OuterRef("id")).order_by("-priority", "id")
+        contacts = contacts.annotate(
+            urn_schemes=ArraySubquery(urns.values("scheme")),
+            urn_paths=ArraySubquery(urns.values("path")),
+            urn_displays=ArraySubquery(urns.values("display")),
+        )
+        if group_ids:
+            memberships = ContactGroup.contacts.through.objects.filter(
+                contact=OuterRef("id"), contactgroup__in=group_ids
+            )
+            contacts = contacts.annotate(group_ids=ArraySubquery(memberships.values("contactgroup_id")))
+
+        contacts = list(contacts.using(using))
+
+        for contact in contacts:
+            contact.org = org
+            contact._urns_cache = [
+                ContactURN(
+                    org=org,
+                    contact=contact,
+                    identity=URN.from_parts(scheme, path),
+                    scheme=scheme,
+                    path=path,
+                    display=display,
+                )
+                for scheme, path, display in zip(contact.urn_schemes, contact.urn_paths, contact.urn_displays)
+            ]
+            if not group_ids:
+                contact.group_ids = []
+
+        return contacts
+
     @classmethod
     def bulk_inspect(self, contacts) -> dict:
         """
@@ -1348,6 +1481,58 @@ class ContactURN(models.Model):
 
         return self
 
+    @classmethod
+    def bulk_normalize_numbers(cls, urns, country_code: str) -> int:
+        """
+        Bulk version of ensure_number_normalization for a batch of tel URNs belonging to the same org. URNs whose
+        normalized identity is already taken, by an existing URN or by an earlier URN in the batch, are left as they are.
+        Returns the number of URNs updated.
+        """
+        candidates = [u for u in urns if u.path and u.path[0] != "+"]
+        if not candidates or not country_code:
+            return 0
+
+        normalized, _ = URN.normalize_many([URN.from_tel(u.path) for u in candidates], country_code)
+
+        changes = {}
+        for urn, norm in zip(candidates, normalized):
+            if norm and norm != urn.identity and norm not in changes:
+                changes[norm] = urn
+
+        if not changes:
+            return 0
+
+        taken = set(
+            cls.objects.filter(org_id=candidates[0].org_id, identity__in=changes.keys()).values_list(
+                "identity", flat=True
+            )
+        )
+        updates = []
+        for identity, urn in changes.items():
+            if identity not in taken:
+                urn.identity = identity
+                urn.path = URN.to_parts(identity)[1]
+                updates.append(urn)
+
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_update(updates, ["identity", "path"])
+            return len(updates)
+        except IntegrityError:
+            pass
+
+        # an identity was taken since we checked, so fall back to updating one at a time
+        num_updated = 0
+        for urn in updates:
+            try:
+                with transaction.atomic():
+                    urn.save(update_fields=("identity", "path"))
+                num_updated += 1
+            except IntegrityError:
+                pass
+
+        return num_updated
+
     def get_display(self, org=None, international: bool = False, formatted: bool = True) -> str:
         """
         Gets a representation of the URN for display, e.g. tel:+12345678901 becomes +1 234 567-8901
@@ -1734,9 +1919,13 @@ class ContactGroupCount(SquashableModel):
         """
         Gets total counts for all the given groups
         """
-        counts = cls.objects.filter(group__in=groups)
-        counts = counts.values("group").order_by("group").annotate(count_sum=Sum("count"))
-        counts_by_group_id = {c["group"]: c["count_sum"] for c in counts}
+
+        def fetch(group_ids):
+            counts = cls.objects.filter(group_id__in=group_ids)
+            counts = counts.values("group").order_by("group").annotate(count_sum=Sum("count"))
+            return {c["group"]: c["count_sum"] for c in counts}
+
+        counts_by_group_id = cls.get_cached_totals([g.id for g in groups], fetch)
         return {g: counts_by_group_id.get(g.id, 0) for g in groups}
 
     @classmethod
@@ -1767,7 +1956,7 @@ class ContactExport(ExportType):
     download_template = "contacts/export_download.html"
 
     @classmethod
-    def create(cls, org, user, group=None, search=None, with_groups=()):
+    def create(cls, org, user, group=None, search=None, with_groups=(), format=Export.FORMAT_XLSX):
         export = Export.objects.create(
             org=org,
             export_type=cls.slug,
@@ -1775,6 +1964,7 @@ class ContactExport(ExportType):
                 "group_id": group.id if group else None,
                 "search": search,
                 "with_groups": [g.id for g in with_groups],
+                "format": format,
             },
             created_by=user,
         )
@@ -1865,24 +2055,23 @@ class ContactExport(ExportType):
             contact_ids = group.contacts.using("readonly").order_by("id").values_list("id", flat=True)
 
         # create our exporter
-        exporter = MultiSheetExporter(
-            "Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields], export.org.timezone
-        )
+        exporter = export.get_exporter("Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields])
 
         num_records = 0
 
         # write out contacts in batches to limit memory usage
         for batch_ids in chunk_list(contact_ids, 1000):
-            # fetch all the contacts for our batch
-            batch_contacts = (
-                Contact.objects.filter(id__in=batch_ids).prefetch_related("org", "groups").using("readonly")
+            # fetch all the contacts for our batch with their URNs and group memberships
+            batch_contacts = Contact.bulk_hydrate(
+                export.org,
+                Contact.objects.filter(id__in=batch_ids),
+                group_ids=[g["group_id"] for g in group_fields],
+                using="readonly",
             )
 
             # to maintain our sort, we need to lookup by id, create a map of our id->contact to aid in that
             contact_by_id = {c.id: c for c in batch_contacts}
 
-            Contact.bulk_urn_cache_initialize(batch_contacts, using="readonly")
-
             for contact_id in batch_ids:
                 contact = contact_by_id[contact_id]
 
@@ -1892,7 +2081,7 @@ class ContactExport(ExportType):
 
                 group_values = []
                 if include_group_memberships:
-                    contact_groups_ids = [g.id for g in contact.groups.all()]
+                    contact_groups_ids = contact.group_ids
                     for col in range(len(group_fields)):
                         field = group_fields[col]
                         group_values.append(field["group_id"] in contact_groups_ids)
@@ -1953,6 +2142,7 @@ def get_import_upload_path(instance: Any, filename: str):
 class ContactImport(SmartModel):
     MAX_RECORDS = 25_000
     BATCH_SIZE = 100
+    ROWS_MAX_MEMORY = 1024 * 1024  # parsed rows beyond this size are spilled to disk
     EXPLICIT_CLEAR = "--"
 
     # how many sequential URNs triggers flagging
@@ -1983,31 +2173,21 @@ class ContactImport(SmartModel):
     finished_on = models.DateTimeField(null=True)
 
     @classmethod
-    def try_to_parse(cls, org: Org, file, filename: str) -> tuple[list, int]:
+    def try_to_parse(cls, org: Org, file, filename: str, *, rows_file=None) -> tuple[list, int]:
         """
         Tries to parse the given file stream as an import. If successful it returns the automatic column mappings and
-        total number of records. Otherwise raises a ValidationError.
+        total number of records. Otherwise raises a ValidationError. If a rows file is provided, the parsed records are
+        written to it as they are validated so that starting the import doesn't require parsing the file again.
         """
 
-        try:
-            workbook = load_workbook(filename=file, read_only=True, data_only=True)
-        except Exception:
-            raise ValidationError(_("Import file appears to be corrupted."))
-        ws = workbook.active
-
-        # see https://openpyxl.readthedocs.io/en/latest/optimized.html#worksheet-dimensions but even with this we need
-        # to ignore empty columns after the last column with data
-        ws.reset_dimensions()
-
-        data = ws.iter_rows()
+        data = cls._read_rows(file, filename)
 
         try:
             header_row = next(data)
         except StopIteration:
             raise ValidationError(_("Import file appears to be empty."))
 
-        headers = [h.value for h in header_row]
-        headers = [str(h).strip() if h else "" for h in headers]
+        headers = [str(h).strip() if h else "" for h in header_row]
 
         # ignore empty header columns after the last column with data
         max_col = 0
@@ -2021,12 +2201,15 @@ class ContactImport(SmartModel):
 
         mappings = cls._auto_mappings(org, headers)
 
-        # iterate over rest of the rows to do row-level validation
-        seen_uuids = set()
-        seen_urns = set()
+        # iterate over rest of the rows to do row-level validation, tracking fingerprints of UUIDs and URNs rather than
+        # the values themselves to keep memory usage down for large files
+        seen_uuids = FingerprintSet()
+        seen_urns = FingerprintSet()
         num_records = 0
         row_num = 1
 
+        writer = gzip.GzipFile(fileobj=rows_file, mode="wb") if rows_file is not None else None
+
         while True:
             row_num += 1
 
@@ -2035,26 +2218,26 @@ class ContactImport(SmartModel):
             except StopIteration:
                 break
 
-            row = cls._parse_row(raw_row, len(mappings))
-            uuid, urns = cls._extract_uuid_and_urns(row, mappings)
-            if uuid:
-                if uuid in seen_uuids:
-                    raise ValidationError(
-                        _("Import file contains duplicated contact UUID '%(uuid)s' on row %(row)s."),
-                        params={"uuid": uuid, "row": row_num},
-                    )
-                seen_uuids.add(uuid)
+            row = cls._parse_row(raw_row, len(mappings), tz=org.timezone)
+            uuid, urns = cls._extract_uuid_and_urns(row, mappings, org.default_country_code)
+            if uuid and not seen_uuids.add(uuid):
+                raise ValidationError(
+                    _("Import file contains duplicated contact UUID '%(uuid)s' on row %(row)s."),
+                    params={"uuid": uuid, "row": row_num},
+                )
             for urn in urns:
-                if urn in seen_urns:
+                if not seen_urns.add(urn):
                     raise ValidationError(
                         _("Import file contains duplicated contact URN '%(urn)s' on row %(row)s."),
                         params={"urn": urn, "row": row_num},
                     )
-                seen_urns.add(urn)
 
             if uuid or urns:  # if we have a UUID or URN on this row it's an importable record
                 num_records += 1
 
+                if writer:
+                    writer.write(json.dumps([row_num, row, urns]).encode("utf-8") + b"\n")
+
             # check if we exceed record limit
             if num_records > ContactImport.MAX_RECORDS:
                 raise ValidationError(
@@ -2065,29 +2248,83 @@ class ContactImport(SmartModel):
         if num_records == 0:
             raise ValidationError(_("Import file doesn't contain any records."))
 
+        if writer:
+            writer.close()
+
         file.seek(0)  # seek back to beginning so subsequent reads work
 
         return mappings, num_records
 
+    @classmethod
+    def parse_upload(cls, org: Org, file, filename: str) -> tuple[list, int, Any]:
+        """
+        Parses an uploaded file as an import, returning the mappings, total number of records and the parsed rows, which
+        should be passed to save_rows once the import has been created.
+        """
+        rows = SpooledTemporaryFile(max_size=cls.ROWS_MAX_MEMORY)
+        try:
+            mappings, num_records = cls.try_to_parse(org, file, filename, rows_file=rows)
+        except Exception:
+            rows.close()
+            raise
+
+        return mappings, num_records, rows
+
     @staticmethod
-    def _extract_uuid_and_urns(row, mappings) -> tuple[str, list[str]]:
+    def _read_rows(file, filename: str):
+        """
+        Generator which streams the rows of raw values from the given XLSX or CSV file, starting with the header row
+        """
+
+        if Path(filename).suffix.lower() == ".csv":
+            text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+            try:
+                yield from csv.reader(text)
+            except (UnicodeDecodeError, csv.Error):
+                raise ValidationError(_("Import file appears to be corrupted."))
+            finally:
+                text.detach()  # so closing the wrapper doesn't close the underlying file
+            return
+
+        try:
+            workbook = load_workbook(filename=file, read_only=True, data_only=True)
+        except Exception:
+            raise ValidationError(_("Import file appears to be corrupted."))
+        ws = workbook.active
+
+        # see https://openpyxl.readthedocs.io/en/latest/optimized.html#worksheet-dimensions but even with this we need
+        # to ignore empty columns after the last column with data
+        ws.reset_dimensions()
+
+        for row in ws.iter_rows():
+            yield [cell.value for cell in row]
+
+    @classmethod
+    def _extract_uuid_and_urns(cls, row, mappings, country_code: str) -> tuple[str, list[str]]:
         """
-        Extracts any UUIDs and URNs from the given row so they can be checked for uniqueness
+        Extracts any UUIDs and normalized URNs from the given row so they can be checked for uniqueness
         """
         uuid = ""
-        urns = []
         for value, item in zip(row, mappings):
             mapping = item["mapping"]
             if mapping["type"] == "attribute" and mapping["name"] == "uuid":
                 uuid = value.lower()
-            elif mapping["type"] == "scheme" and value:
-                urn = URN.from_parts(mapping["scheme"], value)
-                try:
-                    urn = URN.normalize(urn)
-                except ValueError:
-                    pass
-                urns.append(urn)
-        return uuid, urns
+        return uuid, cls._extract_urns(row, mappings, country_code)
+
+    @staticmethod
+    def _extract_urns(row, mappings, country_code: str) -> list[str]:
+        """
+        Extracts and normalizes the URNs from the given row
+        """
+        urns = []
+        for value, item in zip(row, mappings):
+            mapping = item["mapping"]
+            if mapping["type"] == "scheme" and value and value != ContactImport.EXPLICIT_CLEAR:
+                urns.append(URN.from_parts(mapping["scheme"], value))
+
+        # keep any URNs that can't be normalized as they are
+        normalized, _ = URN.normalize_many(urns, country_code)
+        return [norm or urn for urn, norm in zip(urns, normalized)]
 
     @classmethod
     def _auto_mappings(cls, org: Org, headers: list[str]) -> list:
@@ -2174,8 +2411,9 @@ class ContactImport(SmartModel):
         on_transaction_commit(lambda: import_contacts_task.delay(self.id))
 
     def delete(self):
-        # delete our source import file
+        # delete our source import file and any parsed rows
         self.file.delete()
+        default_storage.delete(self.get_rows_path())
 
         # delete any batches associated with this import
         ContactImportBatch.objects.filter(contact_import=self).delete()
@@ -2209,21 +2447,18 @@ class ContactImport(SmartModel):
             self.group = ContactGroup.create_manual(self.org, self.created_by, name=self.group_name)
             self.save(update_fields=("group",))
 
-        # parse each row, creating batch tasks for mailroom
-        workbook = load_workbook(filename=self.file, read_only=True, data_only=True)
-        ws = workbook.active
-        ws.reset_dimensions()  # see https://openpyxl.readthedocs.io/en/latest/optimized.html#worksheet-dimensions
-        data = ws.iter_rows(min_row=2)
-
+        # create batch tasks for mailroom from each parsed row
         urns = []
         batches = []
 
-        for batch_specs, batch_start, batch_end in self._batches_generator(data):
+        for batch_specs, batch_start, batch_end in self._batches_generator(self._iter_parsed_rows()):
             batches.append(self.batches.create(specs=batch_specs, record_start=batch_start, record_end=batch_end))
 
             for spec in batch_specs:
                 urns.extend(spec.get("urns", []))
 
+        default_storage.delete(self.get_rows_path())
+
         # set redis key which mailroom batch tasks can decrement to know when import has completed
         r = get_redis_connection()
         r.set(f"contact_import_batches_remaining:{self.id}", len(batches), ex=24 * 60 * 60)
@@ -2236,22 +2471,55 @@ class ContactImport(SmartModel):
         if not self.org.is_verified and self._detect_spamminess(urns):
             self.org.flag()
 
-    def _batches_generator(self, row_iter):
+    def get_rows_path(self) -> str:
+        """
+        Gets the storage path of the rows parsed from our file when it was uploaded
+        """
+        return f"{os.path.splitext(self.file.name)[0]}_rows.jsonl.gz"
+
+    def save_rows(self, rows_file):
+        """
+        Saves the rows written by try_to_parse so that starting this import doesn't require parsing the file again, and
+        closes the file they were written to
+        """
+        with rows_file:
+            rows_file.seek(0)
+            default_storage.save(self.get_rows_path(), File(rows_file))
+
+    def _iter_parsed_rows(self):
         """
-        Generator which takes an iterable of raw rows and returns tuples of 1. a batches of specs, 2. the record index
+        Generator of (row number, values, URNs) tuples for the importable rows in our file, read from the parsed rows
+        saved at upload if they exist, otherwise by parsing the file again
+        """
+        rows_path = self.get_rows_path()
+
+        if default_storage.exists(rows_path):
+            with default_storage.open(rows_path) as f, gzip.GzipFile(fileobj=f) as rows:
+                for line in rows:
+                    yield tuple(json.loads(line))
+            return
+
+        with self.file.open("rb") as f:
+            data = self._read_rows(f, self.file.name)
+            next(data)  # skip header row
+
+            for row_num, raw_row in enumerate(data, start=2):
+                row_data = self._parse_row(raw_row, len(self.mappings), tz=self.org.timezone)
+                yield row_num, row_data, self._extract_urns(row_data, self.mappings, self.org.default_country_code)
+
+    def _batches_generator(self, rows):
+        """
+        Generator which takes an iterable of parsed rows and returns tuples of 1. a batches of specs, 2. the record index
         at which the batch starts, 3. the record number at which the batch ends
         """
         record = 0
         batch_specs = []
         batch_start = record
-        row = 1  # 1-based rows like Excel uses
 
-        for raw_row in row_iter:
-            row_data = self._parse_row(raw_row, len(self.mappings), tz=self.org.timezone)
-            spec = self._row_to_spec(row_data)
-            row += 1
+        for row_num, row_data, urns in rows:
+            spec = self._row_to_spec(row_data, urns)
             if spec:
-                spec["_import_row"] = row
+                spec["_import_row"] = row_num
                 batch_specs.append(spec)
                 record += 1
 
@@ -2309,14 +2577,16 @@ class ContactImport(SmartModel):
         prefix, name = (parts[0], parts[1]) if len(parts) >= 2 else ("", parts[0])
         return prefix.lower(), name
 
-    def _row_to_spec(self, row: list[str]) -> dict:
+    def _row_to_spec(self, row: list[str], urns: list[str]) -> dict:
         """
-        Convert a record (dict of headers to values) to a contact spec
+        Convert a record (list of values and normalized URNs) to a contact spec
         """
 
         spec = {}
         if self.group_id:
             spec["groups"] = [str(self.group.uuid)]
+        if urns:
+            spec["urns"] = urns
 
         for value, item in zip(row, self.mappings):
             mapping = item["mapping"]
@@ -2331,18 +2601,6 @@ class ContactImport(SmartModel):
                 if attribute in ("uuid", "language", "status"):
                     value = value.lower()
                 spec[attribute] = value
-            elif mapping["type"] == "scheme":
-                scheme = mapping["scheme"]
-                if value:
-                    if "urns" not in spec:
-                        spec["urns"] = []
-                    urn = URN.from_parts(scheme, value)
-                    try:
-                        urn = URN.normalize(urn, country_code=self.org.default_country_code)
-                    except ValueError:
-                        pass
-                    spec["urns"].append(urn)
-
             elif mapping["type"] in ("field", "new_field"):
                 if "fields" not in spec:
                     spec["fields"] = {}
@@ -2356,13 +2614,13 @@ class ContactImport(SmartModel):
         return spec
 
     @classmethod
-    def _parse_row(cls, row: list[str], size: int, tz=None) -> list[str]:
+    def _parse_row(cls, row: list, size: int, tz=None) -> list[str]:
         """
         Parses the raw values in the given row, returning a new list with the given size
         """
         parsed = []
         for i in range(size):
-            parsed.append(cls._parse_value(row[i].value, tz=tz) if i < len(row) else "")
+            parsed.append(cls._parse_value(row[i], tz=tz) if i < len(row) else "")
         return parsed
 
     @staticmethod
@@ -46,7 +46,7 @@ def squash_group_counts():
     """
     Squashes our ContactGroupCounts into single rows per ContactGroup
     """
-    ContactGroupCount.squash()
+    return {"ContactGroupCount": ContactGroupCount.schedule_squash()}
 
 
 @shared_task
@@ -1125,21 +1125,22 @@ class ContactImportCRUDL(SmartCRUDL):
 
     class Create(SpaMixin, OrgPermsMixin, SmartCreateView):
         class Form(forms.ModelForm):
-            file = forms.FileField(validators=[FileExtensionValidator(allowed_extensions=("xlsx",))])
+            file = forms.FileField(validators=[FileExtensionValidator(allowed_extensions=("xlsx", "csv"))])
 
             def __init__(self, *args, org, **kwargs):
                 self.org = org
                 self.headers = None
                 self.mappings = None
                 self.num_records = None
+                self.rows = None
 
                 super().__init__(*args, **kwargs)
 
             def clean_file(self):
                 file = self.cleaned_data["file"]
 
-                # try to parse the file saving the mappings so we don't have to repeat parsing when saving the import
-                self.mappings, self.num_records = ContactImport.try_to_parse(self.org, file.file, file.name)
+                # try to parse the file saving the mappings and parsed rows so we don't have to repeat parsing later
+                self.mappings, self.num_records, self.rows = ContactImport.parse_upload(self.org, file.file, file.name)
 
                 return file
 
@@ -1176,6 +1177,11 @@ class ContactImportCRUDL(SmartCRUDL):
             obj.num_records = self.form.num_records
             return obj
 
+        def post_save(self, obj):
+            obj = super().post_save(obj)
+            obj.save_rows(self.form.rows)
+            return obj
+
     class Preview(SpaMixin, OrgObjPermsMixin, SmartUpdateView):
         menu_path = "/contact/import"
 
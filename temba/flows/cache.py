@@ -0,0 +1,159 @@
+import copy
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from django_redis import get_redis_connection
+
+from temba.utils import json
+
+KEY_PREFIX = "flow_definitions"
+EXPIRES = 60 * 60 * 24 * 7
+STATS_KEY = "flow_definition_cache_stats"
+TIMINGS_KEY = "flow_definition_cache_timings"
+TIMINGS_SIZE = 1000
+STATS_FLUSH_INTERVAL = 10  # seconds between writes of local stats and timings to redis
+
+
+class DefinitionCache:
+    """
+    Two level cache of flow definitions, keyed by flow UUID, revision number and spec version. Definitions are stored
+    parsed in a bounded in-process LRU, so that a local hit only has to copy the definition rather than parse it again,
+    and compressed in a redis hash per flow which is shared between processes. A revision never changes once saved so
+    entries can't go stale, and saving a new revision invalidates the flow's entries to free them. Stats and timings of lookups are accumulated in process and periodically added to those in
+    redis, so that a lookup which is a local hit doesn't require any redis calls.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._local = OrderedDict()
+        self._stats = Counter()
+        self._timings = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get(self, flow_uuid, revision: int, spec_version: str, load) -> dict:
+        """
+        Gets a definition from the cache, calling `load` to get it if it's not cached in either level
+        """
+        start = time.perf_counter()
+        key = (str(flow_uuid), revision, spec_version)
+
+        with self._lock:
+            definition = self._local.get(key)
+            if definition is not None:
+                self._local.move_to_end(key)
+
+        if definition is not None:
+            result = "local_hits"
+        else:
+            r = get_redis_connection()
+            compressed = r.hget(self._key(flow_uuid), self._field(revision, spec_version))
+            if compressed is not None:
+                definition = json.loads(zlib.decompress(compressed).decode())
+                result = "hits"
+            else:
+                serialized = json.dumps(load())
+                definition = json.loads(serialized)  # so a miss gives the same values as a hit from redis
+                pipe = r.pipeline()
+                pipe.hset(self._key(flow_uuid), self._field(revision, spec_version), zlib.compress(serialized.encode()))
+                pipe.expire(self._key(flow_uuid), EXPIRES)
+                pipe.execute()
+                result = "misses"
+
+            self._put_local(key, definition)
+
+        # callers are free to modify the definitions they get so they can't be given the cached one
+        definition = copy.deepcopy(definition)
+
+        with self._lock:
+            self._stats[result] += 1
+            self._timings.append(f"{(time.perf_counter() - start) * 1000:.3f}")
+            del self._timings[:-TIMINGS_SIZE]
+            flush_due = time.monotonic() - self._last_flush >= STATS_FLUSH_INTERVAL
+
+        if flush_due:
+            self.flush_stats()
+
+        return definition
+
+    def flush_stats(self):
+        """
+        Adds the stats and timings accumulated in this process to those in redis
+        """
+        with self._lock:
+            stats, self._stats = self._stats, Counter()
+            timings, self._timings = self._timings, []
+            self._last_flush = time.monotonic()
+
+        if stats:
+            pipe = get_redis_connection().pipeline()
+            for result, count in stats.items():
+                pipe.hincrby(STATS_KEY, result, count)
+            pipe.lpush(TIMINGS_KEY, *timings)
+            pipe.ltrim(TIMINGS_KEY, 0, TIMINGS_SIZE - 1)
+            pipe.execute()
+
+    def invalidate(self, flow_uuid):
+        """
+        Removes all cached definitions of the given flow
+        """
+        get_redis_connection().delete(self._key(flow_uuid))
+
+        with self._lock:
+            for key in [k for k in self._local if k[0] == str(flow_uuid)]:
+                del self._local[key]
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _put_local(self, key: tuple, definition: dict):
+        with self._lock:
+            self._local[key] = definition
+            self._local.move_to_end(key)
+
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    @staticmethod
+    def pop_stats() -> dict:
+        """
+        Gets and resets the hit rate of the cache and p50/p99 definition load times in milliseconds over the lookups
+        since the last pop, as flushed to redis by each process
+        """
+        pipe = get_redis_connection().pipeline()
+        pipe.hgetall(STATS_KEY)
+        pipe.lrange(TIMINGS_KEY, 0, -1)
+        pipe.delete(STATS_KEY, TIMINGS_KEY)
+        raw_stats, raw_timings, _ = pipe.execute()
+
+        stats = {k.decode(): int(v) for k, v in raw_stats.items()}
+        local_hits, hits, misses = stats.get("local_hits", 0), stats.get("hits", 0), stats.get("misses", 0)
+        lookups = local_hits + hits + misses
+
+        timings = sorted(float(t) for t in raw_timings)
+
+        def percentile(p: int) -> float:
+            return timings[min(int(len(timings) * p / 100), len(timings) - 1)] if timings else 0.0
+
+        return {
+            "local_hits": local_hits,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (local_hits + hits) / lookups if lookups else 0.0,
+            "p50_ms": percentile(50),
+            "p99_ms": percentile(99),
+        }
+
+    @staticmethod
+    def _key(flow_uuid) -> str:
+        return f"{KEY_PREFIX}:{flow_uuid}"
+
+    @staticmethod
+    def _field(revision: int, spec_version: str) -> str:
+        return f"{revision}:{spec_version}"
+
+
+definition_cache = DefinitionCache()
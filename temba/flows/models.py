@@ -1,7 +1,8 @@
 import logging
 from array import array
+from bisect import bisect_left
 from collections import defaultdict
-from datetime import datetime, timezone as tzone
+from datetime import datetime, time, timezone as tzone
 
 import iso8601
 from django_redis import get_redis_connection
@@ -25,11 +26,18 @@ from temba.orgs.models import DependencyMixin, Export, ExportType, Org, User
 from temba.templates.models import Template
 from temba.tickets.models import Topic
 from temba.utils import analytics, chunk_list, json, on_transaction_commit, s3
-from temba.utils.export.models import MultiSheetExporter
-from temba.utils.models import JSONAsTextField, LegacyUUIDMixin, SquashableModel, TembaModel, delete_in_batches
+from temba.utils.models import (
+    JSONAsTextField,
+    LegacyUUIDMixin,
+    SquashableModel,
+    TembaModel,
+    delete_in_batches,
+    iter_keyset_batches,
+)
 from temba.utils.uuid import uuid4
 
 from . import legacy
+from .cache import definition_cache
 
 logger = logging.getLogger(__name__)
 
@@ -300,9 +308,26 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
             dependency_mapping[flow_uuid] = str(flow.uuid)
             created_flows.append((flow, flow_def))
 
-        # import each definition (includes re-mapping dependency references)
-        for flow, definition in created_flows:
-            flow.import_definition(user, definition, dependency_mapping)
+        # migrate and inspect all the definitions in batches rather than making mailroom requests for each flow
+        client = mailroom.get_client()
+        flows = [f for f, d in created_flows]
+        definitions = cls.migrate_definitions([d for f, d in created_flows], flow=None)
+        flow_infos = client.flow_inspect_many(org, definitions)
+
+        for flow, flow_info in zip(flows, flow_infos):
+            flow._import_dependencies(user, flow_info[Flow.INSPECT_DEPENDENCIES], dependency_mapping)
+
+        # clone definitions so that all flow elements get new random UUIDs
+        cloned_definitions = client.flow_clone_many(definitions, dependency_mapping)
+        for cloned_definition in cloned_definitions:
+            cloned_definition.pop(Flow.DEFINITION_REVISION, None)
+
+        # save new revisions, but we can't validate them yet because we're in a transaction and mailroom won't see any
+        # new database objects
+        cloned_infos = client.flow_inspect_many(org, cloned_definitions)
+
+        for flow, cloned_definition, cloned_info in zip(flows, cloned_definitions, cloned_infos):
+            flow.save_revision(user, cloned_definition, flow_info=cloned_info)
 
         # remap flow UUIDs in any campaign events
         for campaign in export_json.get("campaigns", []):
@@ -320,7 +345,7 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
                     trigger["flow"]["uuid"] = dependency_mapping[flow_uuid]
 
         # return the created flows
-        return [f[0] for f in created_flows]
+        return flows
 
     @classmethod
     def is_valid_expires(cls, flow_type: str, expires: int) -> bool:
@@ -475,7 +500,22 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         definition = Flow.migrate_definition(definition, flow=None)
 
         flow_info = mailroom.get_client().flow_inspect(self.org, definition)
-        dependencies = flow_info[Flow.INSPECT_DEPENDENCIES]
+
+        self._import_dependencies(user, flow_info[Flow.INSPECT_DEPENDENCIES], dependency_mapping)
+
+        # clone definition so that all flow elements get new random UUIDs
+        cloned_definition = mailroom.get_client().flow_clone(definition, dependency_mapping)
+        if "revision" in cloned_definition:
+            del cloned_definition["revision"]
+
+        # save a new revision but we can't validate it just yet because we're in a transaction and mailroom
+        # won't see any new database objects
+        self.save_revision(user, cloned_definition)
+
+    def _import_dependencies(self, user, dependencies: list, dependency_mapping: dict):
+        """
+        Ensures the dependencies of a definition being imported exist, adding their UUIDs to the dependency mapping
+        """
 
         # converts a dep ref {uuid|key, name, type, missing} to an importable partial definition {uuid|key, name}
         def ref_to_def(r: dict) -> dict:
@@ -534,15 +574,6 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
                 dependency_mapping[ref["uuid"]] = str(obj.uuid) if obj else ref["uuid"]
 
-        # clone definition so that all flow elements get new random UUIDs
-        cloned_definition = mailroom.get_client().flow_clone(definition, dependency_mapping)
-        if "revision" in cloned_definition:
-            del cloned_definition["revision"]
-
-        # save a new revision but we can't validate it just yet because we're in a transaction and mailroom
-        # won't see any new database objects
-        self.save_revision(user, cloned_definition)
-
     def archive(self, user):
         self.is_archived = True
         self.modified_by = user
@@ -708,12 +739,13 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         """
         Returns the current definition of this flow
         """
-        rev = self.get_current_revision()
+        rev = self.revisions.defer("definition").order_by("revision").last()
 
         assert rev, "can't get definition of flow with no revisions"
 
+        definition = definition_cache.get(self.uuid, rev.revision, rev.spec_version, lambda: rev.definition)
+
         # update metadata in definition from database object as it may be out of date
-        definition = rev.definition
 
         if self.is_legacy():
             if "metadata" not in definition:
@@ -735,9 +767,10 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         """
         return self.revisions.order_by("revision").last()
 
-    def save_revision(self, user, definition) -> tuple:
+    def save_revision(self, user, definition, *, flow_info: dict = None) -> tuple:
         """
-        Saves a new revision for this flow, validation will be done on the definition first
+        Saves a new revision for this flow, validation will be done on the definition first unless it has already been
+        inspected and the results are provided as `flow_info`
         """
         if Version(definition.get(Flow.DEFINITION_SPEC_VERSION)) < Version(Flow.INITIAL_GOFLOW_VERSION):
             raise FlowVersionConflictException(definition.get(Flow.DEFINITION_SPEC_VERSION))
@@ -761,7 +794,9 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         definition[Flow.DEFINITION_EXPIRE_AFTER_MINUTES] = self.expires_after_minutes
 
         # inspect the flow (with optional validation)
-        flow_info = mailroom.get_client().flow_inspect(self.org, definition)
+        if flow_info is None:
+            flow_info = mailroom.get_client().flow_inspect(self.org, definition)
+
         dependencies = flow_info[Flow.INSPECT_DEPENDENCIES]
         issues = flow_info[Flow.INSPECT_ISSUES]
 
@@ -804,21 +839,26 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
             self.update_dependencies(dependencies)
 
+        on_transaction_commit(lambda: definition_cache.invalidate(self.uuid))
+
         return revision, issues
 
     @classmethod
     def migrate_definition(cls, flow_def, flow, to_version=None):
+        return cls.migrate_definitions([flow_def], flow, to_version)[0]
+
+    @classmethod
+    def migrate_definitions(cls, flow_defs: list, flow, to_version=None) -> list:
         if not to_version:
             to_version = cls.CURRENT_SPEC_VERSION
 
-        if "version" in flow_def:
-            flow_def = legacy.migrate_definition(flow_def, flow=flow)
+        flow_defs = [legacy.migrate_definition(d, flow=flow) if "version" in d else d for d in flow_defs]
 
         # migrate using goflow for anything newer
         if Version(to_version) >= Version(Flow.INITIAL_GOFLOW_VERSION):
-            flow_def = mailroom.get_client().flow_migrate(flow_def, to_version)
+            flow_defs = mailroom.get_client().flow_migrate_many(flow_defs, to_version)
 
-        return flow_def
+        return flow_defs
 
     @classmethod
     def migrate_export(cls, org, exported_json, same_site, version):
@@ -828,12 +868,7 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
             exported_json = exports.migrate(org, exported_json, same_site, version)
 
-        migrated_flows = []
-        for flow_def in exported_json["flows"]:
-            migrated_def = Flow.migrate_definition(flow_def, flow=None)
-            migrated_flows.append(migrated_def)
-
-        exported_json["flows"] = migrated_flows
+        exported_json["flows"] = Flow.migrate_definitions(exported_json["flows"], flow=None)
 
         return exported_json
 
@@ -873,6 +908,10 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
             m2m.clear()
             m2m.add(*objects)
 
+        self.org._update_flow_dependency_edges(
+            self, [f.id for f in dep_objs["flow"]], [g.id for g in dep_objs["group"]]
+        )
+
     def get_dependents(self):
         dependents = super().get_dependents()
         dependents["campaign_event"] = self.campaign_events.filter(is_active=True)
@@ -927,6 +966,8 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         for rev in self.revisions.all():
             rev.release()
 
+        definition_cache.invalidate(self.uuid)
+
         for trigger in self.triggers.all():
             trigger.delete()
 
@@ -1319,6 +1360,24 @@ class FlowRevision(models.Model):
                 validate_localization(rule["category"])
 
     def get_migrated_definition(self, to_version: str = Flow.CURRENT_SPEC_VERSION) -> dict:
+        # migrating can require calls to mailroom so migrated definitions are cached
+        if self.spec_version != to_version:
+            definition = definition_cache.get(
+                self.flow.uuid, self.revision, to_version, lambda: self._migrate_definition(to_version)
+            )
+        else:
+            definition = self._migrate_definition(to_version)
+
+        # update variables from our db into our revision
+        flow = self.flow
+        definition[Flow.DEFINITION_NAME] = flow.name
+        definition[Flow.DEFINITION_UUID] = flow.uuid
+        definition[Flow.DEFINITION_REVISION] = self.revision
+        definition[Flow.DEFINITION_EXPIRE_AFTER_MINUTES] = flow.expires_after_minutes
+
+        return definition
+
+    def _migrate_definition(self, to_version: str) -> dict:
         definition = self.definition
 
         # if it's previous to version 6, wrap the definition to
@@ -1345,13 +1404,6 @@ class FlowRevision(models.Model):
         if self.spec_version != to_version:
             definition = Flow.migrate_definition(definition, self.flow, to_version)
 
-        # update variables from our db into our revision
-        flow = self.flow
-        definition[Flow.DEFINITION_NAME] = flow.name
-        definition[Flow.DEFINITION_UUID] = flow.uuid
-        definition[Flow.DEFINITION_REVISION] = self.revision
-        definition[Flow.DEFINITION_EXPIRE_AFTER_MINUTES] = flow.expires_after_minutes
-
         return definition
 
     def as_json(self):
@@ -1510,8 +1562,15 @@ class FlowNodeCount(SquashableModel):
 
     @classmethod
     def get_totals(cls, flow):
-        totals = list(cls.objects.filter(flow=flow).values_list("node_uuid").annotate(replies=Sum("count")))
-        return {str(t[0]): t[1] for t in totals if t[1]}
+        def fetch(flow_ids):
+            totals = cls.objects.filter(flow_id__in=flow_ids).values_list("flow_id", "node_uuid")
+            totals_by_flow = {}
+            for flow_id, node_uuid, count in totals.annotate(replies=Sum("count")):
+                if count:
+                    totals_by_flow.setdefault(flow_id, {})[str(node_uuid)] = count
+            return totals_by_flow
+
+        return cls.get_cached_totals([flow.id], fetch)[flow.id] or {}
 
     class Meta:
         indexes = [
@@ -1579,6 +1638,7 @@ class ResultsExport(ExportType):
         with_groups=[],
         responded_only=True,
         extra_urns=[],
+        format=Export.FORMAT_XLSX,
     ):
         export = Export.objects.create(
             org=org,
@@ -1591,6 +1651,7 @@ class ResultsExport(ExportType):
                 "with_groups": [g.id for g in with_groups],
                 "responded_only": responded_only,
                 "extra_urns": extra_urns,
+                "format": format,
             },
             created_by=user,
         )
@@ -1620,10 +1681,44 @@ class ResultsExport(ExportType):
 
         return columns
 
+    def get_partitions(self, export) -> list:
+        return export.get_date_partitions()
+
+    def get_exporter(self, export):
+        flows = self.get_flows(export)
+        extra_urn_columns, result_fields = self._get_extra_columns(export, flows)
+
+        return export.get_exporter("Runs", self.get_runs_columns(export, extra_urn_columns, result_fields))
+
     def write(self, export) -> tuple:
+        exporter = self.get_exporter(export)
+        num_records = self.write_rows(export, exporter, *export.get_date_range())
+
+        return *exporter.save_file(), num_records
+
+    def write_rows(self, export, exporter, start_date, end_date) -> int:
         flows = self.get_flows(export)
-        start_date, end_date = export.get_date_range()
         responded_only = export.config.get("responded_only", True)
+        extra_urn_columns, result_fields = self._get_extra_columns(export, flows)
+        contact_cache = export.get_contact_cache(extra_urn_schemes=[c["scheme"] for c in extra_urn_columns])
+        num_records = 0
+
+        for batch in self._get_run_batches(export, start_date, end_date, flows, responded_only):
+            self._write_runs(export, exporter, contact_cache, batch, result_fields)
+
+            num_records += len(batch)
+
+            export.modified_on = timezone.now()
+            export.save(update_fields=("modified_on",))
+
+        logger.info(
+            f"Results export #{export.id} for org #{export.org.id}: wrote {num_records} runs, "
+            f"{contact_cache.get_stats()}"
+        )
+
+        return num_records
+
+    def _get_extra_columns(self, export, flows) -> tuple:
         extra_urns = export.config.get("extra_urns", [])
 
         result_fields = []
@@ -1641,21 +1736,7 @@ class ResultsExport(ExportType):
                 label = f"URN:{extra_urn.capitalize()}"
                 extra_urn_columns.append(dict(label=label, scheme=extra_urn))
 
-        runs_columns = self.get_runs_columns(export, extra_urn_columns, result_fields)
-
-        # create our exporter
-        exporter = MultiSheetExporter("Runs", runs_columns, export.org.timezone)
-        num_records = 0
-
-        for batch in self._get_run_batches(export, start_date, end_date, flows, responded_only):
-            self._write_runs(export, exporter, batch, extra_urn_columns, result_fields)
-
-            num_records += len(batch)
-
-            export.modified_on = timezone.now()
-            export.save(update_fields=("modified_on",))
-
-        return *exporter.save_file(), num_records
+        return extra_urn_columns, result_fields
 
     def _get_run_batches(self, export, start_date, end_date, flows, responded_only: bool):
         logger.info(f"Results export #{export.id} for org #{export.org.id}: fetching runs from archives to export...")
@@ -1673,65 +1754,70 @@ class ResultsExport(ExportType):
         where = {"flow__uuid__in": flow_uuids}
         if responded_only:
             where["responded"] = True
-        records = Archive.iter_all_records(
-            export.org, Archive.TYPE_FLOWRUN, after=max(earliest_created_on, start_date), before=end_date, where=where
-        )
-        seen = set()
+        after = max(earliest_created_on, start_date)
+
+        # runs are archived by modified_on so any run modified before the end of the last covering archive might also
+        # exist in an archive, and these are the only runs we need to check for duplicates
+        covering = Archive._get_covering_period(export.org, Archive.TYPE_FLOWRUN, after, end_date)
+        covered_until = max((a.get_end_date() for a in covering), default=None)
+        if covered_until:
+            covered_until = datetime.combine(covered_until, time.min, tzinfo=tzone.utc)
+
+        runs = FlowRun.objects.filter(created_on__gte=start_date, created_on__lte=end_date, flow__in=flows)
+        if responded_only:
+            runs = runs.filter(responded=True)
+        runs = runs.prefetch_related(
+            Prefetch("contact", Contact.objects.only("uuid", "name")),
+            Prefetch("flow", Flow.objects.only("uuid", "name")),
+        ).using("readonly")
+
+        # the ids of runs before that boundary are kept as a sorted array with a flag for each which is set when the
+        # run is found in an archive, as that takes a fraction of the memory of a set of ids
+        boundary_ids = array("q")
+        if covered_until:
+            boundary_ids.extend(
+                runs.filter(modified_on__lt=covered_until)
+                .order_by("id")
+                .values_list("id", flat=True)
+                .iterator(chunk_size=10000)
+            )
+        archived = bytearray(len(boundary_ids))
+
+        records = Archive.iter_all_records(export.org, Archive.TYPE_FLOWRUN, after=after, before=end_date, where=where)
 
         for record_batch in chunk_list(records, 1000):
             matching = []
             for record in record_batch:
-                seen.add(record["id"])
+                i = bisect_left(boundary_ids, record["id"])
+                if i < len(boundary_ids) and boundary_ids[i] == record["id"]:
+                    archived[i] = 1
                 matching.append(record)
             yield matching
 
-        # secondly get runs from database
-        runs = (
-            FlowRun.objects.filter(created_on__gte=start_date, created_on__lte=end_date, flow__in=flows)
-            .order_by("modified_on")
-            .using("readonly")
-        )
-        if responded_only:
-            runs = runs.filter(responded=True)
-        run_ids = array(str("l"), runs.values_list("id", flat=True))
+        # secondly get runs from database, starting with any before the boundary that weren't found in archives
+        logger.info(f"Results export #{export.id} for org #{export.org.id}: fetching runs from database to export...")
 
-        logger.info(
-            f"Results export #{export.id} for org #{export.org.id}: found {len(run_ids)} runs in database to export"
-        )
+        unarchived_ids = (run_id for run_id, found in zip(boundary_ids, archived) if not found)
 
-        for id_batch in chunk_list(run_ids, 1000):
-            run_batch = (
-                FlowRun.objects.filter(id__in=id_batch)
-                .order_by("modified_on", "id")
-                .prefetch_related(
-                    Prefetch("contact", Contact.objects.only("uuid", "name")),
-                    Prefetch("flow", Flow.objects.only("uuid", "name")),
-                )
-                .using("readonly")
-            )
+        for id_batch in chunk_list(unarchived_ids, 1000):
+            run_batch = runs.filter(id__in=id_batch).order_by("modified_on", "id")
 
             # convert this batch of runs to same format as records in our archives
-            yield [run.as_archive_json() for run in run_batch if run.id not in seen]
+            yield [run.as_archive_json() for run in run_batch]
+
+        if covered_until:
+            runs = runs.filter(modified_on__gte=covered_until)
 
-    def _write_runs(self, export, exporter, runs, extra_urn_columns, result_fields):
+        for run_batch in iter_keyset_batches(runs, ("modified_on", "id"), batch_size=1000):
+            yield [run.as_archive_json() for run in run_batch]
+
+    def _write_runs(self, export, exporter, contact_cache, runs, result_fields):
         """
         Writes a batch of run JSON blobs to the export
         """
-        # get all the contacts referenced in this batch
-        contact_uuids = {r["contact"]["uuid"] for r in runs}
-        contacts = (
-            Contact.objects.filter(org=export.org, uuid__in=contact_uuids)
-            .select_related("org")
-            .prefetch_related("groups")
-            .using("readonly")
-        )
-        contacts_by_uuid = {str(c.uuid): c for c in contacts}
-
-        Contact.bulk_urn_cache_initialize(contacts, using="readonly")
+        contact_cache.prepare(r["contact"]["uuid"] for r in runs)
 
         for run in runs:
-            contact = contacts_by_uuid.get(run["contact"]["uuid"])
-
             # get this run's results by node name(ruleset label)
             run_values = run["values"]
             if isinstance(run_values, list):
@@ -1739,14 +1825,8 @@ class ResultsExport(ExportType):
             else:
                 results_by_key = {key: result for key, result in run_values.items()}
 
-            # generate contact info columns
-            contact_values = export.get_contact_columns(contact)
-
-            for extra_urn_column in extra_urn_columns:
-                urn_display = contact.get_urn_display(
-                    org=export.org, formatted=False, scheme=extra_urn_column["scheme"]
-                )
-                contact_values.append(urn_display)
+            # generate contact info columns, including any extra URN columns
+            contact_values = contact_cache.get_columns(run["contact"]["uuid"])
 
             # generate result columns for each ruleset
             result_values = []
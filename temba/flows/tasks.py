@@ -5,16 +5,16 @@ from datetime import datetime, timedelta, timezone as tzone
 from celery import shared_task
 from django_redis import get_redis_connection
 
-from django.conf import settings
 from django.db.models import F
 from django.utils import timezone
 from django.utils.timesince import timesince
 
 from temba import mailroom
-from temba.utils import chunk_list
+from temba.utils import analytics, chunk_list
 from temba.utils.crons import cron_task
-from temba.utils.models import delete_in_batches
+from temba.utils.models import RetentionPolicy
 
+from .cache import definition_cache
 from .models import (
     Flow,
     FlowCategoryCount,
@@ -46,11 +46,25 @@ def update_session_wait_expires(flow_id):
 
 @cron_task(lock_timeout=7200)
 def squash_flow_counts():
-    FlowNodeCount.squash()
-    FlowRunStatusCount.squash()
-    FlowCategoryCount.squash()
-    FlowStartCount.squash()
-    FlowPathCount.squash()
+    return {
+        m.__name__: m.schedule_squash()
+        for m in (FlowNodeCount, FlowRunStatusCount, FlowCategoryCount, FlowStartCount, FlowPathCount)
+    }
+
+
+@cron_task()
+def report_flow_definition_cache():
+    stats = definition_cache.pop_stats()
+
+    analytics.gauges(
+        {
+            "temba.flow_definition_cache_hit_rate": stats["hit_rate"],
+            "temba.flow_definition_load_p50": stats["p50_ms"],
+            "temba.flow_definition_load_p99": stats["p99_ms"],
+        }
+    )
+
+    return stats
 
 
 @cron_task()
@@ -106,12 +120,8 @@ def trim_flow_sessions():
     Cleanup ended flow sessions
     """
 
-    trim_before = timezone.now() - settings.RETENTION_PERIODS["flowsession"]
-
     def pre_delete(session_ids):
         # detach any flows runs that belong to these sessions
         FlowRun.objects.filter(session_id__in=session_ids).update(session_id=None)
 
-    num_deleted = delete_in_batches(FlowSession.objects.filter(ended_on__lte=trim_before), pre_delete=pre_delete)
-
-    return {"deleted": num_deleted}
+    return RetentionPolicy("flowsession", FlowSession, "ended_on", pre_delete=pre_delete).apply()
@@ -17,7 +17,7 @@ from temba.api.models import Resthook
 from temba.archives.models import Archive
 from temba.campaigns.models import Campaign, CampaignEvent
 from temba.classifiers.models import Classifier
-from temba.contacts.models import URN, Contact, ContactField, ContactGroup, ContactURN
+from temba.contacts.models import URN, Contact, ContactField, ContactGroup
 from temba.globals.models import Global
 from temba.msgs.models import SystemLabel, SystemLabelCount
 from temba.orgs.integrations.dtone import DTOneType
@@ -31,6 +31,7 @@ from temba.utils import json, s3
 from temba.utils.uuid import uuid4
 from temba.utils.views.mixins import TEMBA_MENU_SELECTION
 
+from .cache import definition_cache
 from .checks import mailroom_url
 from .models import (
     Flow,
@@ -50,6 +51,7 @@ from .models import (
 )
 from .tasks import (
     interrupt_flow_sessions,
+    report_flow_definition_cache,
     squash_flow_counts,
     trim_flow_revisions,
     trim_flow_sessions,
@@ -152,6 +154,76 @@ class FlowTest(TembaTest, CRUDLTestMixin):
         favorites.revisions.all().delete()
         self.assertRaises(AssertionError, favorites.get_definition)
 
+    @patch("temba.flows.cache.STATS_FLUSH_INTERVAL", 3600)
+    def test_definition_cache(self):
+        flow = self.create_flow("Test")
+
+        # first load is a miss so also fetches the definition from the database
+        with self.assertNumQueries(2):
+            definition = flow.get_definition()
+
+        self.assertEqual("Test", definition["name"])
+        self.assertEqual(1, definition["revision"])
+
+        # definitions returned are copies so can be modified
+        definition["nodes"] = []
+
+        # second load is a local hit
+        with self.assertNumQueries(1):
+            definition = flow.get_definition()
+
+        self.assertEqual(1, len(definition["nodes"]))
+
+        # which is also a copy
+        definition["nodes"][0]["actions"] = []
+        self.assertEqual(1, len(flow.get_definition()["nodes"][0]["actions"]))
+
+        # as is load from another process which only has the redis level
+        definition_cache.clear_local()
+
+        with self.assertNumQueries(1):
+            definition = flow.get_definition()
+
+        self.assertEqual(1, len(definition["nodes"]))
+
+        r = get_redis_connection()
+        self.assertEqual({b"1:13.5.0"}, set(r.hkeys(f"flow_definitions:{flow.uuid}")))
+
+        # saving a new revision invalidates the cache
+        flow.save_revision(self.admin, definition)
+
+        self.assertFalse(r.exists(f"flow_definitions:{flow.uuid}"))
+        self.assertEqual(2, flow.get_definition()["revision"])
+
+        # migrated definitions of old revisions are also cached
+        rev = flow.revisions.get(revision=1)
+        rev.spec_version = "13.0.0"
+        rev.save(update_fields=("spec_version",))
+
+        with patch("temba.flows.models.Flow.migrate_definition", wraps=Flow.migrate_definition) as mock_migrate:
+            self.assertEqual(1, rev.get_migrated_definition()["revision"])
+            self.assertEqual(1, rev.get_migrated_definition()["revision"])
+            self.assertEqual(1, mock_migrate.call_count)
+
+        # stats are accumulated in process until flushed to redis
+        self.assertEqual(0, definition_cache.pop_stats()["misses"])
+
+        definition_cache.flush_stats()
+
+        stats = report_flow_definition_cache()
+        self.assertEqual(3, stats["local_hits"])
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(3, stats["misses"])
+        self.assertAlmostEqual(4 / 7, stats["hit_rate"])
+        self.assertGreater(stats["p99_ms"], 0)
+        self.assertGreaterEqual(stats["p99_ms"], stats["p50_ms"])
+
+        # popping the stats resets them, so each report only covers the lookups since the last
+        self.assertEqual(
+            {"local_hits": 0, "hits": 0, "misses": 0, "hit_rate": 0.0, "p50_ms": 0.0, "p99_ms": 0.0},
+            report_flow_definition_cache(),
+        )
+
     def test_ensure_current_version(self):
         # importing migrates to latest spec version
         flow = self.get_flow("favorites_v13")
@@ -3163,6 +3235,7 @@ class FlowCRUDLTest(TembaTest, CRUDLTestMixin):
                 "with_fields": [gender.id],
                 "extra_urns": [],
                 "responded_only": False,
+                "format": "xlsx",
             },
             export.config,
         )
@@ -3907,7 +3980,6 @@ class ResultsExportTest(TembaTest):
         readonly_models = {FlowRun}
         if has_results:
             readonly_models.add(Contact)
-            readonly_models.add(ContactURN)
 
         export = ResultsExport.create(
             self.org,
@@ -4036,7 +4108,7 @@ class ResultsExportTest(TembaTest):
         for run in (contact1_run1, contact2_run1, contact3_run1, contact1_run2, contact2_run2):
             run.refresh_from_db()
 
-        with self.assertNumQueries(23):
+        with self.assertNumQueries(17):
             workbook = self._export(
                 flow,
                 start_date=today - timedelta(days=7),
@@ -4176,7 +4248,7 @@ class ResultsExportTest(TembaTest):
         )
 
         # test without unresponded
-        with self.assertNumQueries(21):
+        with self.assertNumQueries(17):
             workbook = self._export(
                 flow,
                 start_date=today - timedelta(days=7),
@@ -4251,7 +4323,7 @@ class ResultsExportTest(TembaTest):
         )
 
         # test export with a contact field
-        with self.assertNumQueries(25):
+        with self.assertNumQueries(19):
             workbook = self._export(
                 flow,
                 start_date=today - timedelta(days=7),
@@ -4425,7 +4497,7 @@ class ResultsExportTest(TembaTest):
 
         contact1_run1, contact2_run1, contact3_run1, contact1_run2, contact2_run2 = FlowRun.objects.order_by("id")
 
-        with self.assertNumQueries(17):
+        with self.assertNumQueries(15):
             workbook = self._export(flow, start_date=today - timedelta(days=7), end_date=today)
 
         tz = self.org.timezone
@@ -5006,6 +5078,32 @@ class ResultsExportTest(TembaTest):
             tz,
         )
 
+    def test_from_archives_not_yet_deleted(self):
+        today = timezone.now().astimezone(self.org.timezone).date()
+
+        flow = self.get_flow("color_v13")
+        flow_nodes = flow.get_definition()["nodes"]
+
+        run = (
+            MockSessionWriter(self.contact, flow)
+            .visit(flow_nodes[0])
+            .send_msg("What is your favorite color?", self.channel)
+            .visit(flow_nodes[4])
+            .wait()
+            .save()
+        ).session.runs.get()
+        run.refresh_from_db()
+
+        # archive the run but leave it in the database, as happens until the archive's rows are deleted
+        self.create_archive(Archive.TYPE_FLOWRUN, "D", timezone.now().date(), [run.as_archive_json()])
+
+        workbook = self._export(flow, start_date=today - timedelta(days=7), end_date=today)
+
+        # check the run is only exported once
+        rows = list(workbook.worksheets[0].rows)
+        self.assertEqual(2, len(rows))
+        self.assertEqual(str(run.uuid), rows[1][7].value)
+
     def test_no_responses(self):
         today = timezone.now().astimezone(self.org.timezone).date()
         flow = self.create_flow("Test")
@@ -313,7 +313,7 @@ class FlowCRUDL(SmartCRUDL):
             # build a list of valid revisions to display
             revisions = []
 
-            for revision in flow.revisions.all().order_by("-revision")[:100]:
+            for revision in flow.revisions.defer("definition").order_by("-revision")[:100]:
                 revision_version = Version(revision.spec_version)
 
                 # our goflow revisions are already validated
@@ -1,4 +1,7 @@
 import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
 
 import requests
@@ -10,7 +13,14 @@ from temba.msgs.models import Broadcast
 from temba.utils import json
 
 from ..modifiers import Modifier
-from .exceptions import FlowValidationException, QueryValidationException, RequestException, URNValidationException
+from .exceptions import (
+    CircuitOpenException,
+    FlowValidationException,
+    QueryValidationException,
+    RequestException,
+    URNValidationException,
+)
+from .transport import circuit_breaker, get_session, latency_histogram
 from .types import (
     ContactSpec,
     Exclusions,
@@ -33,6 +43,26 @@ class MailroomClient:
 
     default_headers = {"User-Agent": "Temba"}
 
+    # endpoints which don't change state and so can be safely retried
+    idempotent_endpoints = {
+        "contact/export",
+        "contact/export_preview",
+        "contact/inspect",
+        "contact/parse_query",
+        "contact/search",
+        "contact/urns",
+        "flow/change_language",
+        "flow/clone",
+        "flow/inspect",
+        "flow/migrate",
+        "flow/start_preview",
+        "msg/broadcast_preview",
+        "po/export",
+    }
+
+    # status codes of responses from a proxy when mailroom is briefly unavailable
+    retry_statuses = {502, 503, 504}
+
     def __init__(self, base_url, auth_token):
         self.base_url = base_url
         self.headers = self.default_headers.copy()
@@ -44,29 +74,57 @@ class MailroomClient:
 
     def android_event(self, org, channel, phone: str, event_type: str, extra: dict, occurred_on):
         return self._request(
+            "android/event", self._android_event_payload(org, channel, phone, event_type, extra, occurred_on)
+        )
+
+    def android_event_many(self, org, channel, events: list[dict]) -> list:
+        """
+        Creates several channel events, returning the results in the same order. Events from different phone numbers are
+        sent concurrently but those from the same phone number are sent in order. Any event whose phone number isn't a
+        valid URN gets a URNValidationException in place of its result.
+        """
+        return self._request_many(
             "android/event",
-            {
-                "org_id": org.id,
-                "channel_id": channel.id,
-                "phone": phone,
-                "event_type": event_type,
-                "extra": extra,
-                "occurred_on": occurred_on.isoformat(),
-            },
+            [self._android_event_payload(org, channel, **e) for e in events],
+            catch=(URNValidationException,),
+            serialize_by=lambda p: p["phone"],
         )
 
+    def _android_event_payload(self, org, channel, phone: str, event_type: str, extra: dict, occurred_on) -> dict:
+        return {
+            "org_id": org.id,
+            "channel_id": channel.id,
+            "phone": phone,
+            "event_type": event_type,
+            "extra": extra,
+            "occurred_on": occurred_on.isoformat(),
+        }
+
     def android_message(self, org, channel, phone: str, text: str, received_on):
-        return self._request(
+        return self._request("android/message", self._android_message_payload(org, channel, phone, text, received_on))
+
+    def android_message_many(self, org, channel, messages: list[dict]) -> list:
+        """
+        Creates several incoming messages, returning the results in the same order. Messages from different phone numbers
+        are sent concurrently but those from the same phone number are sent in order so that they're handled in order.
+        Any message whose phone number isn't a valid URN gets a URNValidationException in place of its result.
+        """
+        return self._request_many(
             "android/message",
-            {
-                "org_id": org.id,
-                "channel_id": channel.id,
-                "phone": phone,
-                "text": text,
-                "received_on": received_on.isoformat(),
-            },
+            [self._android_message_payload(org, channel, **m) for m in messages],
+            catch=(URNValidationException,),
+            serialize_by=lambda p: p["phone"],
         )
 
+    def _android_message_payload(self, org, channel, phone: str, text: str, received_on) -> dict:
+        return {
+            "org_id": org.id,
+            "channel_id": channel.id,
+            "phone": phone,
+            "text": text,
+            "received_on": received_on.isoformat(),
+        }
+
     def android_sync(self, channel):
         return self._request("android/sync", {"channel_id": channel.id})
 
@@ -146,25 +204,52 @@ class MailroomClient:
     def flow_clone(self, definition: dict, dependency_mapping):
         return self._request("flow/clone", {"flow": definition, "dependency_mapping": dependency_mapping})
 
+    def flow_clone_many(self, definitions: list[dict], dependency_mapping) -> list[dict]:
+        """
+        Clones several flow definitions concurrently, returning the clones in the same order
+        """
+        return self._request_many(
+            "flow/clone", [{"flow": d, "dependency_mapping": dependency_mapping} for d in definitions]
+        )
+
     def flow_inspect(self, org, definition: dict):
+        return self._request("flow/inspect", self._flow_inspect_payload(org, definition), encode_json=True)
+
+    def flow_inspect_many(self, org, definitions: list[dict]) -> list[dict]:
+        """
+        Inspects several flow definitions concurrently, returning the results in the same order
+        """
+        return self._request_many(
+            "flow/inspect", [self._flow_inspect_payload(org, d) for d in definitions], encode_json=True
+        )
+
+    def _flow_inspect_payload(self, org, definition: dict) -> dict:
         payload = {"flow": definition}
 
         # can't do dependency checking during tests because mailroom can't see unit test data created in a transaction
         if not settings.TESTING:
             payload["org_id"] = org.id
 
-        return self._request("flow/inspect", payload, encode_json=True)
+        return payload
 
     def flow_migrate(self, definition: dict, to_version=None):
         """
         Migrates a flow definition to the specified spec version
         """
+        return self.flow_migrate_many([definition], to_version)[0]
+
+    def flow_migrate_many(self, definitions: list[dict], to_version=None) -> list[dict]:
+        """
+        Migrates several flow definitions concurrently to the specified spec version, returning them in the same order
+        """
         from temba.flows.models import Flow
 
         if not to_version:  # pragma: no cover
             to_version = Flow.CURRENT_SPEC_VERSION
 
-        return self._request("flow/migrate", {"flow": definition, "to_version": to_version}, encode_json=True)
+        return self._request_many(
+            "flow/migrate", [{"flow": d, "to_version": to_version} for d in definitions], encode_json=True
+        )
 
     def flow_start_preview(self, org, flow, include: Inclusions, exclude: Exclusions) -> RecipientsPreview:
         resp = self._request(
@@ -336,6 +421,41 @@ class MailroomClient:
     def test_errors(self, log, ret, panic):  # pragma: no cover
         return self._request("test_errors", {"log": log, "ret": ret, "panic": panic})
 
+    def _request_many(self, endpoint, payloads: list, encode_json=False, catch: tuple = (), serialize_by=None) -> list:
+        """
+        Makes requests to the same endpoint with several payloads. If there's more than one, they're made concurrently
+        so that a batch takes as long as the slowest request rather than the sum of all of them. Payloads with the same
+        value of `serialize_by` are sent one at a time in their original order. Exceptions of the types in `catch` are
+        returned in place of the results of the requests that raised them rather than failing the batch.
+        """
+
+        def request(payload):
+            try:
+                return self._request(endpoint, payload, encode_json=encode_json)
+            except catch as e:
+                return e
+
+        groups = defaultdict(list)
+        for i, payload in enumerate(payloads):
+            groups[serialize_by(payload) if serialize_by else i].append(i)
+
+        results = [None] * len(payloads)
+
+        def request_group(indexes: list):
+            for i in indexes:
+                results[i] = request(payloads[i])
+
+        if len(groups) <= 1:
+            for indexes in groups.values():
+                request_group(indexes)
+        else:
+            num_workers = min(settings.MAILROOM_BATCH_WORKERS, len(groups))
+
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                list(executor.map(request_group, groups.values()))
+
+        return results
+
     def _request(self, endpoint, payload=None, files=None, post=True, encode_json=False):
         if logger.isEnabledFor(logging.DEBUG):  # pragma: no cover
             logger.debug("=============== %s request ===============" % endpoint)
@@ -353,8 +473,32 @@ class MailroomClient:
         else:
             kwargs = dict(json=payload)
 
-        req_fn = requests.post if post else requests.get
-        response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=headers, **kwargs)
+        session = get_session()
+        req_fn = session.post if post else session.get
+        timeout = settings.MAILROOM_ENDPOINT_TIMEOUTS.get(endpoint, settings.MAILROOM_TIMEOUT)
+        retries = settings.MAILROOM_RETRIES if (endpoint in self.idempotent_endpoints or not post) else 0
+
+        for attempt in range(retries + 1):
+            if not circuit_breaker.allow():
+                raise CircuitOpenException(endpoint, payload)
+
+            start = time.perf_counter()
+            try:
+                response = req_fn(f"{self.base_url}/mr/{endpoint}", headers=headers, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                latency_histogram.observe(endpoint, time.perf_counter() - start)
+                circuit_breaker.record(False)
+
+                if attempt == retries:
+                    raise
+            else:
+                latency_histogram.observe(endpoint, time.perf_counter() - start)
+                circuit_breaker.record(response.status_code < 500)
+
+                if response.status_code not in self.retry_statuses or attempt == retries:
+                    break
+
+            time.sleep(settings.MAILROOM_RETRY_BACKOFF * (2**attempt))
 
         if response.headers.get("Content-Type") == "application/json":
             resp_body = response.json()
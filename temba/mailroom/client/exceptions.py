@@ -20,6 +20,18 @@ class RequestException(Exception):
         return self.error
 
 
+class CircuitOpenException(RequestException):
+    """
+    Request that wasn't made because recent requests to mailroom have been failing.
+    """
+
+    def __init__(self, endpoint, request):
+        self.endpoint = endpoint
+        self.request = request
+        self.response = None
+        self.error = "mailroom unavailable"
+
+
 class FlowValidationException(Exception):
     """
     Request that fails because the provided flow definition is invalid.
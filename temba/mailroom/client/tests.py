@@ -1,17 +1,29 @@
+import time
 from datetime import datetime, timezone as tzone
 from decimal import Decimal
 from unittest.mock import patch
 
+import requests
+from django_redis import get_redis_connection
+
 from django.test import override_settings
 
 from temba.schedules.models import Schedule
 from temba.tests import MockJsonResponse, MockResponse, TembaTest
 from temba.tickets.models import Topic
 from temba.utils import json
+from temba.utils.tasks import report_mailroom_latency
 
 from .. import modifiers
 from .client import MailroomClient
-from .exceptions import FlowValidationException, QueryValidationException, RequestException, URNValidationException
+from .exceptions import (
+    CircuitOpenException,
+    FlowValidationException,
+    QueryValidationException,
+    RequestException,
+    URNValidationException,
+)
+from .transport import CircuitBreaker, LatencyHistogram, get_session
 from .types import ContactSpec, Exclusions, Inclusions, RecipientsPreview, ScheduleSpec, URNResult
 
 
@@ -22,13 +34,13 @@ class MailroomClientTest(TembaTest):
         self.client = MailroomClient("http://localhost:8090", "sesame")
 
     def test_version(self):
-        with patch("requests.get") as mock_get:
+        with patch("requests.Session.get") as mock_get:
             mock_get.return_value = MockJsonResponse(200, {"version": "5.3.4"})
             version = self.client.version()
 
         self.assertEqual("5.3.4", version)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_android_event(self, mock_post):
         mock_post.return_value = MockJsonResponse(200, {"id": 12345})
         response = self.client.android_event(
@@ -45,6 +57,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/android/event",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "channel_id": self.channel.id,
@@ -55,7 +68,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_android_message(self, mock_post):
         mock_post.return_value = MockJsonResponse(200, {"id": 12345})
         response = self.client.android_message(
@@ -71,6 +84,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/android/message",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "channel_id": self.channel.id,
@@ -80,7 +94,66 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    def test_android_message_many(self):
+        def mock_message(url, headers, timeout, json):
+            if json["phone"] == "xyz":
+                return MockJsonResponse(422, {"error": "not a number", "code": "urn:invalid", "extra": {"index": 0}})
+            return MockJsonResponse(200, {"id": len(json["text"])})
+
+        received_on = datetime(2024, 4, 1, 16, 28, 30, 0, tzone.utc)
+
+        with patch("requests.Session.post", side_effect=mock_message) as mock_post:
+            results = self.client.android_message_many(
+                self.org,
+                self.channel,
+                [
+                    {"phone": "+1234567890", "text": "hi", "received_on": received_on},
+                    {"phone": "xyz", "text": "hello", "received_on": received_on},
+                    {"phone": "+1234567890", "text": "howdy", "received_on": received_on},
+                ],
+            )
+
+        self.assertEqual(3, mock_post.call_count)
+        self.assertEqual({"id": 2}, results[0])
+        self.assertIsInstance(results[1], URNValidationException)
+        self.assertEqual({"id": 5}, results[2])
+
+        # messages from the same phone number are sent in order, even if an earlier one is slow
+        sent = []
+
+        def mock_slow_message(url, headers, timeout, json):
+            if json["text"] == "1":
+                time.sleep(0.05)
+            sent.append((json["phone"], json["text"]))
+            return MockJsonResponse(200, {"id": int(json["text"])})
+
+        with patch("requests.Session.post", side_effect=mock_slow_message):
+            results = self.client.android_message_many(
+                self.org,
+                self.channel,
+                [
+                    {"phone": "+1111111111", "text": "1", "received_on": received_on},
+                    {"phone": "+2222222222", "text": "2", "received_on": received_on},
+                    {"phone": "+1111111111", "text": "3", "received_on": received_on},
+                    {"phone": "+1111111111", "text": "4", "received_on": received_on},
+                ],
+            )
+
+        self.assertEqual([{"id": 1}, {"id": 2}, {"id": 3}, {"id": 4}], results)
+        self.assertEqual(["1", "3", "4"], [text for phone, text in sent if phone == "+1111111111"])
+
+        # other errors still fail the batch
+        with patch("requests.Session.post") as mock_post:
+            mock_post.return_value = MockJsonResponse(400, {"error": "bad"})
+
+            with self.assertRaises(RequestException):
+                self.client.android_event_many(
+                    self.org,
+                    self.channel,
+                    [{"phone": "+1234567890", "event_type": "mo_miss", "extra": {}, "occurred_on": received_on}],
+                )
+
+    @patch("requests.Session.post")
     def test_android_sync(self, mock_post):
         mock_post.return_value = MockJsonResponse(200, {"id": 12345})
         response = self.client.android_sync(
@@ -92,12 +165,13 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/android/sync",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "channel_id": self.channel.id,
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_create(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -112,6 +186,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/create",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -139,6 +214,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/create",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -153,7 +229,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_deindex(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -165,10 +241,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/deindex",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "contact_ids": [ann.id, bob.id]},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_export(self, mock_post):
         group = self.create_group("Doctors", contacts=[])
         mock_post.return_value = MockJsonResponse(200, {"contact_ids": [123, 234]})
@@ -179,10 +256,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/export",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=60,
             json={"org_id": self.org.id, "group_id": group.id, "query": "age = 42"},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_export_preview(self, mock_post):
         group = self.create_group("Doctors", contacts=[])
         mock_post.return_value = MockJsonResponse(200, {"total": 123})
@@ -193,10 +271,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/export_preview",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "group_id": group.id, "query": "age = 42"},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_inspect(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -208,10 +287,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/inspect",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "contact_ids": [ann.id, bob.id]},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_interrupt(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         mock_post.return_value = MockJsonResponse(200, {"sessions": 1})
@@ -222,10 +302,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/interrupt",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "user_id": self.admin.id, "contact_id": ann.id},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_modify(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         mock_post.return_value = MockJsonResponse(
@@ -270,6 +351,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/modify",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -289,7 +371,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_parse_query(self, mock_post):
         mock_post.return_value = MockJsonResponse(
             200, {"query": 'name ~ "frank"', "metadata": {"attributes": ["name"]}}
@@ -301,6 +383,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/parse_query",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"query": "frank", "org_id": self.org.id, "parse_only": False},
         )
 
@@ -309,7 +392,7 @@ class MailroomClientTest(TembaTest):
         with self.assertRaises(RequestException):
             self.client.contact_parse_query(self.org, "age > 10")
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_search(self, mock_post):
         group = self.create_group("Doctors", contacts=[])
 
@@ -329,6 +412,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/search",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "query": "frank",
                 "org_id": self.org.id,
@@ -340,7 +424,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_urns(self, mock_post):
         mock_post.return_value = MockJsonResponse(
             200, {"urns": [{"normalized": "tel:+1234", "contact_id": 345}, {"normalized": "webchat:3a2ef3"}]}
@@ -354,13 +438,14 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/contact/urns",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "urns": ["tel:+1234", "webchat:3a2ef3"]},
         )
 
     def test_flow_change_language(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockJsonResponse(200, {"language": "spa"})
             migrated = self.client.flow_change_language(flow_def, language="spa")
 
@@ -379,7 +464,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_inspect(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockJsonResponse(200, {"dependencies": []})
             info = self.client.flow_inspect(self.org, flow_def)
 
@@ -397,7 +482,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_migrate(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockJsonResponse(200, {"name": "Migrated!"})
             migrated = self.client.flow_migrate(flow_def, to_version="13.1.0")
 
@@ -412,10 +497,60 @@ class MailroomClientTest(TembaTest):
         )
         self.assertEqual({"flow": flow_def, "to_version": "13.1.0"}, json.loads(call[1]["data"]))
 
+    @override_settings(MAILROOM_BATCH_WORKERS=2)
+    def test_flow_inspect_many(self):
+        flow_defs = [{"name": "Flow 1"}, {"name": "Flow 2"}, {"name": "Flow 3"}]
+
+        def mock_inspect(url, headers, timeout, data):
+            return MockJsonResponse(200, {"name": json.loads(data)["flow"]["name"], "dependencies": []})
+
+        with patch("requests.Session.post", side_effect=mock_inspect) as mock_post:
+            infos = self.client.flow_inspect_many(self.org, flow_defs)
+
+            self.assertEqual(["Flow 1", "Flow 2", "Flow 3"], [i["name"] for i in infos])
+            self.assertEqual(3, mock_post.call_count)
+
+        for call in mock_post.call_args_list:
+            self.assertEqual(("http://localhost:8090/mr/flow/inspect",), call[0])
+            self.assertEqual("application/json", call[1]["headers"]["Content-Type"])
+
+        # a batch of one is just a regular request
+        with patch("requests.Session.post") as mock_post:
+            mock_post.return_value = MockJsonResponse(200, {"dependencies": []})
+
+            self.assertEqual([{"dependencies": []}], self.client.flow_inspect_many(self.org, flow_defs[:1]))
+
+        self.assertEqual([], self.client.flow_inspect_many(self.org, []))
+
+    def test_flow_migrate_many(self):
+        flow_defs = [{"name": "Flow 1"}, {"name": "Flow 2"}]
+
+        def mock_migrate(url, headers, timeout, data):
+            payload = json.loads(data)
+            return MockJsonResponse(200, {**payload["flow"], "spec_version": payload["to_version"]})
+
+        with patch("requests.Session.post", side_effect=mock_migrate):
+            migrated = self.client.flow_migrate_many(flow_defs, to_version="13.1.0")
+
+        self.assertEqual(
+            [{"name": "Flow 1", "spec_version": "13.1.0"}, {"name": "Flow 2", "spec_version": "13.1.0"}], migrated
+        )
+
+    def test_flow_clone_many(self):
+        flow_defs = [{"name": "Flow 1"}, {"name": "Flow 2"}]
+
+        def mock_clone(url, headers, timeout, json):
+            return MockJsonResponse(200, {**json["flow"], "cloned": True})
+
+        with patch("requests.Session.post", side_effect=mock_clone):
+            cloned = self.client.flow_clone_many(flow_defs, {"abc": "def"})
+
+        self.assertEqual([{"name": "Flow 1", "cloned": True}, {"name": "Flow 2", "cloned": True}], cloned)
+
     def test_flow_start_preview(self):
         flow = self.create_flow("Test Flow")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_resp = {"query": 'group = "Farmers" AND status = "active"', "total": 2345}
             mock_post.return_value = MockJsonResponse(200, mock_resp)
             preview = self.client.flow_start_preview(
@@ -433,6 +568,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/flow/start_preview",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "flow_id": flow.id,
@@ -450,7 +586,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_broadcast(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -482,6 +618,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/msg/broadcast",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -505,7 +642,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_broadcast_preview(self, mock_post):
         mock_resp = {"query": 'group = "Farmers" AND status = "active"', "total": 2345}
         mock_post.return_value = MockJsonResponse(200, mock_resp)
@@ -523,6 +660,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/msg/broadcast_preview",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "include": {
@@ -539,7 +677,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_handle(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         msg1 = self.create_incoming_msg(ann, "Hi")
@@ -552,10 +690,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/msg/handle",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "msg_ids": [msg1.id, msg2.id]},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_resend(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         msg1 = self.create_outgoing_msg(ann, "Hi")
@@ -568,10 +707,11 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/msg/resend",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id, "msg_ids": [msg1.id, msg2.id]},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_send(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         ticket = self.create_ticket(ann)
@@ -583,6 +723,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/msg/send",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -593,7 +734,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_org_deindex(self, mock_post):
         mock_post.return_value = MockJsonResponse(200, {})
         response = self.client.org_deindex(self.org)
@@ -603,6 +744,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/org/deindex",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={"org_id": self.org.id},
         )
 
@@ -610,7 +752,7 @@ class MailroomClientTest(TembaTest):
         flow1 = self.create_flow("Flow 1")
         flow2 = self.create_flow("Flow 2")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, 'msgid "Red"\nmsgstr "Rojo"\n\n')
             response = self.client.po_export(self.org, [flow1, flow2], "spa")
 
@@ -619,6 +761,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/po/export",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=60,
             json={"org_id": self.org.id, "flow_ids": [flow1.id, flow2.id], "language": "spa"},
         )
 
@@ -626,7 +769,7 @@ class MailroomClientTest(TembaTest):
         flow1 = self.create_flow("Flow 1")
         flow2 = self.create_flow("Flow 2")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockJsonResponse(200, {"flows": []})
             response = self.client.po_import(self.org, [flow1, flow2], "spa", b'msgid "Red"\nmsgstr "Rojo"\n\n')
 
@@ -635,11 +778,12 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/po/import",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=60,
             data={"org_id": self.org.id, "flow_ids": [flow1.id, flow2.id], "language": "spa"},
             files={"po": b'msgid "Red"\nmsgstr "Rojo"\n\n'},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_ticket_assign(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -653,6 +797,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/ticket/assign",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -661,7 +806,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_ticket_add_note(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -675,6 +820,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/ticket/add_note",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -683,7 +829,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_ticket_change_topic(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -698,6 +844,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/ticket/change_topic",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -706,7 +853,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_ticket_close(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -720,6 +867,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/ticket/close",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -728,7 +876,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_ticket_reopen(self, mock_post):
         ann = self.create_contact("Ann", urns=["tel:+12340000001"])
         bob = self.create_contact("Bob", urns=["tel:+12340000002"])
@@ -742,6 +890,7 @@ class MailroomClientTest(TembaTest):
         mock_post.assert_called_once_with(
             "http://localhost:8090/mr/ticket/reopen",
             headers={"User-Agent": "Temba", "Authorization": "Token sesame"},
+            timeout=15,
             json={
                 "org_id": self.org.id,
                 "user_id": self.admin.id,
@@ -749,7 +898,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_errors(self, mock_post):
         group = self.create_group("Doctors", contacts=[])
 
@@ -804,6 +953,157 @@ class MailroomClientTest(TembaTest):
         self.assertEqual("Bad Gateway", e.exception.error)
 
 
+class TransportTest(TembaTest):
+    def setUp(self):
+        super().setUp()
+
+        self.client = MailroomClient("http://localhost:8090", "sesame")
+
+    def test_get_session(self):
+        session = get_session()
+        self.assertEqual(session, get_session())
+
+        # a forked process gets its own session
+        with patch("os.getpid", return_value=-1):
+            self.assertNotEqual(session, get_session())
+
+    @override_settings(MAILROOM_RETRY_BACKOFF=0)
+    @patch("requests.Session.post")
+    def test_retries(self, mock_post):
+        group = self.create_group("Doctors", contacts=[])
+
+        # idempotent requests are retried after connection errors and gateway errors
+        mock_post.side_effect = [
+            requests.ConnectionError(),
+            MockResponse(503, "Service Unavailable"),
+            MockJsonResponse(200, {"query": "age > 10", "total": 0, "contact_ids": []}),
+        ]
+
+        results = self.client.contact_search(self.org, group, "age > 10", "-created_on")
+
+        self.assertEqual(0, results.total)
+        self.assertEqual(3, mock_post.call_count)
+
+        # but only so many times
+        mock_post.reset_mock()
+        mock_post.side_effect = [requests.Timeout(), requests.Timeout(), requests.Timeout()]
+
+        with self.assertRaises(requests.Timeout):
+            self.client.contact_search(self.org, group, "age > 10", "-created_on")
+
+        self.assertEqual(3, mock_post.call_count)
+
+        # other requests are never retried
+        mock_post.reset_mock()
+        mock_post.side_effect = [MockResponse(503, "Service Unavailable")]
+
+        with self.assertRaises(RequestException):
+            self.client.contact_deindex(self.org, [])
+
+        self.assertEqual(1, mock_post.call_count)
+
+    @override_settings(MAILROOM_RETRIES=0, MAILROOM_CIRCUIT_BREAKER_THRESHOLD=2, MAILROOM_CIRCUIT_BREAKER_RESET=30)
+    @patch("requests.Session.post")
+    def test_circuit_breaker(self, mock_post):
+        breaker = CircuitBreaker()
+
+        with patch("temba.mailroom.client.client.circuit_breaker", breaker):
+            mock_post.side_effect = requests.ConnectionError()
+
+            for i in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.client.contact_deindex(self.org, [])
+
+            # circuit is now open so requests fail without being made
+            with self.assertRaises(CircuitOpenException) as e:
+                self.client.contact_deindex(self.org, [])
+
+            self.assertEqual("mailroom unavailable", str(e.exception))
+            self.assertEqual(2, mock_post.call_count)
+
+            # until the reset period has passed and a single probe request can be tried
+            breaker.opened_at -= 30
+
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+
+            # if the probe fails the circuit stays open for another reset period
+            breaker.opened_at -= 30
+
+            with self.assertRaises(requests.ConnectionError):
+                self.client.contact_deindex(self.org, [])
+
+            with self.assertRaises(CircuitOpenException):
+                self.client.contact_deindex(self.org, [])
+
+            self.assertEqual(3, mock_post.call_count)
+
+            # if it succeeds the circuit closes again
+            breaker.opened_at -= 30
+            mock_post.side_effect = None
+            mock_post.return_value = MockJsonResponse(200, {})
+
+            self.client.contact_deindex(self.org, [])
+            self.client.contact_deindex(self.org, [])
+
+            self.assertEqual(5, mock_post.call_count)
+            self.assertIsNone(breaker.opened_at)
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        histogram.observe("contact/search", 0.004)
+        histogram.observe("contact/search", 0.030)
+        histogram.observe("contact/search", 0.120)
+        histogram.observe("flow/inspect", 20)
+        histogram.observe("foo/bar", 0.001)
+
+        # nothing written to redis until flushed
+        self.assertEqual({}, LatencyHistogram.pop_stats())
+
+        histogram.flush()
+        histogram.flush()
+
+        # endpoints not in the fixed set are counted together
+        stats = LatencyHistogram.pop_stats()
+        self.assertEqual({"contact/search", "flow/inspect", "other"}, set(stats.keys()))
+        self.assertEqual(3, stats["contact/search"]["count"])
+        self.assertEqual(50, stats["contact/search"]["p50_ms"])
+        self.assertEqual(250, stats["contact/search"]["p99_ms"])
+        self.assertEqual(1, stats["contact/search"]["buckets"]["le_10"])
+        self.assertEqual(1, stats["flow/inspect"]["count"])
+        self.assertIsNone(stats["flow/inspect"]["p50_ms"])
+        self.assertEqual(1, stats["flow/inspect"]["buckets"]["le_inf"])
+
+        # popping stats resets them
+        self.assertEqual({}, LatencyHistogram.pop_stats())
+
+        # requests are observed and flushed periodically
+        with patch("requests.Session.post") as mock_post, patch(
+            "temba.mailroom.client.transport.LATENCY_FLUSH_INTERVAL", 0
+        ), patch("temba.mailroom.client.client.latency_histogram", histogram):
+            mock_post.return_value = MockJsonResponse(200, {})
+            self.client.contact_deindex(self.org, [])
+
+        self.assertTrue(get_redis_connection().exists("mailroom_latency:contact/deindex"))
+
+        # and reported as gauges by a cron
+        histogram.observe("flow/inspect", 20)
+        histogram.flush()
+
+        with patch("temba.utils.analytics.gauges") as mock_gauges:
+            stats = report_mailroom_latency()
+
+        self.assertEqual({"contact/deindex", "flow/inspect"}, set(stats.keys()))
+        mock_gauges.assert_called_once_with(
+            {
+                "temba.mailroom_requests_contact_deindex": 1,
+                "temba.mailroom_latency_p50_contact_deindex": 10,
+                "temba.mailroom_latency_p99_contact_deindex": 10,
+                "temba.mailroom_requests_flow_inspect": 1,
+            }
+        )
+
+
 class QueryExceptionTest(TembaTest):
     def test_str(self):
         tests = (
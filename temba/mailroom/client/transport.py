@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+import requests
+from django_redis import get_redis_connection
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+LATENCY_KEY = "mailroom_latency"
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # upper bounds in milliseconds
+LATENCY_FLUSH_INTERVAL = 10  # seconds between writes of local counts to redis
+LATENCY_ENDPOINTS = (
+    "android/event",
+    "android/message",
+    "android/sync",
+    "contact/create",
+    "contact/deindex",
+    "contact/export",
+    "contact/export_preview",
+    "contact/inspect",
+    "contact/interrupt",
+    "contact/modify",
+    "contact/parse_query",
+    "contact/search",
+    "contact/urns",
+    "flow/change_language",
+    "flow/clone",
+    "flow/inspect",
+    "flow/migrate",
+    "flow/start_preview",
+    "msg/broadcast",
+    "msg/broadcast_preview",
+    "msg/handle",
+    "msg/resend",
+    "msg/send",
+    "org/deindex",
+    "po/export",
+    "po/import",
+    "sim/resume",
+    "sim/start",
+    "ticket/add_note",
+    "ticket/assign",
+    "ticket/change_topic",
+    "ticket/close",
+    "ticket/reopen",
+)
+LATENCY_OTHER = "other"  # endpoint that requests to any endpoint not listed above are counted under
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Gets the session for requests to mailroom. There's one per process so that connections in its pool are kept alive
+    and reused across requests, and a new one is created after a fork as connections can't be shared across processes.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.MAILROOM_POOL_SIZE)
+
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session_pid = os.getpid()
+
+        return _session
+
+
+class CircuitBreaker:
+    """
+    Opens after a number of consecutive failed requests so that further requests fail fast rather than each waiting on a
+    timeout. Once the reset period has passed a single probe request is allowed through, and the circuit closes again if
+    it succeeds. Disabled if the threshold is zero.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if not settings.MAILROOM_CIRCUIT_BREAKER_THRESHOLD or self.opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self.opened_at < settings.MAILROOM_CIRCUIT_BREAKER_RESET:
+                return False
+
+            # let this request through as the probe, and keep the circuit open for everything else until it records its
+            # result, or until another reset period has passed if it never does
+            self.opened_at = now
+            return True
+
+    def record(self, success: bool):
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+
+                threshold = settings.MAILROOM_CIRCUIT_BREAKER_THRESHOLD
+                if threshold and self.failures >= threshold:
+                    self.opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    """
+    Histograms of request latency by endpoint. Counts are accumulated in process and periodically added to counts in
+    redis, so that recording a request doesn't require its own redis call. Endpoints are limited to a fixed set so that
+    the counts in redis can be read without scanning for their keys.
+    """
+
+    def __init__(self):
+        self.counts = self._new_counts()
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, seconds: float):
+        bucket = bisect_left(LATENCY_BUCKETS, seconds * 1000)
+        if endpoint not in LATENCY_ENDPOINTS:
+            endpoint = LATENCY_OTHER
+
+        with self._lock:
+            self.counts[endpoint][bucket] += 1
+            flush_due = time.monotonic() - self.last_flush >= LATENCY_FLUSH_INTERVAL
+
+        if flush_due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, self._new_counts()
+            self.last_flush = time.monotonic()
+
+        if counts:
+            pipe = get_redis_connection().pipeline()
+            for endpoint, buckets in counts.items():
+                for bucket, count in enumerate(buckets):
+                    if count:
+                        pipe.hincrby(f"{LATENCY_KEY}:{endpoint}", self._label(bucket), count)
+            pipe.execute()
+
+    @classmethod
+    def pop_stats(cls) -> dict:
+        """
+        Gets and resets the latency histogram of each endpoint which has had requests since the last pop, along with p50
+        and p99 values, which are the upper bounds in milliseconds of the buckets they fall in, or None if they fall
+        beyond the largest bucket
+        """
+        endpoints = LATENCY_ENDPOINTS + (LATENCY_OTHER,)
+
+        pipe = get_redis_connection().pipeline()
+        for endpoint in endpoints:
+            pipe.hgetall(f"{LATENCY_KEY}:{endpoint}")
+            pipe.delete(f"{LATENCY_KEY}:{endpoint}")
+        results = pipe.execute()[::2]
+
+        stats = {}
+        for endpoint, raw in zip(endpoints, results):
+            if not raw:
+                continue
+
+            counts = {k.decode(): int(v) for k, v in raw.items()}
+            buckets = [counts.get(cls._label(b), 0) for b in range(len(LATENCY_BUCKETS) + 1)]
+            total = sum(buckets)
+
+            def percentile(p: int):
+                cumulative = 0
+                for bucket, count in enumerate(buckets):
+                    cumulative += count
+                    if cumulative >= total * p / 100:
+                        return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else None
+
+            stats[endpoint] = {
+                "count": total,
+                "p50_ms": percentile(50),
+                "p99_ms": percentile(99),
+                "buckets": {cls._label(b): c for b, c in enumerate(buckets)},
+            }
+
+        return stats
+
+    @staticmethod
+    def _new_counts():
+        return defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    @staticmethod
+    def _label(bucket: int) -> str:
+        return f"le_{LATENCY_BUCKETS[bucket]}" if bucket < len(LATENCY_BUCKETS) else "le_inf"
+
+
+circuit_breaker = CircuitBreaker()
+latency_histogram = LatencyHistogram()
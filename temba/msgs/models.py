@@ -2,7 +2,6 @@ import logging
 import mimetypes
 import os
 import re
-from array import array
 from dataclasses import dataclass
 from fnmatch import fnmatch
 from urllib.parse import unquote, urlparse
@@ -25,8 +24,7 @@ from temba.contacts.models import Contact, ContactGroup, ContactURN
 from temba.orgs.models import DependencyMixin, Export, ExportType, Org
 from temba.schedules.models import Schedule
 from temba.utils import chunk_list, languages, on_transaction_commit
-from temba.utils.export.models import MultiSheetExporter
-from temba.utils.models import JSONAsTextField, SquashableModel, TembaModel
+from temba.utils.models import JSONAsTextField, SquashableModel, TembaModel, iter_keyset_batches
 from temba.utils.s3 import public_file_storage
 from temba.utils.uuid import uuid4
 
@@ -795,13 +793,16 @@ class BroadcastMsgCount(SquashableModel):
 
     @classmethod
     def bulk_annotate(cls, broadcasts):
-        counts = (
-            cls.objects.filter(broadcast_id__in=[b.id for b in broadcasts])
-            .values("broadcast_id")
-            .order_by("broadcast_id")
-            .annotate(count=Sum("count"))
-        )
-        counts_by_bcast = {c["broadcast_id"]: c["count"] for c in counts}
+        def fetch(broadcast_ids):
+            counts = (
+                cls.objects.filter(broadcast_id__in=broadcast_ids)
+                .values("broadcast_id")
+                .order_by("broadcast_id")
+                .annotate(count=Sum("count"))
+            )
+            return {c["broadcast_id"]: c["count"] for c in counts}
+
+        counts_by_bcast = cls.get_cached_totals([b.id for b in broadcasts], fetch)
 
         for bcast in broadcasts:
             bcast.msg_count = counts_by_bcast.get(bcast.id, 0)
@@ -935,8 +936,16 @@ class SystemLabelCount(SquashableModel):
         """
         Gets all system label counts by type for the given org
         """
-        counts = cls.objects.filter(org=org).values_list("label_type").annotate(count_sum=Sum("count"))
-        counts_by_type = {c[0]: c[1] for c in counts}
+
+        def fetch(org_ids):
+            counts = cls.objects.filter(org_id__in=org_ids).values_list("org_id", "label_type")
+            counts = counts.annotate(count_sum=Sum("count"))
+            counts_by_org = {}
+            for org_id, label_type, count_sum in counts:
+                counts_by_org.setdefault(org_id, {})[label_type] = count_sum
+            return counts_by_org
+
+        counts_by_type = cls.get_cached_totals([org.id], fetch)[org.id] or {}
 
         # for convenience, include all label types
         return {lb: counts_by_type.get(lb, 0) for lb, n in SystemLabel.TYPE_CHOICES}
@@ -1055,12 +1064,16 @@ class LabelCount(SquashableModel):
         """
         Gets total counts for all the given labels
         """
-        counts = (
-            cls.objects.filter(label__in=labels, is_archived=False)
-            .values_list("label_id")
-            .annotate(count_sum=Sum("count"))
-        )
-        counts_by_label_id = {c[0]: c[1] for c in counts}
+
+        def fetch(label_ids):
+            counts = (
+                cls.objects.filter(label_id__in=label_ids, is_archived=False)
+                .values_list("label_id")
+                .annotate(count_sum=Sum("count"))
+            )
+            return {c[0]: c[1] for c in counts}
+
+        counts_by_label_id = cls.get_cached_totals([lb.id for lb in labels], fetch)
         return {lb: counts_by_label_id.get(lb.id, 0) for lb in labels}
 
 
@@ -1086,41 +1099,6 @@ class OptIn(TembaModel):
         constraints = [models.UniqueConstraint("org", Lower("name"), name="unique_optin_names")]
 
 
-class MsgIterator:
-    """
-    Queryset wrapper to chunk queries and reduce in-memory footprint
-    """
-
-    def __init__(self, ids, order_by=None, select_related=None, prefetch_related=None, max_obj_num=1000):
-        self._ids = ids
-        self._order_by = order_by
-        self._select_related = select_related
-        self._prefetch_related = prefetch_related
-        self._generator = self._setup()
-        self.max_obj_num = max_obj_num
-
-    def _setup(self):
-        for i in range(0, len(self._ids), self.max_obj_num):
-            chunk_queryset = Msg.objects.filter(id__in=self._ids[i : i + self.max_obj_num])
-
-            if self._order_by:
-                chunk_queryset = chunk_queryset.order_by(*self._order_by)
-
-            if self._select_related:
-                chunk_queryset = chunk_queryset.select_related(*self._select_related)
-
-            if self._prefetch_related:
-                chunk_queryset = chunk_queryset.prefetch_related(*self._prefetch_related)
-
-            yield chunk_queryset
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return next(self._generator)
-
-
 class MessageExport(ExportType):
     """
     Export of messages
@@ -1132,7 +1110,18 @@ class MessageExport(ExportType):
     download_template = "msgs/export_download.html"
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, system_label=None, label=None, with_fields=(), with_groups=()):
+    def create(
+        cls,
+        org,
+        user,
+        start_date,
+        end_date,
+        system_label=None,
+        label=None,
+        with_fields=(),
+        with_groups=(),
+        format=Export.FORMAT_XLSX,
+    ):
         export = Export.objects.create(
             org=org,
             export_type=cls.slug,
@@ -1143,6 +1132,7 @@ class MessageExport(ExportType):
                 "label_uuid": str(label.uuid) if label else None,
                 "with_fields": [f.id for f in with_fields],
                 "with_groups": [g.id for g in with_groups],
+                "format": format,
             },
             created_by=user,
         )
@@ -1156,23 +1146,31 @@ class MessageExport(ExportType):
         else:
             return system_label, None
 
-    def write(self, export):
-        system_label, label = self.get_folder(export)
-        start_date, end_date = export.get_date_range()
+    def get_partitions(self, export) -> list:
+        return export.get_date_partitions()
 
-        # create our exporter
-        exporter = MultiSheetExporter(
+    def get_exporter(self, export):
+        return export.get_exporter(
             "Messages",
             ["Date"]
             + export.get_contact_headers()
             + ["Flow", "Direction", "Text", "Attachments", "Status", "Channel", "Labels"],
-            export.org.timezone,
         )
+
+    def write(self, export):
+        exporter = self.get_exporter(export)
+        num_records = self.write_rows(export, exporter, *export.get_date_range())
+
+        return *exporter.save_file(), num_records
+
+    def write_rows(self, export, exporter, start_date, end_date) -> int:
+        system_label, label = self.get_folder(export)
+        contact_cache = export.get_contact_cache()
         num_records = 0
         logger.info(f"starting msgs export #{export.id} for org #{export.org.id}")
 
         for batch in self._get_msg_batches(export, system_label, label, start_date, end_date):
-            self._write_msgs(export, exporter, batch)
+            self._write_msgs(export, exporter, contact_cache, batch)
 
             num_records += len(batch)
 
@@ -1180,7 +1178,12 @@ class MessageExport(ExportType):
             export.modified_on = timezone.now()
             export.save(update_fields=("modified_on",))
 
-        return *exporter.save_file(), num_records
+        logger.info(
+            f"finished msgs export #{export.id} for org #{export.org.id}: {num_records} records, "
+            f"{contact_cache.get_stats()}"
+        )
+
+        return num_records
 
     def _get_msg_batches(self, export, system_label, label, start_date, end_date):
         from temba.archives.models import Archive
@@ -1190,7 +1193,7 @@ class MessageExport(ExportType):
         if system_label:
             where = SystemLabel.get_archive_query(system_label)
         elif label:
-            where = {"visibility": "visible", "__raw__": f"'{label.uuid}' IN s.labels[*].uuid"}
+            where = {"visibility": "visible", "labels__uuid__contains": str(label.uuid)}
         else:
             where = {"visibility": "visible"}
 
@@ -1215,44 +1218,32 @@ class MessageExport(ExportType):
             messages = export.org.msgs.filter(visibility=Msg.VISIBILITY_VISIBLE)
 
         messages = messages.filter(created_on__gte=start_date, created_on__lte=end_date)
-
-        messages = messages.order_by("created_on").using("readonly")
         if last_created_on:
             messages = messages.filter(created_on__gt=last_created_on)
 
-        all_message_ids = array(str("l"), messages.values_list("id", flat=True))
-
-        for msg_batch in MsgIterator(
-            all_message_ids,
-            order_by=("created_on",),
-            select_related=("channel", "contact_urn"),
-            prefetch_related=(
+        messages = (
+            messages.select_related("channel", "contact_urn")
+            .prefetch_related(
                 Prefetch("contact", queryset=Contact.objects.only("uuid", "name")),
                 Prefetch("flow", queryset=Flow.objects.only("uuid", "name")),
                 Prefetch("labels", queryset=Label.objects.only("uuid", "name").order_by("name")),
-            ),
-        ):
+            )
+            .using("readonly")
+        )
+
+        for msg_batch in iter_keyset_batches(messages, ("created_on", "id"), batch_size=1000):
             # convert this batch of msgs to same format as records in our archives
             yield [msg.as_archive_json() for msg in msg_batch]
 
-    def _write_msgs(self, export, exporter, msgs):
-        # get all the contacts referenced in this batch
-        contact_uuids = {m["contact"]["uuid"] for m in msgs}
-        contacts = (
-            Contact.objects.filter(org=export.org, uuid__in=contact_uuids)
-            .select_related("org")
-            .prefetch_related("groups")
-            .using("readonly")
-        )
-        contacts_by_uuid = {str(c.uuid): c for c in contacts}
+    def _write_msgs(self, export, exporter, contact_cache, msgs):
+        contact_cache.prepare(m["contact"]["uuid"] for m in msgs)
 
         for msg in msgs:
-            contact = contacts_by_uuid.get(msg["contact"]["uuid"])
             flow = msg.get("flow")
 
             exporter.write_row(
                 [iso8601.parse_date(msg["created_on"])]
-                + export.get_contact_columns(contact, urn=msg["urn"])
+                + contact_cache.get_columns(msg["contact"]["uuid"], urn=msg["urn"])
                 + [
                     flow["name"] if flow else None,
                     msg["direction"].upper() if msg["direction"] else None,
@@ -32,9 +32,7 @@ def fail_old_android_messages():
 
 @cron_task(lock_timeout=7200)
 def squash_msg_counts():
-    SystemLabelCount.squash()
-    LabelCount.squash()
-    BroadcastMsgCount.squash()
+    return {m.__name__: m.schedule_squash() for m in (SystemLabelCount, LabelCount, BroadcastMsgCount)}
 
 
 @shared_task
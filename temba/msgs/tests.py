@@ -2,6 +2,7 @@ import json
 from datetime import date, datetime, timedelta, timezone as tzone
 from unittest.mock import call, patch
 
+from django_redis import get_redis_connection
 from openpyxl import load_workbook
 
 from django.conf import settings
@@ -889,7 +890,13 @@ class MsgCRUDLTest(TembaTest, CRUDLTestMixin):
         self.assertEqual(date(2022, 6, 28), export.start_date)
         self.assertEqual(date(2022, 9, 28), export.end_date)
         self.assertEqual(
-            {"with_groups": [testers.id], "with_fields": [gender.id], "label_uuid": None, "system_label": "I"},
+            {
+                "with_groups": [testers.id],
+                "with_fields": [gender.id],
+                "label_uuid": None,
+                "system_label": "I",
+                "format": "xlsx",
+            },
             export.config,
         )
 
@@ -913,11 +920,13 @@ class MsgCRUDLTest(TembaTest, CRUDLTestMixin):
                 "with_fields": [gender.id],
                 "label_uuid": str(label.uuid),
                 "system_label": None,
+                "format": "xlsx",
             },
             export.config,
         )
 
 
+@override_settings(EXPORT_PARTITION_DAYS=0)
 class MessageExportTest(TembaTest):
     def setUp(self):
         super().setUp()
@@ -1021,7 +1030,7 @@ class MessageExportTest(TembaTest):
         msg7.delete()
 
         # export all visible messages (i.e. not msg3) using export_all param
-        with self.assertNumQueries(18):
+        with self.assertNumQueries(14):
             workbook = self._export(None, None, date(2000, 9, 1), date(2022, 9, 1))
 
         expected_headers = [
@@ -1346,7 +1355,7 @@ class MessageExportTest(TembaTest):
         ]
 
         # export all visible messages (i.e. not msg3) using export_all param
-        with self.assertNumQueries(16):
+        with self.assertNumQueries(14):
             self.assertExcelSheet(
                 self._export(None, None, date(2000, 9, 1), date(2022, 9, 28)).worksheets[0],
                 [
@@ -1731,6 +1740,77 @@ class MessageExportTest(TembaTest):
                 self.org.timezone,
             )
 
+    def test_export_partitioned(self):
+        self.org.created_on = datetime(2017, 1, 1, 9, tzinfo=tzone.utc)
+        self.org.save(update_fields=("created_on",))
+
+        self.create_incoming_msg(self.joe, "hello 1", created_on=datetime(2017, 1, 1, 10, tzinfo=tzone.utc))
+        self.create_incoming_msg(self.frank, "hello 2", created_on=datetime(2017, 1, 30, 23, tzinfo=tzone.utc))
+        self.create_incoming_msg(self.joe, "hello 3", created_on=datetime(2017, 2, 3, 10, tzinfo=tzone.utc))
+        self.create_incoming_msg(self.kevin, "hello 4", created_on=datetime(2017, 3, 20, 10, tzinfo=tzone.utc))
+
+        expected = self._export(None, None, date(2017, 1, 1), date(2017, 3, 31), with_groups=[self.just_joe])
+        expected_rows = [[c.value for c in row] for row in expected.worksheets[0].rows]
+        self.assertEqual(5, len(expected_rows))
+
+        with override_settings(EXPORT_PARTITION_DAYS=30):
+            export = MessageExport.create(
+                self.org, self.admin, date(2017, 1, 1), date(2017, 3, 31), with_groups=[self.just_joe]
+            )
+
+            partitions = export.get_partitions()
+            self.assertEqual(3, len(partitions))
+            self.assertEqual(self.org.created_on, partitions[0][0])
+            self.assertEqual(partitions[0][1] + timedelta(microseconds=1), partitions[1][0])
+            self.assertEqual(partitions[1][1] + timedelta(microseconds=1), partitions[2][0])
+            self.assertEqual(export.get_date_range()[1], partitions[2][1])
+
+            # perform export but don't run the partition tasks yet
+            with patch("temba.orgs.tasks.perform_export_partition.delay") as mock_partition:
+                export.perform()
+
+            self.assertEqual(
+                [call(export.id, 0), call(export.id, 1), call(export.id, 2)], mock_partition.call_args_list
+            )
+            self.assertEqual(Export.STATUS_PROCESSING, export.status)
+
+            with self.mockReadOnly():
+                export.perform_partition(1)
+                export.perform_partition(0)
+
+            export.refresh_from_db()
+            self.assertEqual(Export.STATUS_PROCESSING, export.status)
+
+            # restarting the export doesn't re-queue the partition which is still claimed by its task
+            with patch("temba.orgs.tasks.perform_export_partition.delay") as mock_partition:
+                export.perform()
+
+            self.assertEqual([], mock_partition.call_args_list)
+
+            # but once that claim expires, restarting only queues the partition which hasn't been written
+            r = get_redis_connection()
+            self.assertTrue(r.exists(export._get_partition_claim_key(2)))
+            self.assertFalse(r.exists(export._get_partition_claim_key(0)))
+            r.delete(export._get_partition_claim_key(2))
+
+            with patch("temba.orgs.tasks.perform_export_partition.delay") as mock_partition:
+                export.perform()
+
+            self.assertEqual([call(export.id, 2)], mock_partition.call_args_list)
+
+            # writing the last partition merges them all into the final file
+            with self.mockReadOnly():
+                export.perform_partition(2)
+
+        export.refresh_from_db()
+        self.assertEqual(Export.STATUS_COMPLETE, export.status)
+        self.assertEqual(4, export.num_records)
+        self.assertEqual(f"orgs/{self.org.id}/message_exports/{export.uuid}.xlsx", export.path)
+        self.assertFalse(default_storage.exists(export._get_partition_path(0)))
+
+        workbook = load_workbook(filename=default_storage.open(export.path))
+        self.assertEqual(expected_rows, [[c.value for c in row] for row in workbook.worksheets[0].rows])
+
 
 class BroadcastTest(TembaTest):
     def setUp(self):
@@ -1,10 +1,7 @@
 import logging
 
-from django.conf import settings
-from django.utils import timezone
-
 from temba.utils.crons import cron_task
-from temba.utils.models import delete_in_batches
+from temba.utils.models import RetentionPolicy
 
 from .models import Notification, NotificationCount
 
@@ -34,13 +31,9 @@ def send_notification_emails():
 
 @cron_task(lock_timeout=1800)
 def squash_notification_counts():
-    NotificationCount.squash()
+    return {"NotificationCount": NotificationCount.schedule_squash()}
 
 
 @cron_task()
 def trim_notifications():
-    trim_before = timezone.now() - settings.RETENTION_PERIODS["notification"]
-
-    num_deleted = delete_in_batches(Notification.objects.filter(created_on__lt=trim_before))
-
-    return {"deleted": num_deleted}
+    return RetentionPolicy("notification", Notification, "created_on", inclusive=False).apply()
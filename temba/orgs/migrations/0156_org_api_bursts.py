@@ -0,0 +1,21 @@
+# Generated by Django 5.1 on 2026-10-18 12:00
+
+from django.db import migrations
+
+import temba.utils.json
+import temba.utils.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("orgs", "0155_remove_invitation_user_group_and_more")]
+
+    operations = [
+        migrations.AddField(
+            model_name="org",
+            name="api_bursts",
+            field=temba.utils.models.fields.JSONField(
+                decoder=temba.utils.json.TembaDecoder, default=dict, encoder=temba.utils.json.TembaEncoder
+            ),
+        ),
+    ]
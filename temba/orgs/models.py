@@ -1,8 +1,9 @@
 import itertools
 import logging
 import os
+import time
 from abc import ABCMeta
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
 from enum import Enum
 from pathlib import Path
@@ -13,6 +14,7 @@ from urllib.parse import urlparse
 import pycountry
 import pyotp
 import pytz
+from django_redis import get_redis_connection
 from packaging.version import Version
 from smartmin.models import SmartModel
 from timezone_field import TimeZoneField
@@ -36,11 +38,12 @@ from django.utils.translation import gettext_lazy as _
 from temba import mailroom
 from temba.archives.models import Archive
 from temba.locations.models import AdminBoundary
-from temba.utils import json, languages, on_transaction_commit
+from temba.utils import connected_components, json, languages, on_transaction_commit
 from temba.utils.dates import datetime_to_str
 from temba.utils.email import EmailSender
+from temba.utils.export import CSVExporter, MultiSheetExporter, PartialExporter
 from temba.utils.fields import UploadToIdPathAndRename
-from temba.utils.models import JSONField, TembaUUIDMixin, delete_in_batches
+from temba.utils.models import DeletionPlan, DeletionStep, JSONField, TembaUUIDMixin
 from temba.utils.s3 import public_file_storage
 from temba.utils.text import generate_secret, generate_token
 from temba.utils.timezones import timezone_to_country_code
@@ -474,6 +477,15 @@ class Org(SmartModel):
 
     DELETE_DELAY_DAYS = 7  # how many days after releasing that an org is deleted
 
+    DEPENDENCY_GRAPH_KEY = "org_dependency_graph"  # redis hashes of the cached dependencies of each org's flows
+    DEPENDENCY_GRAPH_EXPIRES = 60 * 60 * 24
+
+    NORMALIZE_TELS_KEY = "normalize_contact_tels"  # redis keys of the progress of tel normalization jobs
+    NORMALIZE_TELS_ACTIVE_KEY = "normalize_contact_tels_active"  # redis set of ids of orgs with unfinished jobs
+    NORMALIZE_TELS_EXPIRES = 60 * 60 * 24 * 7
+    NORMALIZE_TELS_LOCK_TIMEOUT = 60 * 15  # jobs which haven't checkpointed for this long are considered stalled
+    NORMALIZE_TELS_BATCH_SIZE = 1000
+
     BLOCKER_SUSPENDED = _(
         "Sorry, your workspace is currently suspended. To re-enable starting flows and sending messages, please "
         "contact support."
@@ -525,6 +537,7 @@ class Org(SmartModel):
     features = ArrayField(models.CharField(max_length=32), default=list)
     limits = JSONField(default=dict)
     api_rates = JSONField(default=dict)
+    api_bursts = JSONField(default=dict)
 
     is_anon = models.BooleanField(
         default=False, help_text=_("Whether this organization anonymizes the phone numbers of contacts within it")
@@ -762,8 +775,9 @@ class Org(SmartModel):
             campaign.schedule_events_async()
 
         # with all the flows and dependencies committed, we can now have mailroom do full validation
-        for flow in new_flows:
-            flow_info = mailroom.get_client().flow_inspect(self, flow.get_definition())
+        flow_infos = mailroom.get_client().flow_inspect_many(self, [f.get_definition() for f in new_flows])
+
+        for flow, flow_info in zip(new_flows, flow_infos):
             flow.has_issues = len(flow_info[Flow.INSPECT_ISSUES]) > 0
             flow.save(update_fields=("has_issues",))
 
@@ -934,6 +948,82 @@ class Org(SmartModel):
 
         normalize_contact_tels_task.delay(self.pk)
 
+    def _normalize_contact_tels(self, *, batch_size: int = NORMALIZE_TELS_BATCH_SIZE) -> bool:
+        """
+        Normalizes tel URNs which don't have full E164 numbers in pages ordered by id, checkpointing our position after
+        each page so that if this job is interrupted, running it again resumes where it left off. Returns whether the
+        job ran, i.e. wasn't already running elsewhere.
+        """
+        from temba.contacts.models import URN, ContactURN
+
+        r = get_redis_connection()
+
+        country_code = self.default_country_code
+        if not country_code:
+            self._finish_normalize_tels(r)
+            return False
+
+        lock = r.lock(f"{self.NORMALIZE_TELS_KEY}-lock:{self.id}", timeout=self.NORMALIZE_TELS_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            return False
+
+        try:
+            urns = ContactURN.objects.filter(org=self, scheme=URN.TEL_SCHEME).exclude(path__startswith="+")
+
+            # resume from our checkpoint unless it was for a different country
+            state = self._get_normalize_tels_state()
+            if not state or state["country"] != country_code:
+                state = {"country": country_code, "last_id": 0, "done": 0, "updated": 0, "total": urns.count()}
+                r.set(f"{self.NORMALIZE_TELS_KEY}:{self.id}", json.dumps(state), ex=self.NORMALIZE_TELS_EXPIRES)
+                r.sadd(self.NORMALIZE_TELS_ACTIVE_KEY, self.id)
+
+            while True:
+                batch = list(
+                    urns.filter(id__gt=state["last_id"])
+                    .only("id", "org", "path", "identity")
+                    .order_by("id")[:batch_size]
+                )
+                if not batch:
+                    break
+
+                state["updated"] += ContactURN.bulk_normalize_numbers(batch, country_code)
+                state["last_id"] = batch[-1].id
+                state["done"] += len(batch)
+
+                r.set(f"{self.NORMALIZE_TELS_KEY}:{self.id}", json.dumps(state), ex=self.NORMALIZE_TELS_EXPIRES)
+                lock.reacquire()
+
+            logger.info(
+                "normalized contact tels",
+                extra={"org_id": self.id, "country": country_code, "total": state["done"], "updated": state["updated"]},
+            )
+
+            self._finish_normalize_tels(r)
+        finally:
+            lock.release()
+
+        return True
+
+    def _finish_normalize_tels(self, r):
+        pipe = r.pipeline()
+        pipe.delete(f"{self.NORMALIZE_TELS_KEY}:{self.id}")
+        pipe.srem(self.NORMALIZE_TELS_ACTIVE_KEY, self.id)
+        pipe.execute()
+
+    def get_normalize_contact_tels_progress(self) -> float | None:
+        """
+        Gets the percentage progress of an unfinished tel normalization job for this org, or None if there isn't one
+        """
+        state = self._get_normalize_tels_state()
+        if not state:
+            return None
+
+        return min(100.0, 100.0 * state["done"] / state["total"]) if state["total"] else 0.0
+
+    def _get_normalize_tels_state(self) -> dict | None:
+        state = get_redis_connection().get(f"{self.NORMALIZE_TELS_KEY}:{self.id}")
+        return json.loads(state) if state else None
+
     @cached_property
     def active_contacts_group(self):
         from temba.contacts.models import ContactGroup
@@ -1133,8 +1223,6 @@ class Org(SmartModel):
         Generates a dict of all exportable flows and campaigns for this org with each object's immediate dependencies
         """
         from temba.campaigns.models import Campaign, CampaignEvent
-        from temba.contacts.models import ContactField, ContactGroup
-        from temba.flows.models import Flow
 
         campaign_prefetches = (
             Prefetch(
@@ -1158,29 +1246,33 @@ class Org(SmartModel):
             all_flows = all_flows.filter(is_archived=False)
             all_campaigns = all_campaigns.filter(is_archived=False)
 
-        # build dependency graph for all flows and campaigns
-        dependencies = defaultdict(set)
-        for flow in all_flows:
-            dependencies[flow] = flow.get_export_dependencies()
-        for campaign in all_campaigns:
-            dependencies[campaign] = set([e.flow for e in campaign.flow_events])
+        flows_by_id = {f.id: f for f in all_flows}
+        flow_edges = self._get_flow_dependency_edges()
+
+        # fetch any flows which are dependencies but not included themselves, e.g. archived flows
+        dep_flow_ids = {d for f in flows_by_id for d in flow_edges.get(f, {}).get("flows", ())}
+        missing_flow_ids = dep_flow_ids - flows_by_id.keys()
+        if missing_flow_ids:
+            flows_by_id.update({f.id: f for f in self.flows.filter(id__in=missing_flow_ids, is_active=True)})
 
         # replace any dependency on a group with that group's associated campaigns - we're not actually interested
         # in flow-group-flow relationships - only relationships that go through a campaign
         campaigns_by_group = defaultdict(list)
         if include_campaigns:
-            for campaign in self.campaigns.filter(is_active=True).select_related("group"):
-                campaigns_by_group[campaign.group].append(campaign)
-
-        for c, deps in dependencies.items():
-            if isinstance(c, Flow):
-                for d in list(deps):
-                    # not interested in groups or fields for now
-                    if isinstance(d, ContactField):
-                        deps.remove(d)
-                    if isinstance(d, ContactGroup):
-                        deps.remove(d)
-                        deps.update(campaigns_by_group[d])
+            for campaign in self.campaigns.filter(is_active=True):
+                campaigns_by_group[campaign.group_id].append(campaign)
+
+        # build dependency graph for all flows and campaigns
+        dependencies = defaultdict(set)
+        for flow in all_flows:
+            edges = flow_edges.get(flow.id, {})
+            deps = {flows_by_id[d] for d in edges.get("flows", ()) if d in flows_by_id}
+            for group_id in edges.get("groups", ()):
+                deps.update(campaigns_by_group[group_id])
+
+            dependencies[flow] = deps
+        for campaign in all_campaigns:
+            dependencies[campaign] = set([e.flow for e in campaign.flow_events])
 
         if include_triggers:
             all_triggers = self.triggers.filter(is_archived=False, is_active=True).select_related("flow")
@@ -1194,6 +1286,47 @@ class Org(SmartModel):
 
         return dependencies
 
+    def _get_flow_dependency_edges(self) -> dict:
+        """
+        Gets the flow and group dependencies of each of this org's active flows as a dict of flow ids to dicts of lists
+        of ids. These are cached in redis and updated as flow dependencies change so that building the dependency graph
+        doesn't require fetching the dependencies of every flow.
+        """
+        from temba.flows.models import Flow
+
+        r = get_redis_connection()
+        key = f"{self.DEPENDENCY_GRAPH_KEY}:{self.id}"
+
+        cached = r.hgetall(key)
+        if cached:
+            return {int(k): json.loads(v) for k, v in cached.items() if k != b"built"}
+
+        edges = defaultdict(lambda: {"flows": [], "groups": []})
+        flow_deps = Flow.flow_dependencies.through.objects.filter(from_flow__org=self, from_flow__is_active=True)
+        for from_id, to_id in flow_deps.values_list("from_flow_id", "to_flow_id"):
+            edges[from_id]["flows"].append(to_id)
+
+        group_deps = Flow.group_dependencies.through.objects.filter(flow__org=self, flow__is_active=True)
+        for flow_id, group_id in group_deps.values_list("flow_id", "contactgroup_id"):
+            edges[flow_id]["groups"].append(group_id)
+
+        pipe = r.pipeline()
+        pipe.hset(key, mapping={"built": "1", **{str(k): json.dumps(v) for k, v in edges.items()}})
+        pipe.expire(key, self.DEPENDENCY_GRAPH_EXPIRES)
+        pipe.execute()
+
+        return dict(edges)
+
+    def _update_flow_dependency_edges(self, flow, flow_ids, group_ids):
+        """
+        Updates the cached dependency edges of the given flow, if the dependency graph for this org is cached
+        """
+        r = get_redis_connection()
+        key = f"{self.DEPENDENCY_GRAPH_KEY}:{self.id}"
+
+        if r.exists(key):
+            r.hset(key, str(flow.id), json.dumps({"flows": list(flow_ids), "groups": list(group_ids)}))
+
     def resolve_dependencies(
         self, flows, campaigns, include_campaigns=True, include_triggers=False, include_archived=False
     ):
@@ -1205,22 +1338,11 @@ class Org(SmartModel):
         )
 
         primary_components = set(itertools.chain(flows, campaigns))
-        all_components = set()
-
-        def add_component(c):
-            if c in all_components:
-                return
+        all_components = set(primary_components)
 
-            all_components.add(c)
-            if c in primary_components:
-                primary_components.remove(c)
-
-            for d in dependencies[c]:
-                add_component(d)
-
-        while primary_components:
-            component = next(iter(primary_components))
-            add_component(component)
+        for component in connected_components(dependencies):
+            if not component.isdisjoint(primary_components):
+                all_components.update(component)
 
         return all_components
 
@@ -1283,119 +1405,28 @@ class Org(SmartModel):
         for org_user in self.users.all():
             self.remove_user(org_user)
 
-    def delete(self) -> dict:
+    def delete(self, *, workers: int = 1) -> dict:
         """
-        Does an actual delete of this org, returning counts of what was deleted.
+        Does an actual delete of this org, returning counts of what was deleted. If deletion is interrupted, calling this
+        again resumes where it left off.
         """
 
-        from temba.msgs.models import Msg
-
         assert not self.is_active and self.released_on, "can't delete org which hasn't been released"
         assert self.released_on < timezone.now() - timedelta(days=7), "can't delete org which was released recently"
         assert not self.deleted_on, "can't delete org twice"
 
         user = self.modified_by
-        counts = defaultdict(int)
-
-        # delete notifications and exports
-        delete_in_batches(self.notifications.all())
-        delete_in_batches(self.notification_counts.all())
-        delete_in_batches(self.incidents.all())
-        delete_in_batches(self.flow_labels.all())
-
-        for exp in self.exports.all():
-            exp.delete()
-
-        for imp in self.contact_imports.all():
-            imp.delete()
-
-        for label in self.msgs_labels.all():
-            label.release(user)
-            label.delete()
-
-        while True:
-            msg_batch = list(self.msgs.all()[:1000])
-            if not msg_batch:
-                break
-            Msg.bulk_delete(msg_batch)
-            counts["messages"] += len(msg_batch)
-
-        # delete all our campaigns and associated events
-        for c in self.campaigns.all():
-            c.delete()
 
         # release flows (actual deletion occurs later after contacts and tickets are gone)
         # we want to manually release runs so we don't fire a mailroom task to do it
-        for flow in self.flows.all():
+        for flow in self.flows.filter(is_active=True):
             flow.release(user, interrupt_sessions=False)
 
-        # delete runs and keep the count
-        counts["runs"] = delete_in_batches(self.runs.all())
-
-        # delete contact-related data
-        delete_in_batches(self.http_logs.all())
-        delete_in_batches(self.sessions.all())
-        delete_in_batches(self.ticket_events.all())
-        delete_in_batches(self.tickets.all())
-        delete_in_batches(self.ticket_counts.all())
-        delete_in_batches(self.topics.all())
-        delete_in_batches(self.airtime_transfers.all())
-
-        # delete our contacts
-        for contact in self.contacts.all():
-            # release synchronously and don't deindex as that will happen for the whole org
-            contact.release(user, immediately=True, deindex=False)
-            contact.delete()
-            counts["contacts"] += 1
-
-        # delete all our URNs
-        self.urns.all().delete()
-
-        # delete our fields
-        for field in self.fields.all():
-            field.delete()
-
-        # delete our groups
-        for group in self.groups.all():
-            group.release(user, immediate=True)
-            group.delete()
-
-        # delete our channels
-        for channel in self.channels.all():
-            channel.delete()
-
-        for glob in self.globals.all():
-            glob.delete()
-
-        for classifier in self.classifiers.all():
-            classifier.release(user)
-            classifier.delete()
-
-        for flow in self.flows.all():
-            flow.delete()
-
-        delete_in_batches(self.webhookevent_set.all())
-
-        for resthook in self.resthooks.all():
-            resthook.release(user)
-            resthook.delete()
-
-        # release our broadcasts
-        for bcast in self.broadcasts.filter(parent=None):
-            bcast.delete(user, soft=False)
+        plan = DeletionPlan(f"org:{self.id}", self._get_deletion_steps(user), workers=workers)
+        counts = plan.execute()
 
         Archive.delete_for_org(self)
 
-        # delete other related objects
-        delete_in_batches(self.api_tokens.all(), pk="key")
-        delete_in_batches(self.invitations.all())
-        delete_in_batches(self.schedules.all())
-        delete_in_batches(self.boundaryalias_set.all())
-        delete_in_batches(self.templates.all())
-
-        # needs to come after deletion of msgs and broadcasts as those insert new counts
-        delete_in_batches(self.system_labels.all())
-
         # now that contacts are no longer in the database, we can start de-indexing them from search
         mailroom.get_client().org_deindex(self)
 
@@ -1407,6 +1438,107 @@ class Org(SmartModel):
 
         return counts
 
+    def _get_deletion_steps(self, user) -> list:
+        """
+        Gets the steps for deleting everything this org owns. The order they're run in is derived from the relationships
+        between their models, so here they're just listed roughly in the order they'd naturally be deleted.
+        """
+
+        from temba.campaigns.models import CampaignEvent, EventFire
+        from temba.channels.models import ChannelEvent
+        from temba.contacts.models import ContactGroupCount, ContactNote
+        from temba.flows.models import FlowStartCount
+        from temba.msgs.models import Msg
+        from temba.templates.models import TemplateTranslation
+
+        def delete_each(*methods):
+            def delete_batch(objs):
+                for obj in objs:
+                    for method in methods:
+                        method(obj)
+
+            return delete_batch
+
+        return [
+            # notifications and exports
+            DeletionStep("notifications", self.notifications.all()),
+            DeletionStep("notification_counts", self.notification_counts.all()),
+            DeletionStep("incidents", self.incidents.all()),
+            DeletionStep("flow_labels", self.flow_labels.all()),
+            DeletionStep("exports", self.exports.all(), delete_batch=delete_each(lambda e: e.delete())),
+            DeletionStep("imports", self.contact_imports.all(), delete_batch=delete_each(lambda i: i.delete())),
+            # messages
+            DeletionStep(
+                "labels",
+                self.msgs_labels.all(),
+                delete_batch=delete_each(lambda lb: lb.release(user), lambda lb: lb.delete()),
+            ),
+            DeletionStep("messages", self.msgs.all(), delete_batch=Msg.bulk_delete),
+            # campaigns and flow activity
+            DeletionStep("event_fires", EventFire.objects.filter(contact__org=self)),
+            DeletionStep(
+                "campaigns",
+                self.campaigns.all(),
+                delete_batch=delete_each(lambda c: c.delete()),
+                models=(CampaignEvent,),
+            ),
+            DeletionStep("triggers", self.triggers.all()),
+            DeletionStep("flow_start_counts", FlowStartCount.objects.filter(start__org=self)),
+            DeletionStep("flow_starts", self.flow_starts.all()),
+            DeletionStep("runs", self.runs.all()),
+            # contact-related data
+            DeletionStep("http_logs", self.http_logs.all()),
+            DeletionStep("sessions", self.sessions.all()),
+            DeletionStep("calls", self.calls.all()),
+            DeletionStep("channel_events", ChannelEvent.objects.filter(org=self)),
+            DeletionStep("ticket_events", self.ticket_events.all()),
+            DeletionStep("tickets", self.tickets.all()),
+            # needs to come after deletion of tickets as that inserts new counts
+            DeletionStep("ticket_counts", self.ticket_counts.all(), after=("tickets",)),
+            DeletionStep("topics", self.topics.all()),
+            DeletionStep("airtime_transfers", self.airtime_transfers.all()),
+            DeletionStep("contact_notes", ContactNote.objects.filter(contact__org=self)),
+            # contacts, their URNs and memberships of groups, scheduled broadcasts etc
+            DeletionStep("urns", self.urns.all()),
+            DeletionStep("contacts", self.contacts.all()),
+            DeletionStep("fields", self.fields.all()),
+            # needs to come after deletion of contacts as removing their group memberships inserts new counts
+            DeletionStep("group_counts", ContactGroupCount.objects.filter(group__org=self), after=("contacts",)),
+            DeletionStep("groups", self.groups.all()),
+            # configuration
+            DeletionStep(
+                "channels",
+                self.channels.all(),
+                delete_batch=delete_each(lambda c: c.delete()),
+                models=(TemplateTranslation,),
+            ),
+            DeletionStep("globals", self.globals.all()),
+            DeletionStep(
+                "classifiers",
+                self.classifiers.all(),
+                delete_batch=delete_each(lambda c: c.release(user), lambda c: c.delete()),
+            ),
+            DeletionStep("flows", self.flows.all(), delete_batch=delete_each(lambda f: f.delete())),
+            DeletionStep("webhook_events", self.webhookevent_set.all()),
+            DeletionStep(
+                "resthooks",
+                self.resthooks.all(),
+                delete_batch=delete_each(lambda rh: rh.release(user), lambda rh: rh.delete()),
+            ),
+            DeletionStep(
+                "broadcasts",
+                self.broadcasts.filter(parent=None),
+                delete_batch=delete_each(lambda b: b.delete(user, soft=False)),
+            ),
+            DeletionStep("api_tokens", self.api_tokens.all(), pk="key"),
+            DeletionStep("invitations", self.invitations.all()),
+            DeletionStep("schedules", self.schedules.all()),
+            DeletionStep("boundary_aliases", self.boundaryalias_set.all()),
+            DeletionStep("templates", self.templates.all()),
+            # needs to come after deletion of msgs and broadcasts as those insert new counts
+            DeletionStep("system_labels", self.system_labels.all(), after=("messages", "broadcasts")),
+        ]
+
     def as_environment_def(self):
         """
         Returns this org as an environment definition as used by the flow engine
@@ -1590,6 +1722,25 @@ class ExportType:
         """
         pass
 
+    def get_partitions(self, export) -> list:
+        """
+        Gets the (start, end) datetime ranges that this export can be split into for writing in parallel, or an empty
+        list if it can't be partitioned. Types which support partitioning must implement get_exporter and write_rows.
+        """
+        return []
+
+    def get_exporter(self, export):  # pragma: no cover
+        """
+        Gets the exporter for the final file of a partitioned export
+        """
+        pass
+
+    def write_rows(self, export, exporter, start_date, end_date) -> int:  # pragma: no cover
+        """
+        Writes the rows in the given datetime range to the given exporter, returning the number of records written
+        """
+        pass
+
     def get_download_context(self, export) -> dict:  # pragma: no cover
         return {}
 
@@ -1655,6 +1806,116 @@ class DefinitionExport(ExportType):
         }
 
 
+class ContactColumnCache:
+    """
+    Export scoped LRU cache of prepared contact column values keyed by contact UUID. Misses are filled in bulk for each
+    batch of records, with a single query for the contacts, their URNs and their group memberships.
+    """
+
+    MAX_SIZE = 10_000
+
+    def __init__(self, export, *, extra_urn_schemes=(), max_size: int = None):
+        self.export = export
+        self.extra_urn_schemes = extra_urn_schemes
+        self.max_size = max_size or self.MAX_SIZE
+        self.fields = export.get_contact_fields()
+        self.groups = export.get_contact_groups()
+
+        self._columns = OrderedDict()
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_rows = 0
+        self.started_on = time.perf_counter()
+
+    def prepare(self, contact_uuids):
+        """
+        Ensures the given contacts are cached, fetching any which aren't
+        """
+        from temba.contacts.models import Contact
+
+        contact_uuids = set(contact_uuids)
+        missing = set()
+
+        for contact_uuid in contact_uuids:
+            if contact_uuid in self._columns:
+                self._columns.move_to_end(contact_uuid)
+                self.num_hits += 1
+            else:
+                missing.add(contact_uuid)
+                self.num_misses += 1
+
+        if missing:
+            contacts = Contact.bulk_hydrate(
+                self.export.org,
+                Contact.objects.filter(org=self.export.org, uuid__in=missing),
+                group_ids=[g.id for g in self.groups],
+                using="readonly",
+            )
+            for contact in contacts:
+                self._columns[str(contact.uuid)] = self._get_columns(contact)
+
+        # evict least recently used contacts but never those in the current batch
+        while len(self._columns) > max(self.max_size, len(contact_uuids)):
+            self._columns.popitem(last=False)
+
+    def get_columns(self, contact_uuid: str, urn: str = "") -> list:
+        """
+        Gets the column values for the given prepared contact, optionally overriding their URN
+        """
+        from temba.contacts.models import URN
+
+        self.num_rows += 1
+        cols = list(self._columns[contact_uuid])
+
+        if urn != "":
+            if urn is not None:
+                cols[2] = URN.to_parts(urn)[0]
+                if not self.export.org.is_anon:
+                    cols[3] = URN.format(urn, international=False, formatted=False)
+            else:  # pragma: no cover
+                cols[2] = None
+                if not self.export.org.is_anon:
+                    cols[3] = None
+
+        return cols
+
+    def get_stats(self) -> str:
+        """
+        Gets a summary of the performance of this cache for logging
+        """
+        lookups = self.num_hits + self.num_misses
+        hit_rate = (self.num_hits / lookups) if lookups else 0
+        elapsed = time.perf_counter() - self.started_on
+        rows_per_sec = (self.num_rows / elapsed) if elapsed else 0
+
+        return f"contact cache hit rate {hit_rate:.1%}, {rows_per_sec:.0f} rows/sec"
+
+    def _get_columns(self, contact) -> tuple:
+        org = self.export.org
+
+        urn_obj = contact.get_urn()
+        urn_scheme, urn_path = (urn_obj.scheme, urn_obj.path) if urn_obj else (None, None)
+
+        cols = [str(contact.uuid), contact.name, urn_scheme]
+        if org.is_anon:
+            cols.append(contact.anon_display)
+        else:
+            cols.append(urn_path)
+
+        for cf in self.fields:
+            cols.append(contact.get_field_display(cf))
+
+        memberships = set(contact.group_ids)
+
+        for cg in self.groups:
+            cols.append(cg.id in memberships)
+
+        for scheme in self.extra_urn_schemes:
+            cols.append(contact.get_urn_display(org=org, formatted=False, scheme=scheme))
+
+        return tuple(cols)
+
+
 class Export(TembaUUIDMixin, models.Model):
     """
     An export of workspace data initiated by a user
@@ -1671,9 +1932,21 @@ class Export(TembaUUIDMixin, models.Model):
         (STATUS_FAILED, _("Failed")),
     )
 
+    FORMAT_XLSX = "xlsx"
+    FORMAT_CSV = "csv"
+    FORMAT_CSV_GZIP = "csv.gz"
+    FORMAT_CHOICES = (
+        (FORMAT_XLSX, _("Excel")),
+        (FORMAT_CSV, _("CSV")),
+        (FORMAT_CSV_GZIP, _("Compressed CSV")),
+    )
+
     # log progress after this number of exported objects have been exported
     LOG_PROGRESS_PER_ROWS = 10000
 
+    # how long a queued partition is considered claimed by its task before it can be queued again
+    PARTITION_CLAIM_TIMEOUT = 60 * 60 * 6
+
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="exports")
     export_type = models.CharField(max_length=20)
     status = models.CharField(max_length=1, default=STATUS_PENDING, choices=STATUS_CHOICES)
@@ -1697,7 +1970,10 @@ class Export(TembaUUIDMixin, models.Model):
         perform_export.delay(self.id)
 
     def perform(self):
-        from temba.notifications.types.builtin import ExportFinishedNotificationType
+        partitions = self.get_partitions()
+        if partitions:
+            self._perform_partitioned(partitions)
+            return
 
         assert self.status != self.STATUS_PROCESSING, "can't start an export that's already processing"
 
@@ -1706,29 +1982,159 @@ class Export(TembaUUIDMixin, models.Model):
 
         try:
             temp_file, extension, num_records = self.type.write(self)
+            path = self._save_file(temp_file, extension)
+
+        except Exception as e:  # pragma: no cover
+            self.status = self.STATUS_FAILED
+            self.save(update_fields=("status", "modified_on"))
+            raise e
+        else:
+            self._complete(path, num_records)
+
+    def get_partitions(self) -> list:
+        """
+        Gets the (start, end) datetime ranges of the partitions of this export, or an empty list if it isn't partitioned
+        """
+        if not settings.EXPORT_PARTITION_DAYS or not self.start_date or not self.end_date:
+            return []
+
+        partitions = self.type.get_partitions(self)
+        return partitions if len(partitions) > 1 else []
+
+    def get_date_partitions(self) -> list:
+        """
+        Splits the date range of this export into partitions of EXPORT_PARTITION_DAYS days
+        """
+        start_date, end_date = self.get_date_range()
+        partitions = []
+
+        while start_date <= end_date:
+            next_start = (start_date + timedelta(days=settings.EXPORT_PARTITION_DAYS)).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            partitions.append((start_date, min(next_start - timedelta(microseconds=1), end_date)))
+            start_date = next_start
+
+        return partitions
+
+    def _perform_partitioned(self, partitions: list):
+        """
+        Queues a task for each partition which hasn't already been written. Restarting an interrupted export thus
+        resumes from where it left off.
+        """
+        from .tasks import perform_export_partition
+
+        self.status = self.STATUS_PROCESSING
+        self.save(update_fields=("status", "modified_on"))
+
+        pending = [i for i in range(len(partitions)) if not default_storage.exists(self._get_partition_path(i))]
+
+        logger.info(
+            f"export #{self.id} for org #{self.org.id}: {len(partitions) - len(pending)}/{len(partitions)} partitions "
+            f"already written"
+        )
 
-            # save file to storage
-            path = f"orgs/{self.org.id}/{self.type.slug}_exports/{self.uuid}.{extension}"
+        if pending:
+            # only queue partitions which aren't already claimed by a queued or running task
+            r = get_redis_connection()
+            for index in pending:
+                if r.set(self._get_partition_claim_key(index), "1", nx=True, ex=self.PARTITION_CLAIM_TIMEOUT):
+                    perform_export_partition.delay(self.id, index)
+        else:
+            self._merge_partitions(partitions)
+
+    def perform_partition(self, index: int):
+        """
+        Writes a single partition of this export to storage, and if it's the last one to be finished, merges all the
+        partitions into the final file
+        """
+        partitions = self.get_partitions()
+        start_date, end_date = partitions[index]
+
+        try:
+            exporter = PartialExporter()
+            num_records = self.type.write_rows(self, exporter, start_date, end_date)
+
+            temp_file, extension = exporter.save_file()
+            path = self._get_partition_path(index)
+            default_storage.delete(path)  # in case an earlier attempt was interrupted
             default_storage.save(path, File(temp_file))
+            os.unlink(temp_file.name)
 
-            # remove temporary file
-            if hasattr(temp_file, "delete"):
-                if temp_file.delete is False:  # pragma: no cover
-                    os.unlink(temp_file.name)
-            else:  # pragma: no cover
-                os.unlink(temp_file.name)
+            logger.info(f"export #{self.id} for org #{self.org.id}: wrote partition {index} ({num_records} records)")
+
+            self.modified_on = timezone.now()
+            self.save(update_fields=("modified_on",))
+
+            self._merge_partitions(partitions)
 
         except Exception as e:  # pragma: no cover
             self.status = self.STATUS_FAILED
             self.save(update_fields=("status", "modified_on"))
             raise e
-        else:
-            self.status = self.STATUS_COMPLETE
-            self.num_records = num_records
-            self.path = path
-            self.save(update_fields=("status", "num_records", "path", "modified_on"))
 
-            ExportFinishedNotificationType.create(self)
+        finally:
+            get_redis_connection().delete(self._get_partition_claim_key(index))
+
+    def _merge_partitions(self, partitions: list):
+        """
+        Merges the written partitions in order into the final file, if they have all been written
+        """
+        with get_redis_connection().lock(f"export-merge:{self.id}", timeout=3600):
+            self.refresh_from_db(fields=("status",))
+
+            paths = [self._get_partition_path(i) for i in range(len(partitions))]
+            if self.status != self.STATUS_PROCESSING or not all(default_storage.exists(p) for p in paths):
+                return
+
+            exporter = self.type.get_exporter(self)
+            num_records = 0
+
+            for path in paths:
+                with default_storage.open(path) as f:
+                    for row in PartialExporter.read_rows(f):
+                        exporter.write_row(row)
+                        num_records += 1
+
+            temp_file, extension = exporter.save_file()
+            path = self._save_file(temp_file, extension)
+
+            for partition_path in paths:
+                default_storage.delete(partition_path)
+
+            self._complete(path, num_records)
+
+    def _save_file(self, temp_file, extension: str) -> str:
+        """
+        Saves the given temp file to storage as the final file of this export
+        """
+        path = f"orgs/{self.org.id}/{self.type.slug}_exports/{self.uuid}.{extension}"
+        default_storage.save(path, File(temp_file))
+
+        # remove temporary file
+        if hasattr(temp_file, "delete"):
+            if temp_file.delete is False:  # pragma: no cover
+                os.unlink(temp_file.name)
+        else:  # pragma: no cover
+            os.unlink(temp_file.name)
+
+        return path
+
+    def _complete(self, path: str, num_records: int):
+        from temba.notifications.types.builtin import ExportFinishedNotificationType
+
+        self.status = self.STATUS_COMPLETE
+        self.num_records = num_records
+        self.path = path
+        self.save(update_fields=("status", "num_records", "path", "modified_on"))
+
+        ExportFinishedNotificationType.create(self)
+
+    def _get_partition_path(self, index: int) -> str:
+        return f"orgs/{self.org.id}/{self.type.slug}_exports/{self.uuid}/partition_{index:04d}.jsonl.gz"
+
+    def _get_partition_claim_key(self, index: int) -> str:
+        return f"export-partition:{self.id}:{index}"
 
     @classmethod
     def get_unfinished(cls, org, export_type: str):
@@ -1748,6 +2154,17 @@ class Export(TembaUUIDMixin, models.Model):
         end_date = datetime.combine(self.end_date, datetime.max.time()).replace(tzinfo=tz)
         return start_date, end_date
 
+    def get_exporter(self, base_sheet_name: str, headers: list):
+        """
+        Gets an exporter for writing rows in this export's format
+        """
+        format = self.config.get("format", self.FORMAT_XLSX)
+
+        if format == self.FORMAT_XLSX:
+            return MultiSheetExporter(base_sheet_name, headers, self.org.timezone)
+
+        return CSVExporter(headers, self.org.timezone, compress=format == self.FORMAT_CSV_GZIP)
+
     def get_contact_fields(self):
         ids = self.config.get("with_fields", [])
         id_by_order = {id: i for i, id in enumerate(ids)}
@@ -1776,36 +2193,11 @@ class Export(TembaUUIDMixin, models.Model):
 
         return cols
 
-    def get_contact_columns(self, contact, urn: str = "") -> list:
+    def get_contact_cache(self, *, extra_urn_schemes=()):
         """
-        Gets the column values for the given contact.
+        Gets a cache of contact column values for writing rows in this export
         """
-        from temba.contacts.models import URN
-
-        if urn == "":
-            urn_obj = contact.get_urn()
-            urn_scheme, urn_path = (urn_obj.scheme, urn_obj.path) if urn_obj else (None, None)
-        elif urn is not None:  # pragma: no cover
-            urn_scheme = URN.to_parts(urn)[0]
-            urn_path = URN.format(urn, international=False, formatted=False)
-        else:
-            urn_scheme, urn_path = None, None  # pragma: no cover
-
-        cols = [str(contact.uuid), contact.name, urn_scheme]
-        if self.org.is_anon:
-            cols.append(contact.anon_display)
-        else:
-            cols.append(urn_path)
-
-        for cf in self.get_contact_fields():
-            cols.append(contact.get_field_display(cf))
-
-        memberships = set(contact.groups.all())
-
-        for cg in self.get_contact_groups():
-            cols.append(cg in memberships)
-
-        return cols
+        return ContactColumnCache(self, extra_urn_schemes=extra_urn_schemes)
 
     @classmethod
     def _get_types(cls) -> dict:
@@ -1833,7 +2225,7 @@ class Export(TembaUUIDMixin, models.Model):
         """
         Create a more user friendly filename for download
         """
-        _, extension = self.path.rsplit(".", 1)
+        _, extension = os.path.basename(self.path).split(".", 1)
         date_str = datetime.today().strftime(r"%Y%m%d")
         return f"{self.type.download_prefix}_{date_str}.{extension}"
 
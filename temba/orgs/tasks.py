@@ -8,7 +8,6 @@ from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from temba.contacts.models import URN, ContactURN
 from temba.utils.crons import cron_task
 from temba.utils.email import EmailSender
 
@@ -28,6 +27,14 @@ def perform_export(export_id):
     Export.objects.select_related("org", "created_by").get(id=export_id).perform()
 
 
+@shared_task
+def perform_export_partition(export_id, index):
+    """
+    Perform a single partition of a partitioned export
+    """
+    Export.objects.select_related("org", "created_by").get(id=export_id).perform_partition(index)
+
+
 @shared_task
 def send_user_verification_email(org_id, user_id):
     r = get_redis_connection()
@@ -57,13 +64,28 @@ def send_user_verification_email(org_id, user_id):
 
 @shared_task
 def normalize_contact_tels_task(org_id):
-    org = Org.objects.get(id=org_id)
+    Org.objects.get(id=org_id)._normalize_contact_tels()
+
+
+@cron_task()
+def restart_stalled_tel_normalizations():
+    """
+    Restarts tel normalization jobs which have a checkpoint but are no longer running
+    """
+    r = get_redis_connection()
+
+    num_restarted = 0
+    for org_id in r.smembers(Org.NORMALIZE_TELS_ACTIVE_KEY):
+        org_id = int(org_id)
+
+        # checkpoints which have expired can't be resumed
+        if not r.exists(f"{Org.NORMALIZE_TELS_KEY}:{org_id}"):
+            r.srem(Org.NORMALIZE_TELS_ACTIVE_KEY, org_id)
+        elif not r.exists(f"{Org.NORMALIZE_TELS_KEY}-lock:{org_id}"):
+            normalize_contact_tels_task.delay(org_id)
+            num_restarted += 1
 
-    # do we have an org-level country code? if so, try to normalize any numbers not starting with +
-    if org.default_country_code:
-        urns = ContactURN.objects.filter(org=org, scheme=URN.TEL_SCHEME).exclude(path__startswith="+").iterator()
-        for urn in urns:
-            urn.ensure_number_normalization(org.default_country_code)
+    return {"restarted": num_restarted}
 
 
 @cron_task()
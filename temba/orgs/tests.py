@@ -24,7 +24,15 @@ from temba.campaigns.models import Campaign, CampaignEvent, EventFire
 from temba.channels.models import Channel, ChannelLog, SyncEvent
 from temba.classifiers.models import Classifier
 from temba.classifiers.types.wit import WitType
-from temba.contacts.models import URN, ContactExport, ContactField, ContactGroup, ContactImport, ContactImportBatch
+from temba.contacts.models import (
+    URN,
+    ContactExport,
+    ContactField,
+    ContactGroup,
+    ContactImport,
+    ContactImportBatch,
+    ContactURN,
+)
 from temba.flows.models import Flow, FlowLabel, FlowRun, FlowSession, FlowStart, FlowStartCount, ResultsExport
 from temba.globals.models import Global
 from temba.locations.models import AdminBoundary
@@ -39,11 +47,13 @@ from temba.tests.base import get_contact_search
 from temba.tickets.models import TicketExport
 from temba.triggers.models import Trigger
 from temba.utils import json, languages
+from temba.utils.models import DeletionPlan
 from temba.utils.uuid import uuid4
 
 from .context_processors import RolePermsWrapper
 from .models import (
     BackupToken,
+    ContactColumnCache,
     DefinitionExport,
     Export,
     Invitation,
@@ -58,6 +68,7 @@ from .tasks import (
     delete_released_orgs,
     expire_invitations,
     restart_stalled_exports,
+    restart_stalled_tel_normalizations,
     send_user_verification_email,
     trim_exports,
 )
@@ -827,6 +838,82 @@ class OrgTest(TembaTest):
 
         self.assertIsNone(self.org.default_country)
 
+    def test_normalize_contact_tels(self):
+        def create_urn(path, org=None):
+            return ContactURN.objects.create(
+                org=org or self.org, scheme=URN.TEL_SCHEME, path=path, identity=f"tel:{path}", priority=50
+            )
+
+        urn1 = create_urn("0788111111")
+        urn2 = create_urn("+250788222222")
+        urn3 = create_urn("0788222222")  # normalizes to the identity of urn2
+        urn4 = create_urn("0788333333")
+        urn5 = create_urn("078 833 3333")  # normalizes to the same identity as urn4
+        urn6 = create_urn("12345")  # can't be normalized
+        urn7 = create_urn("0788444444", org=self.org2)
+
+        self.assertIsNone(self.org.get_normalize_contact_tels_progress())
+
+        bulk_normalize = ContactURN.bulk_normalize_numbers
+        batches = []
+
+        def interrupt_after_first_batch(urns, country_code):
+            if batches:
+                raise ValueError("boom")
+            batches.append(urns)
+            return bulk_normalize(urns, country_code)
+
+        with patch("temba.contacts.models.ContactURN.bulk_normalize_numbers", side_effect=interrupt_after_first_batch):
+            with self.assertRaises(ValueError):
+                self.org._normalize_contact_tels(batch_size=2)
+
+        self.assertEqual([urn1, urn3], batches[0])
+        self.assertEqual(40.0, self.org.get_normalize_contact_tels_progress())
+        self.assertEqual({str(self.org.id).encode()}, get_redis_connection().smembers("normalize_contact_tels_active"))
+
+        # progress is shown on the workspace page
+        self.login(self.admin)
+        response = self.client.get(reverse("orgs.org_workspace"))
+        self.assertEqual(40.0, response.context["normalize_tels_progress"])
+        self.assertContains(response, "(40% complete)")
+
+        urn1.refresh_from_db()
+        urn3.refresh_from_db()
+        self.assertEqual(("+250788111111", "tel:+250788111111"), (urn1.path, urn1.identity))
+        self.assertEqual(("0788222222", "tel:0788222222"), (urn3.path, urn3.identity))
+
+        # job can't be resumed while another worker holds its lock
+        with get_redis_connection().lock(f"normalize_contact_tels-lock:{self.org.id}", timeout=60):
+            self.assertFalse(self.org._normalize_contact_tels(batch_size=2))
+            self.assertEqual({"restarted": 0}, restart_stalled_tel_normalizations())
+
+        # stalled job is restarted and resumes from its checkpoint
+        with patch("temba.contacts.models.ContactURN.bulk_normalize_numbers", wraps=bulk_normalize) as mock_bulk:
+            self.assertEqual({"restarted": 1}, restart_stalled_tel_normalizations())
+
+        mock_bulk.assert_called_once_with([urn4, urn5, urn6], "RW")
+        self.assertIsNone(self.org.get_normalize_contact_tels_progress())
+        self.assertEqual(set(), get_redis_connection().smembers("normalize_contact_tels_active"))
+
+        for urn in (urn2, urn4, urn5, urn6, urn7):
+            urn.refresh_from_db()
+
+        self.assertEqual("+250788222222", urn2.path)
+        self.assertEqual(("+250788333333", "tel:+250788333333"), (urn4.path, urn4.identity))
+        self.assertEqual("078 833 3333", urn5.path)
+        self.assertEqual("12345", urn6.path)
+        self.assertEqual("0788444444", urn7.path)  # other org untouched
+
+        # nothing to do for orgs without a country
+        with patch("temba.orgs.models.Org.default_country_code", ""):
+            self.assertFalse(self.org._normalize_contact_tels())
+
+        # jobs whose checkpoints have expired are no longer tracked as active
+        get_redis_connection().sadd("normalize_contact_tels_active", self.org2.id)
+
+        self.assertEqual({"restarted": 0}, restart_stalled_tel_normalizations())
+        self.assertEqual(set(), get_redis_connection().smembers("normalize_contact_tels_active"))
+
     @patch("temba.flows.models.FlowStart.async_start")
     @mock_mailroom
     def test_org_flagging_and_suspending(self, mr_mocks, mock_async_start):
@@ -1036,6 +1123,13 @@ class OrgTest(TembaTest):
 
         self.assertEqual(self.org.api_rates, {"v2.contacts": "10000/hour"})
 
+        self.assertEqual(self.org.api_bursts, {})
+
+        self.org.api_bursts = {"v2.contacts": 500}
+        self.org.save()
+
+        self.assertEqual(self.org.api_bursts, {"v2.contacts": 500})
+
     def test_child_management(self):
         # error if an org without this feature tries to create a child
         with self.assertRaises(AssertionError):
@@ -1402,6 +1496,16 @@ class OrgDeleteTest(TembaTest):
         self.assertFalse(user.is_active)
         self.assertEqual("", user.password)
 
+    def test_deletion_steps(self):
+        plan = DeletionPlan("test", self.org._get_deletion_steps(self.admin))
+        stages = {step.name: i for i, stage in enumerate(plan.stages) for step in stage}
+
+        # count tables which triggers insert into when rows are deleted are deleted after those rows
+        self.assertGreater(stages["group_counts"], stages["contacts"])
+        self.assertGreater(stages["ticket_counts"], stages["tickets"])
+        self.assertGreater(stages["system_labels"], stages["messages"])
+        self.assertGreater(stages["system_labels"], stages["broadcasts"])
+
     @mock_mailroom
     def test_release_and_delete(self, mr_mocks):
         org1_content = self.create_content(self.org, self.admin)
@@ -1638,6 +1742,7 @@ class OrgCRUDLTest(TembaTest, CRUDLTestMixin):
 
         # make sure we have the appropriate number of sections
         self.assertEqual(6, len(response.context["formax"].sections))
+        self.assertIsNone(response.context["normalize_tels_progress"])
 
         self.assertPageMenu(
             f"{reverse('orgs.org_menu')}settings/",
@@ -3545,6 +3650,46 @@ class BulkExportTest(TembaTest):
         self.assertEqual(dep_graph[child], {parent})
         self.assertEqual(dep_graph[parent], {child})
 
+    def test_dependency_graph_cache(self):
+        self.import_file("test_flows/mixed_versions.json")
+
+        group = ContactGroup.objects.get(name="Survey Audience")
+        child = Flow.objects.get(name="New Child")
+        parent = Flow.objects.get(name="Legacy Parent")
+        campaign = Campaign.create(self.org, self.admin, "Reminders", group)
+
+        r = get_redis_connection()
+        key = f"org_dependency_graph:{self.org.id}"
+        self.assertFalse(r.exists(key))
+
+        dep_graph = self.org.generate_dependency_graph()
+        self.assertEqual({parent, campaign}, dep_graph[child])
+        self.assertEqual({child}, dep_graph[parent])
+        self.assertEqual({child}, dep_graph[campaign])
+
+        # flow dependencies are now cached
+        self.assertEqual({"flows": [child.id], "groups": []}, json.loads(r.hget(key, str(parent.id))))
+        self.assertEqual({"flows": [], "groups": [group.id]}, json.loads(r.hget(key, str(child.id))))
+
+        # and updated when a flow's dependencies change
+        parent.update_dependencies([])
+
+        self.assertEqual({"flows": [], "groups": []}, json.loads(r.hget(key, str(parent.id))))
+
+        dep_graph = self.org.generate_dependency_graph()
+        self.assertEqual({campaign}, dep_graph[child])
+        self.assertEqual(set(), dep_graph[parent])
+
+        self.assertEqual({child, campaign}, self.org.resolve_dependencies([child], []))
+        self.assertEqual({parent}, self.org.resolve_dependencies([parent], []))
+
+        # released flows are ignored even if their dependencies are still cached
+        child.release(self.admin, interrupt_sessions=False)
+
+        dep_graph = self.org.generate_dependency_graph()
+        self.assertNotIn(child, dep_graph)
+        self.assertEqual(set(), dep_graph[campaign])
+
     def test_import_dependency_types(self):
         self.import_file("test_flows/all_dependency_types.json")
 
@@ -3582,6 +3727,10 @@ class BulkExportTest(TembaTest):
 
         self.assertFalse(flow.has_issues)
 
+        # all inspections are made in batches
+        self.assertEqual(3, len(mr_mocks.calls["flow_inspect_many"]))
+        self.assertEqual(0, len(mr_mocks.calls["flow_inspect"]))
+
     def test_import_missing_flow_dependency(self):
         # in production this would blow up validating the flow but we can't do that during tests
         self.import_file("test_flows/parent_without_its_child.json")
@@ -4178,6 +4327,69 @@ class ExportTest(TembaTest):
         self.assertFalse(default_storage.exists(export1.path))
         self.assertTrue(default_storage.exists(export2.path))
 
+    def test_contact_cache(self):
+        age = self.create_field("age", "Age", value_type=ContactField.TYPE_NUMBER)
+        joe = self.create_contact("Joe", urns=["tel:+250788382382", "twitter:joey"], fields={"age": "30"})
+        ann = self.create_contact("Ann", urns=["twitter:annie"])
+        bob = self.create_contact("Bob", urns=[])
+        devs = self.create_group("Devs", contacts=[joe, bob])
+
+        export = MessageExport.create(
+            self.org,
+            self.admin,
+            start_date=date.today(),
+            end_date=date.today(),
+            system_label="I",
+            with_fields=(age,),
+            with_groups=(devs,),
+        )
+
+        cache = ContactColumnCache(export, extra_urn_schemes=["twitter"], max_size=2)
+
+        # misses are fetched with their URNs and groups in a single query
+        with self.assertNumQueries(1):
+            cache.prepare([str(joe.uuid), str(ann.uuid), str(joe.uuid)])
+
+        self.assertEqual(
+            [str(joe.uuid), "Joe", "tel", "+250788382382", "30", True, "joey"], cache.get_columns(str(joe.uuid))
+        )
+        self.assertEqual(
+            [str(ann.uuid), "Ann", "twitter", "annie", "", False, "annie"], cache.get_columns(str(ann.uuid))
+        )
+        self.assertEqual(
+            [str(joe.uuid), "Joe", "twitter", "joey", "30", True, "joey"],
+            cache.get_columns(str(joe.uuid), urn="twitter:joey"),
+        )
+
+        # hits don't need any queries
+        with self.assertNumQueries(0):
+            cache.prepare([str(ann.uuid)])
+
+        # ann was used more recently so joe is evicted to make space for bob
+        with self.assertNumQueries(1):
+            cache.prepare([str(bob.uuid)])
+
+        self.assertEqual([str(bob.uuid), "Bob", None, None, "", True, ""], cache.get_columns(str(bob.uuid)))
+        self.assertEqual({str(ann.uuid), str(bob.uuid)}, set(cache._columns.keys()))
+
+        self.assertEqual(1, cache.num_hits)
+        self.assertEqual(3, cache.num_misses)
+        self.assertEqual(4, cache.num_rows)
+        self.assertRegex(cache.get_stats(), r"contact cache hit rate 25\.0%, \d+ rows/sec")
+
+        # anon orgs get the anon display in place of URN values
+        with self.anonymous(self.org):
+            cache = ContactColumnCache(export)
+            cache.prepare([str(joe.uuid)])
+
+            self.assertEqual(
+                [str(joe.uuid), "Joe", "tel", f"{joe.id:010}", "30", True], cache.get_columns(str(joe.uuid))
+            )
+            self.assertEqual(
+                [str(joe.uuid), "Joe", "twitter", f"{joe.id:010}", "30", True],
+                cache.get_columns(str(joe.uuid), urn="twitter:joey"),
+            )
+
 
 class ExportCRUDLTest(TembaTest):
     def test_download(self):
@@ -41,7 +41,7 @@ from temba.flows.models import Flow
 from temba.formax import FormaxMixin
 from temba.notifications.mixins import NotificationTargetMixin
 from temba.orgs.tasks import send_user_verification_email
-from temba.utils import analytics, json, languages, on_transaction_commit, str_to_bool
+from temba.utils import analytics, connected_components, json, languages, on_transaction_commit, str_to_bool
 from temba.utils.email import EmailSender, parse_smtp_url
 from temba.utils.fields import (
     ArbitraryJsonChoiceField,
@@ -1332,29 +1332,7 @@ class OrgCRUDL(SmartCRUDL):
             Generates a set of buckets of related exportable flows and campaigns
             """
             dependencies = org.generate_dependency_graph(include_archived=include_archived)
-
-            unbucketed = set(dependencies.keys())
-            buckets = []
-
-            # helper method to add a component and its dependencies to a bucket
-            def collect_component(c, bucket):
-                if c in bucket:  # pragma: no cover
-                    return
-
-                unbucketed.remove(c)
-                bucket.add(c)
-
-                for d in dependencies[c]:
-                    if d in unbucketed:
-                        collect_component(d, bucket)
-
-            while unbucketed:
-                component = next(iter(unbucketed))
-
-                bucket = set()
-                buckets.append(bucket)
-
-                collect_component(component, bucket)
+            buckets = connected_components(dependencies)
 
             # collections with only one non-group component should be merged into a single "everything else" collection
             non_single_buckets = []
@@ -1927,6 +1905,11 @@ class OrgCRUDL(SmartCRUDL):
         title = _("Workspace")
         menu_path = "/settings/workspace"
 
+        def get_context_data(self, **kwargs):
+            context = super().get_context_data(**kwargs)
+            context["normalize_tels_progress"] = self.object.get_normalize_contact_tels_progress()
+            return context
+
         def derive_formax_sections(self, formax, context):
             if self.has_org_perm("orgs.org_edit"):
                 formax.add_section("org", reverse("orgs.org_edit"), icon="settings")
@@ -108,6 +108,12 @@ AWS_S3_FILE_OVERWRITE = False
 
 STORAGE_URL = f"{AWS_S3_ENDPOINT_URL}/{_bucket_prefix}-default"
 
+# optional local directory where downloaded archives are cached, the maximum size in bytes of that cache, and how long
+# in seconds an unused file is kept for
+ARCHIVE_CACHE_DIR = None
+ARCHIVE_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+ARCHIVE_CACHE_MAX_AGE = 60 * 60 * 24 * 7
+
 # -----------------------------------------------------------------------------------
 # Localization
 # -----------------------------------------------------------------------------------
@@ -747,6 +753,9 @@ CACHES = {
     }
 }
 
+# how long totals of squashable counts can be cached for, zero disables caching
+COUNT_CACHE_TTL = 10
+
 SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 SESSION_CACHE_ALIAS = "default"
 
@@ -758,6 +767,9 @@ CELERY_BROKER_URL = _redis_url
 CELERY_RESULT_BACKEND = None
 CELERY_TASK_TRACK_STARTED = True
 
+# number of shards tables with a squash backlog are split into, each squashed by a separate task
+SQUASH_SHARDS = 4
+
 # by default, celery doesn't have any timeout on our redis connections, this fixes that
 CELERY_BROKER_TRANSPORT_OPTIONS = {"socket_timeout": 5}
 
@@ -769,13 +781,21 @@ CELERY_BEAT_SCHEDULE = {
     "interrupt-flow-sessions": {"task": "interrupt_flow_sessions", "schedule": crontab(hour=23, minute=30)},
     "refresh-whatsapp-tokens": {"task": "refresh_whatsapp_tokens", "schedule": crontab(hour=6, minute=0)},
     "refresh-templates": {"task": "refresh_templates", "schedule": timedelta(seconds=900)},
+    "report-api-throttle-stats": {"task": "report_api_throttle_stats", "schedule": timedelta(seconds=60)},
+    "report-archive-cache": {"task": "report_archive_cache", "schedule": timedelta(seconds=300)},
+    "report-flow-definition-cache": {"task": "report_flow_definition_cache", "schedule": timedelta(seconds=300)},
+    "report-mailroom-latency": {"task": "report_mailroom_latency", "schedule": timedelta(seconds=60)},
+    "restart-stalled-tel-normalizations": {
+        "task": "restart_stalled_tel_normalizations",
+        "schedule": timedelta(seconds=900),
+    },
     "send-notification-emails": {"task": "send_notification_emails", "schedule": timedelta(seconds=60)},
-    "squash-channel-counts": {"task": "squash_channel_counts", "schedule": timedelta(seconds=60)},
-    "squash-group-counts": {"task": "squash_group_counts", "schedule": timedelta(seconds=60)},
-    "squash-flow-counts": {"task": "squash_flow_counts", "schedule": timedelta(seconds=60)},
-    "squash-msg-counts": {"task": "squash_msg_counts", "schedule": timedelta(seconds=60)},
-    "squash-notification-counts": {"task": "squash_notification_counts", "schedule": timedelta(seconds=60)},
-    "squash-ticket-counts": {"task": "squash_ticket_counts", "schedule": timedelta(seconds=60)},
+    "squash-channel-counts": {"task": "squash_channel_counts", "schedule": timedelta(seconds=15)},
+    "squash-group-counts": {"task": "squash_group_counts", "schedule": timedelta(seconds=15)},
+    "squash-flow-counts": {"task": "squash_flow_counts", "schedule": timedelta(seconds=15)},
+    "squash-msg-counts": {"task": "squash_msg_counts", "schedule": timedelta(seconds=15)},
+    "squash-notification-counts": {"task": "squash_notification_counts", "schedule": timedelta(seconds=15)},
+    "squash-ticket-counts": {"task": "squash_ticket_counts", "schedule": timedelta(seconds=15)},
     "sync-classifier-intents": {"task": "sync_classifier_intents", "schedule": timedelta(seconds=300)},
     "track-org-channel-counts": {"task": "track_org_channel_counts", "schedule": crontab(hour=4, minute=0)},
     "trim-channel-events": {"task": "trim_channel_events", "schedule": crontab(hour=3, minute=0)},
@@ -809,6 +829,9 @@ REST_FRAMEWORK = {
 }
 REST_HANDLE_EXCEPTIONS = not TESTING
 
+# burst sizes of API throttle scopes, which otherwise default to the number of requests allowed in the rate's duration
+API_THROTTLE_BURSTS = {}
+
 # -----------------------------------------------------------------------------------
 # Compression
 # -----------------------------------------------------------------------------------
@@ -928,6 +951,14 @@ NON_ISO6391_LANGUAGES = {"mul", "und"}
 
 MAILROOM_URL = None
 MAILROOM_AUTH_TOKEN = None
+MAILROOM_BATCH_WORKERS = 8  # max concurrent requests when making batches of requests, e.g. inspecting flows to import
+MAILROOM_POOL_SIZE = 10  # max keep-alive connections to mailroom per process
+MAILROOM_TIMEOUT = 15  # seconds
+MAILROOM_ENDPOINT_TIMEOUTS = {"contact/export": 60, "po/export": 60, "po/import": 60}
+MAILROOM_RETRIES = 2  # retries of idempotent requests which fail to connect, time out or get a gateway error
+MAILROOM_RETRY_BACKOFF = 0.1  # seconds before first retry, doubled for each retry after
+MAILROOM_CIRCUIT_BREAKER_THRESHOLD = 0  # consecutive failures which stop requests being made, zero to disable
+MAILROOM_CIRCUIT_BREAKER_RESET = 30  # seconds before trying requests again
 
 # -----------------------------------------------------------------------------------
 # Data Model
@@ -947,6 +978,9 @@ ORG_LIMIT_DEFAULTS = {
     "topics": 250,
 }
 
+# date range exports are split into partitions of this many days which are written in parallel (0 to disable)
+EXPORT_PARTITION_DAYS = 30
+
 RETENTION_PERIODS = {
     "channelevent": timedelta(days=90),
     "channellog": timedelta(days=7),
@@ -24,6 +24,7 @@ from django.utils import timezone
 from temba.archives.models import Archive, jsonlgz_encode
 from temba.channels.models import Channel, ChannelEvent, ChannelLog
 from temba.contacts.models import URN, Contact, ContactField, ContactGroup, ContactImport
+from temba.flows.cache import definition_cache
 from temba.flows.models import Flow, FlowRun, FlowSession
 from temba.ivr.models import Call
 from temba.locations.models import AdminBoundary, BoundaryAlias
@@ -32,6 +33,7 @@ from temba.orgs.models import Org, OrgRole, User
 from temba.templates.models import Template
 from temba.tickets.models import Ticket, TicketEvent
 from temba.utils import dynamo, json
+from temba.utils.models.squashable import COUNT_CACHE_KEY
 from temba.utils.uuid import UUID, uuid4, uuid7
 
 from .mailroom import (
@@ -55,9 +57,14 @@ class TembaTest(SmartminTest):
     databases = ("default", "readonly")
     default_password = "Qwerty123"
 
+    # whether writes clear cached count totals, so that tests see changed totals without waiting for them to expire
+    clear_count_cache_on_write = True
+
     def setUp(self):
         super().setUp()
 
+        self.enterContext(connection.execute_wrapper(self._clear_count_cache_on_write))
+
         self.create_anonymous_user()
 
         self.superuser = User.objects.create_superuser(
@@ -147,12 +154,27 @@ class TembaTest(SmartminTest):
         self.org.country = self.country
         self.org.save(update_fields=("country",))
 
+    def _clear_count_cache_on_write(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+
+        if self.clear_count_cache_on_write and sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            r = get_redis_connection()
+            keys = r.keys(f"{COUNT_CACHE_KEY}:*")
+            if keys:
+                r.delete(*keys)
+
+        return result
+
     def tearDown(self):
         super().tearDown()
 
+        definition_cache.flush_stats()
+
         r = get_redis_connection()
         r.flushdb()
 
+        definition_cache.clear_local()
+
     def login(self, user, update_last_auth_on: bool = True, choose_org=None):
         self.assertTrue(
             self.client.login(username=user.username, password=self.default_password),
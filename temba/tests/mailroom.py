@@ -161,6 +161,10 @@ class TestClient(MailroomClient):
         )
         return {"id": event.id}
 
+    @_client_method
+    def android_event_many(self, org, channel, events: list[dict]) -> list:
+        return [self._call_catching_urn_errors(self.android_event, org, channel, **e) for e in events]
+
     def android_message(self, org, channel, phone: str, text: str, received_on):
         contact, contact_urn = contact_resolve(org, phone)
         text = text[: Msg.MAX_TEXT_LEN]
@@ -187,9 +191,20 @@ class TestClient(MailroomClient):
         )
         return {"id": msg.id, "duplicate": False}
 
+    @_client_method
+    def android_message_many(self, org, channel, messages: list[dict]) -> list:
+        return [self._call_catching_urn_errors(self.android_message, org, channel, **m) for m in messages]
+
     def android_sync(self, channel):
         return {"id": channel.id}
 
+    @staticmethod
+    def _call_catching_urn_errors(func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except mailroom.URNValidationException as e:
+            return e
+
     @_client_method
     def contact_create(self, org, user, contact: mailroom.ContactSpec):
         status = {v: k for k, v in Contact.ENGINE_STATUSES.items()}[contact.status]
@@ -305,6 +320,14 @@ class TestClient(MailroomClient):
         # and is something we might want to change in the future
         return super().flow_inspect(org, definition)
 
+    @_client_method
+    def flow_inspect_many(self, org, definitions: list[dict]) -> list[dict]:
+        # use mocked results in order for as many definitions as we have them, and the real client for the rest
+        num_mocked = min(len(self.mocks._flow_inspect), len(definitions))
+        mocked = [self.mocks._flow_inspect.pop(0) for i in range(num_mocked)]
+
+        return mocked + super().flow_inspect_many(org, definitions[num_mocked:])
+
     @_client_method
     def flow_start_preview(self, org, flow, include, exclude):
         assert self.mocks._flow_start_preview, "missing flow_start_preview mock"
@@ -582,6 +582,7 @@ class TicketExport(ExportType):
         )
 
         exporter = MultiSheetExporter("Tickets", headers, export.org.timezone)
+        contact_cache = export.get_contact_cache()
         num_records = 0
 
         # add tickets to the export in batches of 1k to limit memory usage
@@ -589,11 +590,11 @@ class TicketExport(ExportType):
             tickets = (
                 Ticket.objects.filter(id__in=batch_ids)
                 .order_by("opened_on")
-                .prefetch_related("org", "contact", "contact__org", "contact__groups", "assignee", "topic")
+                .prefetch_related("org", "contact", "assignee", "topic")
                 .using("readonly")
             )
 
-            Contact.bulk_urn_cache_initialize([t.contact for t in tickets], using="readonly")
+            contact_cache.prepare(str(t.contact.uuid) for t in tickets)
 
             for ticket in tickets:
                 values = [
@@ -603,7 +604,7 @@ class TicketExport(ExportType):
                     ticket.topic.name,
                     ticket.assignee.email if ticket.assignee else None,
                 ]
-                values += export.get_contact_columns(ticket.contact)
+                values += contact_cache.get_columns(str(ticket.contact.uuid))
 
                 exporter.write_row(values)
 
@@ -5,6 +5,4 @@ from .models import TicketCount, TicketDailyCount, TicketDailyTiming
 
 @cron_task(lock_timeout=7200)
 def squash_ticket_counts():
-    TicketCount.squash()
-    TicketDailyCount.squash()
-    TicketDailyTiming.squash()
+    return {m.__name__: m.schedule_squash() for m in (TicketCount, TicketDailyCount, TicketDailyTiming)}
@@ -1,3 +1,6 @@
+import hashlib
+from array import array
+from collections import defaultdict
 from itertools import islice
 
 from django.conf import settings
@@ -64,6 +67,102 @@ def chunk_list(iterable, size):
         item = list(islice(it, size))
 
 
+def connected_components(graph: dict) -> list[set]:
+    """
+    Finds the connected components of an undirected graph given as a dict of nodes to their adjacent nodes. Uses a
+    union-find rather than recursion so that large graphs can't hit the recursion limit.
+    """
+    parents = {}
+
+    def find(node):
+        root = node
+        while parents.setdefault(root, root) != root:
+            root = parents[root]
+
+        # compress the path so that future lookups are quicker
+        while node != root:
+            parents[node], node = root, parents[node]
+        return root
+
+    for node, adjacent in graph.items():
+        root = find(node)
+        for other in adjacent:
+            other_root = find(other)
+            if other_root != root:
+                parents[other_root] = root
+
+    components = defaultdict(set)
+    for node in parents:
+        components[find(node)].add(node)
+
+    return list(components.values())
+
+
+class FingerprintSet:
+    """
+    Memory-compact set of strings for detecting duplicates. Values are stored as 64-bit hashes in an open addressing
+    table backed by an array which is kept at most half full, so each value takes 8-16 bytes rather than the 50+ bytes
+    of a string or an int in a Python set. Distinct values have a 1 in 2^64 chance of being treated as duplicates.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be a power of 2"
+
+        self._slots = array("Q", bytes(8 * capacity))
+        self._size = 0
+
+    def add(self, value: str) -> bool:
+        """
+        Adds the given value, returning whether it was added, i.e. that it wasn't already in this set
+        """
+        if (self._size + 1) * 2 > len(self._slots):
+            self._resize(len(self._slots) * 2)
+
+        return self._insert(self._hash(value))
+
+    def __contains__(self, value: str) -> bool:
+        mask = len(self._slots) - 1
+        fingerprint = self._hash(value)
+        i = fingerprint & mask
+
+        while self._slots[i]:
+            if self._slots[i] == fingerprint:
+                return True
+            i = (i + 1) & mask
+
+        return False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _insert(self, fingerprint: int) -> bool:
+        mask = len(self._slots) - 1
+        i = fingerprint & mask
+
+        while self._slots[i]:
+            if self._slots[i] == fingerprint:
+                return False
+            i = (i + 1) & mask
+
+        self._slots[i] = fingerprint
+        self._size += 1
+        return True
+
+    def _resize(self, capacity: int):
+        old_slots = self._slots
+        self._slots = array("Q", bytes(8 * capacity))
+        self._size = 0
+
+        for fingerprint in old_slots:
+            if fingerprint:
+                self._insert(fingerprint)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        # zero marks an empty slot so can't be a fingerprint
+        return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big") or 1
+
+
 def on_transaction_commit(func):
     """
     Requests that the given function be called after the current transaction has been committed. However function will
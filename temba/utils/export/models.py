@@ -1,12 +1,16 @@
-import gc
+import csv
+import gzip
+import io
 import logging
 from datetime import datetime
 
+import iso8601
 from xlsxlite.writer import XLSXBook
 
 from django.core.files.temp import NamedTemporaryFile
 from django.http import HttpResponse
 
+from temba.utils import json
 from temba.utils.text import clean_string
 
 logger = logging.getLogger(__name__)
@@ -33,7 +37,7 @@ def prepare_value(value, tz=None):
 class MultiSheetExporter:
     """
     Utility to aid writing a stream of rows which may exceed the 1048576 limit on rows per sheet, and require adding
-    new sheets.
+    new sheets. Each sheet's XML is written to disk as rows are added so memory use doesn't grow with the row count.
     """
 
     MAX_EXCEL_ROWS = 1_048_576
@@ -77,8 +81,6 @@ class MultiSheetExporter:
         """
         Saves our data to a file, returning the file saved to and the extension
         """
-        gc.collect()  # force garbage collection
-
         temp_file = NamedTemporaryFile(delete=False, suffix=".xlsx", mode="wb+")
         self.workbook.finalize(to_file=temp_file)
         temp_file.flush()
@@ -86,6 +88,80 @@ class MultiSheetExporter:
         return temp_file, "xlsx"
 
 
+class CSVExporter:
+    """
+    Utility for writing a stream of rows to a CSV file, optionally gzipped. Rows are written straight to a temp file so
+    memory use doesn't grow with the row count, and there's no limit on the number of rows.
+    """
+
+    def __init__(self, headers: list, tz, compress: bool = False):
+        self.headers = headers
+        self.tz = tz
+        self.extension = "csv.gz" if compress else "csv"
+
+        self.temp_file = NamedTemporaryFile(delete=False, suffix=f".{self.extension}", mode="wb+")
+        self.gzip_file = gzip.GzipFile(fileobj=self.temp_file, mode="wb") if compress else None
+        self.text_file = io.TextIOWrapper(self.gzip_file or self.temp_file, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.text_file)
+        self.writer.writerow(headers)
+
+    def write_row(self, values):
+        """
+        Writes the passed in row to our file
+        """
+
+        assert len(values) == len(self.headers), "need same number of column values as column headers"
+
+        self.writer.writerow([prepare_value(v, self.tz) for v in values])
+
+    def save_file(self):
+        """
+        Finishes writing our file, returning it and the extension
+        """
+        self.text_file.flush()
+        self.text_file.detach()
+
+        if self.gzip_file:
+            self.gzip_file.close()
+
+        self.temp_file.flush()
+
+        return self.temp_file, self.extension
+
+
+class PartialExporter:
+    """
+    Utility for writing the rows of one partition of an export to a gzipped JSONL file, from which they can later be
+    read back and written in order to the final file by another exporter
+    """
+
+    def __init__(self):
+        self.temp_file = NamedTemporaryFile(delete=False, suffix=".jsonl.gz", mode="wb+")
+        self.gzip_file = gzip.GzipFile(fileobj=self.temp_file, mode="wb")
+
+    def write_row(self, values):
+        values = [{"datetime": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+
+        self.gzip_file.write(json.dumps(values).encode("utf-8"))
+        self.gzip_file.write(b"\n")
+
+    def save_file(self):
+        self.gzip_file.close()
+        self.temp_file.flush()
+
+        return self.temp_file, "jsonl.gz"
+
+    @staticmethod
+    def read_rows(stream):
+        """
+        Reads back the rows from a partial file
+        """
+        for line in gzip.GzipFile(fileobj=stream):
+            values = json.loads(line)
+
+            yield [iso8601.parse_date(v["datetime"]) if isinstance(v, dict) else v for v in values]
+
+
 def response_from_workbook(workbook, filename: str) -> HttpResponse:
     """
     Creates an HTTP response from an openpyxl workbook
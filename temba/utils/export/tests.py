@@ -1,15 +1,21 @@
+import csv
+import gzip
+import io
 import os
 from datetime import datetime
+from decimal import Decimal
 from unittest.mock import PropertyMock, patch
 from zoneinfo import ZoneInfo
 
 from openpyxl import load_workbook
 
+from django.core.files.storage import default_storage
+
 from temba.contacts.models import ContactExport
 from temba.orgs.models import Export
 from temba.tests import TembaTest
 
-from .models import MultiSheetExporter, prepare_value
+from .models import CSVExporter, MultiSheetExporter, PartialExporter, prepare_value
 
 
 class ExportTest(TembaTest):
@@ -107,3 +113,77 @@ class ExportTest(TembaTest):
         self.assertEqual(32 + 16, len(list(sheet2.columns)))
 
         os.unlink(temp_file.name)
+
+    def test_csvexporter(self):
+        dt = datetime(2017, 2, 7, 15, 41, 23, 123_456).replace(tzinfo=ZoneInfo("Africa/Nairobi"))
+
+        exporter = CSVExporter(["Name", "Joined", "Count", "Active"], self.org.timezone)
+        exporter.write_row(["Bob", dt, 12, True])
+        exporter.write_row(['=Jim, "Jimmy"', None, 1.5, False])
+
+        with self.assertRaises(AssertionError):
+            exporter.write_row(["Bob"])
+
+        temp_file, file_ext = exporter.save_file()
+
+        self.assertEqual("csv", file_ext)
+        with open(temp_file.name, encoding="utf-8", newline="") as f:
+            self.assertEqual(
+                [
+                    ["Name", "Joined", "Count", "Active"],
+                    ["Bob", "2017-02-07 14:41:23", "12", "True"],
+                    ['\'=Jim, "Jimmy"', "", "1.5", "False"],
+                ],
+                list(csv.reader(f)),
+            )
+
+        os.unlink(temp_file.name)
+
+        exporter = CSVExporter(["Name", "Count"], self.org.timezone, compress=True)
+        for i in range(1000):
+            exporter.write_row([f"Contact {i}", i])
+
+        temp_file, file_ext = exporter.save_file()
+
+        self.assertEqual("csv.gz", file_ext)
+        with gzip.open(temp_file.name, "rt", encoding="utf-8", newline="") as f:
+            rows = list(csv.reader(f))
+
+        self.assertEqual(1001, len(rows))
+        self.assertEqual(["Contact 999", "999"], rows[-1])
+
+        os.unlink(temp_file.name)
+
+    def test_partialexporter(self):
+        dt = datetime(2017, 2, 7, 15, 41, 23, 123_456).replace(tzinfo=ZoneInfo("Africa/Nairobi"))
+
+        exporter = PartialExporter()
+        exporter.write_row(["Bob", dt, Decimal("12.5"), True])
+        exporter.write_row(["Jim", "", 3, False])
+
+        temp_file, file_ext = exporter.save_file()
+
+        self.assertEqual("jsonl.gz", file_ext)
+        with open(temp_file.name, "rb") as f:
+            self.assertEqual(
+                [["Bob", dt, Decimal("12.5"), True], ["Jim", "", 3, False]], list(PartialExporter.read_rows(f))
+            )
+
+        os.unlink(temp_file.name)
+
+    def test_formats(self):
+        bob = self.create_contact("Bob", phone="+1234567890")
+        group = self.create_group("Bobs", [bob])
+
+        export = ContactExport.create(org=self.org, user=self.admin, group=group, format=Export.FORMAT_CSV_GZIP)
+        export.perform()
+
+        self.assertEqual(f"orgs/{self.org.id}/contact_exports/{export.uuid}.csv.gz", export.path)
+        self.assertTrue(export._get_download_filename().endswith(".csv.gz"))
+
+        with default_storage.open(export.path) as f:
+            rows = list(csv.reader(io.StringIO(gzip.decompress(f.read()).decode("utf-8"))))
+
+        self.assertEqual(2, len(rows))
+        self.assertEqual(["Contact UUID", "Name"], rows[0][:2])
+        self.assertEqual([str(bob.uuid), "Bob"], rows[1][:2])
@@ -0,0 +1,49 @@
+import os
+import resource
+import time
+from datetime import datetime, timezone as tzone
+
+from django.core.management import BaseCommand
+
+from temba.utils.export import CSVExporter, MultiSheetExporter
+
+FORMATS = ("xlsx", "csv", "csv.gz")
+
+
+class Command(BaseCommand):
+    help = "Benchmarks peak memory use against row count when writing export files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="xlsx", help="The format of file to write")
+        parser.add_argument("--rows", type=int, default=1_000_000, help="The number of rows to write")
+        parser.add_argument("--cols", type=int, default=20, help="The number of columns in each row")
+        parser.add_argument("--every", type=int, default=100_000, help="Report memory use every this many rows")
+
+    def handle(self, format: str, rows: int, cols: int, every: int, *args, **kwargs):
+        headers = [f"Column {c}" for c in range(cols)]
+        now = datetime.now(tzone.utc)
+        row = ([now] + [f"Value {c}" for c in range(1, cols - 1)] + [123])[:cols]
+
+        if format == "xlsx":
+            exporter = MultiSheetExporter("Benchmark", headers, tzone.utc)
+        else:
+            exporter = CSVExporter(headers, tzone.utc, compress=format == "csv.gz")
+
+        self.stdout.write(f"Writing {rows} rows of {cols} columns as {format}...")
+        start = time.perf_counter()
+
+        for r in range(1, rows + 1):
+            exporter.write_row(row)
+
+            if r % every == 0 or r == rows:
+                self._report(f"rows={r}", start)
+
+        temp_file, extension = exporter.save_file()
+        self._report(f"saved size={os.path.getsize(temp_file.name)}", start)
+
+        os.unlink(temp_file.name)
+
+    def _report(self, prefix: str, start: float):
+        # on Linux ru_maxrss is in kilobytes
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        self.stdout.write(f" > {prefix} peak_rss={peak_rss}MB elapsed={time.perf_counter() - start:.1f}s")
@@ -1,10 +1,12 @@
 from io import StringIO
+from unittest.mock import patch
 
 from django.core.management import call_command
 from django.test.utils import override_settings
 
 from temba.tests import TembaTest
 from temba.utils import dynamo
+from temba.utils.export import CSVExporter
 
 
 class MigrateDynamoTest(TembaTest):
@@ -37,3 +39,23 @@ class MigrateDynamoTest(TembaTest):
         call_command("migrate_dynamo", stdout=out)
 
         self.assertIn("Skipping TempChannelLogs", out.getvalue())
+
+
+class BenchmarkExportTest(TembaTest):
+    def test_command(self):
+        for format in ("xlsx", "csv", "csv.gz"):
+            out = StringIO()
+            call_command("benchmark_export", format=format, rows=250, cols=5, every=100, stdout=out)
+
+            output = out.getvalue()
+            self.assertIn(f"Writing 250 rows of 5 columns as {format}...", output)
+            self.assertIn(" > rows=100 peak_rss=", output)
+            self.assertIn(" > rows=250 peak_rss=", output)
+            self.assertIn(" > saved size=", output)
+
+        # rows always have the requested number of columns
+        for cols in (1, 2, 3):
+            with patch.object(CSVExporter, "write_row", autospec=True) as mock_write_row:
+                call_command("benchmark_export", format="csv", rows=1, cols=cols, stdout=StringIO())
+
+            self.assertEqual(cols, len(mock_write_row.call_args.args[1]))
@@ -1,3 +1,5 @@
 from .base import *  # noqa
+from .deletion import DeletionPlan, DeletionStep  # noqa
 from .fields import JSONAsTextField, JSONField, TranslatableField  # noqa
+from .retention import RetentionPolicy  # noqa
 from .squashable import *  # noqa
@@ -1,15 +1,24 @@
+import logging
+import time
 import types
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 from smartmin.models import SmartModel
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models
 from django.utils.translation import gettext_lazy as _
 
+from temba.utils import analytics
 from temba.utils.fields import NameValidator
 from temba.utils.uuid import is_uuid, uuid4
 
+logger = logging.getLogger(__name__)
+
+DELETE_MIN_BATCH_SIZE = 10
+DELETE_MAX_BATCH_SIZE = 10_000
+
 
 def generate_uuid():
     """
@@ -25,32 +34,194 @@ def patch_queryset_count(qs, function):
     qs.count = types.MethodType(lambda s: function(), qs)
 
 
-def delete_in_batches(qs, *, batch_size: int = 1000, pk: str = "id", pre_delete=None, post_delete=None) -> int:
+def delete_in_batches(
+    qs,
+    *,
+    batch_size: int = 1000,
+    pk: str = "id",
+    pre_delete=None,
+    post_delete=None,
+    target_latency: float = None,
+    max_lag: float = None,
+    workers: int = 1,
+) -> int:
     """
     Deletes objects from the given queryset in batches returning the number deleted. Callback functions can be provided
     as `pre_delete` and `post_delete` which will be called pre and post batch deletion respectively. If `post_delete`
     returns falsey then batch processing stops.
+
+    Batches are fetched by walking the primary key so each batch query starts after the last batch rather than
+    rescanning the rows just deleted. If `target_latency` is given, batch sizes are adjusted so that deleting a batch
+    takes about that many seconds. If `max_lag` is given, deletion pauses while replicas are more than that many seconds
+    behind. If `workers` is more than one, the range of (integer) primary keys is split between that many threads, each
+    with its own database connection.
     """
 
+    start = time.perf_counter()
+    state = {"stop": False, "max_lag": 0.0}
+    kwargs = dict(
+        batch_size=batch_size,
+        pk=pk,
+        pre_delete=pre_delete,
+        post_delete=post_delete,
+        target_latency=target_latency,
+        max_lag=max_lag,
+        state=state,
+    )
+
+    if workers > 1:
+        ranges = _split_pk_range(qs, pk, workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            num_deleted = sum(
+                executor.map(
+                    lambda r: _delete_range_in_thread(qs.filter(**{f"{pk}__gte": r[0], f"{pk}__lt": r[1]}), **kwargs),
+                    ranges,
+                )
+            )
+    else:
+        num_deleted = _delete_range(qs, **kwargs)
+
+    if num_deleted:
+        elapsed = time.perf_counter() - start
+        table = qs.model._meta.db_table
+        rate = num_deleted / elapsed if elapsed else 0
+
+        logger.info(
+            "deleted in batches",
+            extra={"table": table, "deleted": num_deleted, "rate": rate, "max_lag": state["max_lag"]},
+        )
+
+        gauges = {f"temba.delete_rate_{table}": rate}
+        if max_lag:
+            gauges[f"temba.delete_lag_{table}"] = state["max_lag"]
+        analytics.gauges(gauges)
+
+    return num_deleted
+
+
+def _delete_range(
+    qs, *, batch_size, pk, pre_delete, post_delete, target_latency, max_lag, state, delete_batch=None, last=None
+) -> int:
+    """
+    Deletes the rows of the given queryset in batches walking the primary key, starting after `last` if given. Rows are
+    bulk deleted by primary key unless a `delete_batch` function is given, in which case it's called with each batch of
+    objects.
+    """
+    qs = qs.order_by(pk)
     num_deleted = 0
 
-    while True:
-        pk_batch = list(qs.values_list(pk, flat=True)[:batch_size])
+    while not state["stop"]:
+        batch_qs = qs.filter(**{f"{pk}__gt": last}) if last is not None else qs
+
+        if delete_batch:
+            batch = list(batch_qs[:batch_size])
+            pk_batch = [getattr(o, pk) for o in batch]
+        else:
+            pk_batch = list(batch_qs.values_list(pk, flat=True)[:batch_size])
+
         if not pk_batch:
             break
 
+        batch_start = time.perf_counter()
+
         if pre_delete:
             pre_delete(pk_batch)
 
-        qs.model.objects.filter(**{f"{pk}__in": pk_batch}).delete()
+        if delete_batch:
+            delete_batch(batch)
+        else:
+            qs.model.objects.filter(**{f"{pk}__in": pk_batch}).delete()
+
         num_deleted += len(pk_batch)
+        last = pk_batch[-1]
 
         if post_delete and not post_delete():
+            state["stop"] = True
             break
 
+        if target_latency:
+            # scale the batch size towards the target, but by no more than a factor of 2 at a time
+            elapsed = time.perf_counter() - batch_start
+            factor = min(max(target_latency / elapsed, 0.5), 2.0) if elapsed else 2.0
+            batch_size = min(max(int(batch_size * factor), DELETE_MIN_BATCH_SIZE), DELETE_MAX_BATCH_SIZE)
+
+        if max_lag:
+            _wait_for_replicas(max_lag, state)
+
     return num_deleted
 
 
+def _delete_range_in_thread(qs, **kwargs) -> int:
+    try:
+        return _delete_range(qs, **kwargs)
+    finally:
+        connection.close()  # each thread gets its own connection
+
+
+def _split_pk_range(qs, pk: str, num_ranges: int) -> list[tuple]:
+    """
+    Splits the range of primary keys in the given queryset into contiguous ranges of equal size
+    """
+    bounds = qs.aggregate(min_pk=models.Min(pk), max_pk=models.Max(pk))
+    if bounds["min_pk"] is None:
+        return []
+
+    lo, hi = bounds["min_pk"], bounds["max_pk"] + 1
+    step = max((hi - lo + num_ranges - 1) // num_ranges, 1)
+
+    return [(r, min(r + step, hi)) for r in range(lo, hi, step)]
+
+
+def _wait_for_replicas(max_lag: float, state: dict):
+    while True:
+        lag = get_replication_lag()
+        state["max_lag"] = max(state["max_lag"], lag)
+
+        if lag <= max_lag:
+            return
+
+        time.sleep(min(lag, 5))
+
+
+def get_replication_lag() -> float:
+    """
+    Gets the replay lag in seconds of the furthest behind replica, or zero if there are none
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(EXTRACT(EPOCH FROM MAX(replay_lag)), 0) FROM pg_stat_replication")
+        return float(cursor.fetchone()[0])
+
+
+def iter_keyset_batches(qs, fields: tuple, *, batch_size: int = 1000, reverse: bool = False):
+    """
+    Iterates over the given queryset in batches ordered by the given fields, the last of which must be unique, e.g.
+    ("created_on", "id"). Batches are fetched using keyset pagination, i.e. each batch query starts after the last row
+    of the previous batch, so every batch is an index range scan regardless of how far into the results we are.
+    """
+    qs = qs.order_by(*[f"-{f}" if reverse else f for f in fields])
+    qs = qs.alias(keyset_row=models.Func(*[models.F(f) for f in fields], function="ROW", output_field=models.Field()))
+    op = "lt" if reverse else "gt"
+    last = None
+
+    while True:
+        batch_qs = qs
+        if last:
+            # a row comparison, i.e. (f1, f2) > (v1, v2), which postgres can satisfy with a range scan of an index on
+            # the same fields
+            after = models.Func(*[models.Value(v) for v in last], function="ROW", output_field=models.Field())
+            batch_qs = batch_qs.filter(**{f"keyset_row__{op}": after})
+
+        batch = list(batch_qs[:batch_size])
+        if batch:
+            yield batch
+
+        if len(batch) < batch_size:
+            return
+
+        last = tuple(getattr(batch[-1], f) for f in fields)
+
+
 def update_if_changed(obj, **kwargs) -> bool:
     """
     Updates the given model instance with the given values, saving it if a change was made.
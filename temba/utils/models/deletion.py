@@ -0,0 +1,171 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django_redis import get_redis_connection
+
+from django.db import connection
+
+from temba.utils import json
+
+from .base import _delete_range
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionStep:
+    """
+    A step in a deletion plan which deletes the rows of the given queryset. By default rows are bulk deleted by primary
+    key but a `delete_batch` function can be provided for tables whose rows need deleting individually, e.g. because
+    they own files in storage. Any other models whose rows that function also deletes should be listed in `models` so
+    that they're considered when ordering the plan.
+    """
+
+    def __init__(self, name: str, qs, *, pk: str = "id", delete_batch=None, models=(), after=()):
+        self.name = name
+        self.qs = qs
+        self.pk = pk
+        self.delete_batch = delete_batch
+        self.models = (qs.model, *models)
+        self.after = set(after)
+
+    @property
+    def model(self):
+        return self.qs.model
+
+    def __repr__(self):
+        return f"<DeletionStep: name={self.name}>"
+
+
+class DeletionPlan:
+    """
+    A plan for deleting the rows of several tables. The order of the steps is derived from the foreign keys between
+    their models, so that rows are always deleted before the rows they reference, and steps are grouped into stages of
+    steps which don't depend on each other and so can be run in parallel. Each step deletes its rows in batches walking
+    the primary key, and checkpoints its progress to redis so that an interrupted plan resumes where it left off.
+    """
+
+    KEY = "deletion_plan"
+    EXPIRES = 60 * 60 * 24 * 30
+
+    def __init__(self, key: str, steps: list, *, batch_size: int = 1000, workers: int = 1):
+        self.key = f"{self.KEY}:{key}"
+        self.stages = self._get_stages(steps)
+        self.batch_size = batch_size
+        self.workers = workers
+
+    @staticmethod
+    def _get_stages(steps: list) -> list[list]:
+        by_name = {s.name: s for s in steps}
+        by_model = {s.model: s for s in steps}
+        assert len(by_name) == len(by_model) == len(steps), "steps must have unique names and models"
+
+        # a step must run before any step whose model is referenced by one of its models
+        preceding = {s.name: set(s.after) for s in steps}
+        for step in steps:
+            for model in step.models:
+                for field in model._meta.get_fields():
+                    if not (field.many_to_one or field.one_to_one) or not field.concrete or not field.db_constraint:
+                        continue
+
+                    target = by_model.get(field.related_model)
+                    if target and target is not step:
+                        preceding[target.name].add(step.name)
+
+        stages = []
+        remaining = list(steps)
+        done = set()
+        while remaining:
+            stage = [s for s in remaining if preceding[s.name] <= done]
+            if not stage:
+                raise ValueError(f"deletion steps have circular dependencies: {', '.join(s.name for s in remaining)}")
+
+            stages.append(stage)
+            done.update(s.name for s in stage)
+            remaining = [s for s in remaining if s.name not in done]
+
+        return stages
+
+    def execute(self) -> dict:
+        """
+        Executes this plan, returning the number of rows deleted by each step
+        """
+        r = get_redis_connection()
+        checkpoints = {k.decode(): json.loads(v) for k, v in r.hgetall(self.key).items()}
+        counts = {}
+
+        for stage in self.stages:
+            pending = []
+            for step in stage:
+                checkpoint = checkpoints.get(step.name)
+                if checkpoint and checkpoint["done"]:
+                    counts[step.name] = checkpoint["deleted"]
+                else:
+                    pending.append(step)
+
+            if self.workers > 1 and len(pending) > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    deleted = executor.map(lambda s: self._execute_step_in_thread(s, checkpoints.get(s.name)), pending)
+                    counts.update(zip([s.name for s in pending], deleted))
+            else:
+                for step in pending:
+                    counts[step.name] = self._execute_step(step, checkpoints.get(step.name))
+
+        r.delete(self.key)
+
+        return counts
+
+    def _execute_step_in_thread(self, step, checkpoint: dict) -> int:
+        try:
+            return self._execute_step(step, checkpoint)
+        finally:
+            connection.close()  # each thread gets its own connection
+
+    def _execute_step(self, step, checkpoint: dict) -> int:
+        r = get_redis_connection()
+        deleted = checkpoint["deleted"] if checkpoint else 0
+        last = checkpoint["last"] if checkpoint else None
+        start = time.perf_counter()
+
+        # progress is tracked as each batch is fetched but only checkpointed once the batch has been deleted
+        progress = {"deleted": deleted, "last": last}
+
+        def track(pks):
+            progress["deleted"] += len(pks)
+            progress["last"] = pks[-1]
+
+        def save_checkpoint():
+            r.hset(self.key, step.name, json.dumps({**progress, "done": False}))
+            r.expire(self.key, self.EXPIRES)
+            return True
+
+        _delete_range(
+            step.qs,
+            batch_size=self.batch_size,
+            pk=step.pk,
+            pre_delete=track,
+            post_delete=save_checkpoint,
+            target_latency=None,
+            max_lag=None,
+            state={"stop": False, "max_lag": 0.0},
+            delete_batch=step.delete_batch,
+            last=last,
+        )
+
+        deleted, last = progress["deleted"], progress["last"]
+
+        r.hset(self.key, step.name, json.dumps({"deleted": deleted, "last": last, "done": True}))
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "deleted rows",
+            extra={
+                "plan": self.key,
+                "step": step.name,
+                "deleted": deleted,
+                "seconds": elapsed,
+                "rate": deleted / elapsed if elapsed else 0,
+            },
+        )
+
+        return deleted
@@ -0,0 +1,148 @@
+import logging
+from datetime import datetime, time, timedelta, timezone as tzone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .base import delete_in_batches
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """
+    Retention of the rows of a log-style table, i.e. one whose rows are only ever trimmed once older than the period for
+    the table in `settings.RETENTION_PERIODS`.
+
+    If the table has been converted to a table partitioned by range of its timestamp field, it's managed as daily
+    partitions. Partitions for upcoming days are created ahead of time, and a partition is dropped whole once all of its
+    rows have expired, so rows are kept for up to a day longer than the retention period. Otherwise expired rows are
+    deleted in batches, which is also the only option for tables with `pre_delete` hooks because those have to run for
+    each batch of rows.
+    """
+
+    partitions_ahead = 3  # number of future daily partitions to keep created
+    delete_target_latency = 0.5  # seconds per batch when deleting in batches
+
+    def __init__(self, key: str, model, field: str, *, inclusive: bool = True, pre_delete=None, post_delete=None):
+        self.key = key
+        self.model = model
+        self.field = field
+        self.inclusive = inclusive
+        self.pre_delete = pre_delete
+        self.post_delete = post_delete
+
+    @property
+    def table(self) -> str:
+        return self.model._meta.db_table
+
+    def apply(self, now=None) -> dict:
+        """
+        Trims expired rows, returning the number of rows deleted and (approximate) number of bytes reclaimed
+        """
+        period = settings.RETENTION_PERIODS[self.key]
+        if not period:
+            return {"deleted": 0, "bytes": 0}
+
+        now = now or timezone.now()
+        trim_before = now - period
+
+        if not self.pre_delete and self.is_partitioned():
+            result = self._drop_partitions(trim_before)
+            self._create_partitions(now)
+        else:
+            result = self._delete_batches(trim_before)
+
+        logger.info("trimmed expired rows", extra={"table": self.table, **result})
+
+        return result
+
+    def is_partitioned(self) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_get_partkeydef(c.oid) FROM pg_partitioned_table p "
+                "INNER JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+                [self.table],
+            )
+            row = cursor.fetchone()
+
+        return row is not None and row[0] == f"RANGE ({self.field})"
+
+    def get_partitions(self) -> list[tuple]:
+        """
+        Gets the daily partitions of this table, as tuples of name, day, approximate row count and size in bytes
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname, GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid) FROM pg_inherits i "
+                "INNER JOIN pg_class c ON c.oid = i.inhrelid INNER JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = %s ORDER BY c.relname",
+                [self.table],
+            )
+            rows = cursor.fetchall()
+
+        partitions = []
+        for name, num_rows, num_bytes in rows:
+            # ignore partitions not created by us, e.g. a default partition
+            try:
+                day = datetime.strptime(name[len(self.table) + 1 :], "%Y%m%d").date()
+            except ValueError:
+                continue
+
+            partitions.append((name, day, num_rows, num_bytes))
+
+        return partitions
+
+    def _drop_partitions(self, trim_before) -> dict:
+        deleted, reclaimed, dropped = 0, 0, 0
+
+        for name, day, num_rows, num_bytes in self.get_partitions():
+            if self._day_start(day + timedelta(days=1)) <= trim_before:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+
+                deleted += num_rows
+                reclaimed += num_bytes
+                dropped += 1
+
+        return {"deleted": deleted, "bytes": reclaimed, "partitions_dropped": dropped}
+
+    def _create_partitions(self, now):
+        today = now.astimezone(tzone.utc).date()
+
+        for d in range(self.partitions_ahead + 1):
+            day = today + timedelta(days=d)
+            name = f"{self.table}_{day.strftime('%Y%m%d')}"
+
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(name)} "
+                    f"PARTITION OF {connection.ops.quote_name(self.table)} FOR VALUES FROM (%s) TO (%s)",
+                    [self._day_start(day), self._day_start(day + timedelta(days=1))],
+                )
+
+    def _delete_batches(self, trim_before) -> dict:
+        # estimate bytes reclaimed from the average row size of the table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT CASE WHEN reltuples > 0 THEN pg_table_size(oid) / reltuples ELSE 0 END FROM pg_class "
+                "WHERE relname = %s",
+                [self.table],
+            )
+            row_size = cursor.fetchone()[0]
+
+        lookup = "lte" if self.inclusive else "lt"
+        qs = self.model.objects.filter(**{f"{self.field}__{lookup}": trim_before})
+        deleted = delete_in_batches(
+            qs,
+            pre_delete=self.pre_delete,
+            post_delete=self.post_delete,
+            target_latency=self.delete_target_latency,
+        )
+
+        return {"deleted": deleted, "bytes": int(deleted * row_size)}
+
+    @staticmethod
+    def _day_start(day) -> datetime:
+        return datetime.combine(day, time(0, 0), tzinfo=tzone.utc)
@@ -1,10 +1,63 @@
 import logging
+import threading
 import time
 from abc import abstractmethod
+from collections import defaultdict
 
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.db import connection, models
 from django.db.models import Sum
 
+from temba.utils import analytics, json
+
+SQUASH_INTERVAL_KEY = "squash_interval"
+SQUASH_DUE_KEY = "squash_due"
+SQUASH_MIN_INTERVAL = 15
+SQUASH_MAX_INTERVAL = 300
+SQUASH_DEFAULT_INTERVAL = 60
+
+COUNT_CACHE_KEY = "count_cache"
+COUNT_CACHE_STATS_INTERVAL = 60  # how often in seconds each process reports its count cache hits and misses
+
+
+class CountCacheStats:
+    """
+    Hits and misses of the count cache by model. These are accumulated in process and periodically reported as gauges,
+    so that recording them doesn't require its own redis call.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(lambda: [0, 0])
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, table: str, hits: int, misses: int):
+        with self._lock:
+            self.counts[table][0] += hits
+            self.counts[table][1] += misses
+            flush_due = time.monotonic() - self.last_flush >= COUNT_CACHE_STATS_INTERVAL
+
+        if flush_due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, defaultdict(lambda: [0, 0])
+            self.last_flush = time.monotonic()
+
+        if counts:
+            gauges = {}
+            for table, (hits, misses) in counts.items():
+                gauges[f"temba.count_cache_hits_{table}"] = hits
+                gauges[f"temba.count_cache_misses_{table}"] = misses
+
+            analytics.gauges(gauges)
+
+
+count_cache_stats = CountCacheStats()
+
 
 class SquashableModel(models.Model):
     """
@@ -12,6 +65,9 @@ class SquashableModel(models.Model):
     """
 
     squash_over = ()
+    squash_sums = ("count",)
+    squash_batch_size = 1000
+    squash_max_batches = 25
 
     id = models.BigAutoField(auto_created=True, primary_key=True)
     is_squashed = models.BooleanField(default=False)
@@ -37,11 +93,181 @@ class SquashableModel(models.Model):
 
         logging.debug("Squashed %d distinct sets of %s in %0.3fs" % (num_sets, cls.__name__, time_taken))
 
+    @classmethod
+    def get_squash_backlog(cls, limit: int) -> int:
+        """
+        Gets the number of distinct sets with unsquashed rows, up to the given limit
+        """
+        return cls.get_unsquashed().order_by().values(*cls.squash_over).distinct()[:limit].count()
+
+    @classmethod
+    def schedule_squash(cls) -> dict:
+        """
+        Queues squash tasks for this model if it's due, splitting its unsquashed sets into shards when it has a backlog
+        bigger than a single batch. How often it's due adapts to the size of its backlog.
+        """
+        from temba.utils.tasks import squash_shard
+
+        r = get_redis_connection()
+        key = cls._meta.label
+        now = time.time()
+
+        due_at = r.hget(SQUASH_DUE_KEY, key)
+        if due_at and float(due_at) > now:
+            return {"skipped": True}
+
+        backlog = cls.get_squash_backlog(limit=cls.squash_batch_size * settings.SQUASH_SHARDS)
+        interval = float(r.hget(SQUASH_INTERVAL_KEY, key) or SQUASH_DEFAULT_INTERVAL)
+
+        if backlog > cls.squash_batch_size:
+            num_shards = settings.SQUASH_SHARDS
+            interval = max(interval / 2, SQUASH_MIN_INTERVAL)
+        else:
+            num_shards = 1
+            interval = min(interval * 2, SQUASH_MAX_INTERVAL)
+
+        if backlog:
+            for shard in range(num_shards):
+                squash_shard.delay(key, shard, num_shards)
+
+        r.hset(SQUASH_INTERVAL_KEY, key, interval)
+        r.hset(SQUASH_DUE_KEY, key, now + interval)
+
+        analytics.gauges({f"temba.squash_backlog_{cls._meta.db_table}": backlog})
+
+        return {"backlog": backlog, "shards": num_shards if backlog else 0, "interval": interval}
+
+    @classmethod
+    def squash_batched(
+        cls, batch_size: int = None, max_batches: int = None, shard: int = 0, num_shards: int = 1
+    ) -> dict:
+        """
+        Squashes many distinct sets at a time using a single set based statement per batch. If num_shards is greater
+        than one, only the sets whose key hashes to the given shard are squashed.
+        """
+        batch_size = batch_size or cls.squash_batch_size
+        max_batches = max_batches or cls.squash_max_batches
+
+        start = time.time()
+        num_sets, num_removed, num_inserted = 0, 0, 0
+
+        sql = cls.get_squash_batch_query(sharded=num_shards > 1)
+        params = (num_shards, shard, batch_size) if num_shards > 1 else (batch_size,)
+
+        for _ in range(max_batches):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                batch_sets, batch_removed, batch_inserted = cursor.fetchone()
+
+            num_sets += batch_sets
+            num_removed += batch_removed
+            num_inserted += batch_inserted
+
+            if batch_sets < batch_size:
+                break
+
+        time_taken = time.time() - start
+        num_collapsed = num_removed - num_inserted
+        rate = num_collapsed / time_taken if time_taken > 0 else 0
+
+        logging.debug(
+            "Squashed %d rows in %d distinct sets of %s in %0.3fs (%0.1f rows/s)"
+            % (num_collapsed, num_sets, cls.__name__, time_taken, rate)
+        )
+
+        return {"sets": num_sets, "collapsed": num_collapsed, "rate": round(rate, 1)}
+
+    @classmethod
+    def get_squash_batch_query(cls, sharded: bool = False) -> str:
+        """
+        Gets the query which squashes a batch of distinct sets (size given as the last param) and returns the number
+        of sets, the number of rows removed and the number of rows inserted. Columns not in squash_over or squash_sums
+        (e.g. flow_id on node counts) are assumed to be constant within a set and are carried over. If sharded, the
+        first two params are the number of shards and the shard to squash.
+        """
+        over_fields = [cls._meta.get_field(c) for c in cls.squash_over]
+        over_cols = [f.column for f in over_fields]
+        sum_cols = [cls._meta.get_field(c).column for c in cls.squash_sums]
+        carry_cols = [
+            f.column
+            for f in cls._meta.concrete_fields
+            if not f.primary_key and f.name != "is_squashed" and f.column not in over_cols + sum_cols
+        ]
+        conditions = " AND ".join(
+            f't."{f.column}" IS NOT DISTINCT FROM s."{f.column}"' if f.null else f't."{f.column}" = s."{f.column}"'
+            for f in over_fields
+        )
+
+        over = ", ".join(f'"{c}"' for c in over_cols)
+        shard_condition = f" AND MOD(HASHTEXT(ROW({over})::text)::bigint + 2147483648, %s) = %s" if sharded else ""
+        insert_cols = ", ".join(f'"{c}"' for c in over_cols + carry_cols + sum_cols)
+        returning = ", ".join(f't."{c}"' for c in over_cols + carry_cols + sum_cols)
+        selects = ", ".join(
+            [f'"{c}"' for c in over_cols]
+            + [f'(ARRAY_AGG("{c}"))[1]' for c in carry_cols]
+            + [f'GREATEST(0, SUM("{c}"))' for c in sum_cols]
+        )
+
+        return f"""
+        WITH sets AS (
+            SELECT DISTINCT {over} FROM {cls._meta.db_table} WHERE "is_squashed" = FALSE{shard_condition} LIMIT %s
+        ),
+        removed AS (
+            DELETE FROM {cls._meta.db_table} t USING sets s WHERE {conditions}
+            RETURNING {returning}
+        ),
+        inserted AS (
+            INSERT INTO {cls._meta.db_table}({insert_cols}, "is_squashed")
+            SELECT {selects}, TRUE FROM removed GROUP BY {over}
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM sets), (SELECT COUNT(*) FROM removed), (SELECT COUNT(*) FROM inserted);
+        """
+
     @classmethod
     @abstractmethod
     def get_squash_query(cls, distinct_set) -> tuple:  # pragma: no cover
         pass
 
+    @classmethod
+    def get_cached_totals(cls, keys, fetch) -> dict:
+        """
+        Gets totals for the given keys from the count cache, using fetch(keys) to get any which aren't cached. Cached
+        totals can be up to COUNT_CACHE_TTL seconds stale, and any keys missing from fetched totals are cached as zero.
+        """
+        keys = list(keys)
+
+        if not settings.COUNT_CACHE_TTL or not keys:
+            fetched = fetch(keys)
+            return {k: fetched.get(k, 0) for k in keys}
+
+        r = get_redis_connection()
+        cached = r.mget([cls._count_cache_key(k) for k in keys])
+
+        totals, missing = {}, []
+        for key, value in zip(keys, cached):
+            if value is not None:
+                totals[key] = json.loads(value)
+            else:
+                missing.append(key)
+
+        if missing:
+            fetched = fetch(missing)
+
+            pipe = r.pipeline()
+            for key in missing:
+                totals[key] = fetched.get(key, 0)
+                pipe.set(cls._count_cache_key(key), json.dumps(totals[key]), ex=settings.COUNT_CACHE_TTL)
+            pipe.execute()
+
+        count_cache_stats.record(cls._meta.db_table, len(keys) - len(missing), len(missing))
+
+        return totals
+
+    @classmethod
+    def _count_cache_key(cls, key) -> str:
+        return f"{COUNT_CACHE_KEY}:{cls._meta.db_table}:{key}"
+
     @classmethod
     def sum(cls, instances) -> int:
         count_sum = instances.aggregate(count_sum=Sum("count"))["count_sum"]
@@ -168,6 +394,8 @@ class DailyTimingModel(DailyCountModel):
     Base for daily scoped count+seconds squashable models
     """
 
+    squash_sums = ("count", "seconds")
+
     seconds = models.BigIntegerField()
 
     @classmethod
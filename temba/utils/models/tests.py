@@ -1,17 +1,39 @@
+from datetime import date, datetime, timedelta, timezone as tzone
 from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django_redis import get_redis_connection
 
 from django.contrib.auth.models import Group, User
 from django.core import checks
 from django.db import connection, models
-from django.test import TestCase
-
-from temba.contacts.models import Contact
-from temba.flows.models import Flow
-from temba.tests import TembaTest
-
-from .base import delete_in_batches, patch_queryset_count, update_if_changed
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from temba.channels.models import ChannelCount
+from temba.contacts.models import Contact, ContactGroupCount, ContactNote, ContactURN
+from temba.flows.models import Flow, FlowNodeCount
+from temba.msgs.models import SystemLabel, SystemLabelCount
+from temba.notifications.models import Notification
+from temba.tests import TembaTest, matchers
+from temba.tickets.models import TicketDailyTiming
+from temba.utils import json
+from temba.utils.tasks import squash_shard
+
+from .base import (
+    _split_pk_range,
+    delete_in_batches,
+    get_replication_lag,
+    iter_keyset_batches,
+    patch_queryset_count,
+    update_if_changed,
+)
+from .deletion import DeletionPlan, DeletionStep
 from .es import IDSliceQuerySet
 from .fields import JSONAsTextField
+from .retention import RetentionPolicy
+from .squashable import count_cache_stats
 
 
 class ModelsTest(TembaTest):
@@ -51,6 +73,76 @@ class ModelsTest(TembaTest):
         self.assertTrue(Group.objects.filter(id=to_keep.id).exists())
         self.assertEqual(4, Group.objects.filter(id__in=[g.id for g in to_delete]).count())
 
+        # batch sizes can be adjusted to target a statement latency, here one which is never reached so they double
+        to_delete = [Group.objects.create(name=f"AA{i}") for i in range(30)]
+        batch_sizes = []
+
+        num_deleted = delete_in_batches(
+            Group.objects.filter(name__startswith="AA"),
+            batch_size=3,
+            pre_delete=lambda ids: batch_sizes.append(len(ids)),
+            target_latency=60,
+        )
+
+        self.assertEqual(30, num_deleted)
+        self.assertEqual([3, 6, 12, 9], batch_sizes)
+        self.assertTrue(Group.objects.filter(id=to_keep.id).exists())
+
+        # deletion can wait for replicas to catch up
+        to_delete = [Group.objects.create(name=f"BB{i}") for i in range(4)]
+
+        with patch("temba.utils.models.base.get_replication_lag", side_effect=[3.0, 0.5, 0.0]) as mock_lag:
+            with patch("time.sleep") as mock_sleep:
+                num_deleted = delete_in_batches(Group.objects.filter(name__startswith="BB"), batch_size=2, max_lag=1)
+
+        self.assertEqual(4, num_deleted)
+        self.assertEqual(3, mock_lag.call_count)
+        mock_sleep.assert_called_once_with(3.0)
+
+        self.assertEqual(0.0, get_replication_lag())  # no replicas in tests
+
+    def test_split_pk_range(self):
+        groups = [Group.objects.create(name=f"SP{i}") for i in range(10)]
+        qs = Group.objects.filter(name__startswith="SP")
+        first = groups[0].id
+
+        self.assertEqual([(first, first + 5), (first + 5, first + 10)], _split_pk_range(qs, "id", 2))
+        self.assertEqual(
+            [(first, first + 4), (first + 4, first + 8), (first + 8, first + 10)], _split_pk_range(qs, "id", 3)
+        )
+        self.assertEqual([], _split_pk_range(Group.objects.filter(name="XX"), "id", 2))
+
+    def test_iter_keyset_batches(self):
+        # create groups with duplicate names so that batches have to be split on the tie-breaking field
+        groups = [Group.objects.create(name=f"KS{i // 3}") for i in range(10)]
+        qs = Group.objects.filter(name__startswith="KS")
+
+        def names_and_ids(batches):
+            return [[(g.name, g.id) for g in batch] for batch in batches]
+
+        expected = sorted([(g.name, g.id) for g in groups])
+
+        with CaptureQueriesContext(connection) as captured:
+            batches = names_and_ids(iter_keyset_batches(qs, ("name", "id"), batch_size=4))
+
+        self.assertEqual([expected[0:4], expected[4:8], expected[8:10]], batches)
+        self.assertEqual(3, len(captured))
+        self.assertNotIn("ROW(", captured[0]["sql"])
+        self.assertIn('ROW("auth_group"."name", "auth_group"."id") > (ROW(', captured[1]["sql"])
+
+        batches = names_and_ids(iter_keyset_batches(qs, ("name", "id"), batch_size=4, reverse=True))
+        self.assertEqual(
+            [list(reversed(expected))[0:4], list(reversed(expected))[4:8], list(reversed(expected))[8:10]], batches
+        )
+
+        # an exact multiple of the batch size needs one extra query to find the end
+        with self.assertNumQueries(3):
+            batches = names_and_ids(iter_keyset_batches(qs, ("name", "id"), batch_size=5))
+
+        self.assertEqual([expected[0:5], expected[5:10]], batches)
+
+        self.assertEqual([], list(iter_keyset_batches(qs.filter(name="XX"), ("name", "id"))))
+
     def test_update_if_changed(self):
         with self.assertNumQueries(1):
             changed = update_if_changed(self.admin, first_name="Andrew", last_name="McAdmin")  # all fields changing
@@ -82,6 +174,382 @@ class ModelsTest(TembaTest):
         self.assertEqual("Andy", self.admin.first_name)
         self.assertEqual("McAdmin", self.admin.last_name)
 
+    def test_squash_batched(self):
+        def create_channel_count(count_type, day, count):
+            ChannelCount.objects.create(channel=self.channel, count_type=count_type, day=day, count=count)
+
+        create_channel_count("IM", date(2024, 1, 1), 2)
+        create_channel_count("IM", date(2024, 1, 1), 3)
+        create_channel_count("IM", date(2024, 1, 2), 1)
+        create_channel_count("OM", None, 4)
+        create_channel_count("OM", None, -1)
+
+        result = ChannelCount.squash_batched()
+
+        self.assertEqual(3, result["sets"])
+        self.assertEqual(2, result["collapsed"])
+        self.assertEqual(
+            {("IM", date(2024, 1, 1), 5), ("IM", date(2024, 1, 2), 1), ("OM", None, 3)},
+            set(ChannelCount.objects.values_list("count_type", "day", "count")),
+        )
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+
+        # squashing again is a noop
+        self.assertEqual({"sets": 0, "collapsed": 0, "rate": 0.0}, ChannelCount.squash_batched())
+
+        # columns not squashed over are carried over
+        flow = self.create_flow("Test")
+        node_uuid = "2b8d1d5b-6f4d-4bf7-8f2f-bf5a6c2b1a66"
+        FlowNodeCount.objects.create(flow=flow, node_uuid=node_uuid, count=1)
+        FlowNodeCount.objects.create(flow=flow, node_uuid=node_uuid, count=1)
+
+        FlowNodeCount.squash_batched()
+
+        self.assertEqual(
+            [(flow.id, 2, True)], list(FlowNodeCount.objects.values_list("flow_id", "count", "is_squashed"))
+        )
+
+        # multiple columns can be summed and totals can't go negative
+        for day, count, seconds in [(1, 1, 10), (1, 1, 20), (2, 1, 5), (2, -2, -10), (3, 1, 1), (4, 1, 1)]:
+            TicketDailyTiming.objects.create(
+                count_type="R", scope="o:1", day=date(2024, 1, day), count=count, seconds=seconds
+            )
+
+        # limit to a single batch of 3 sets
+        result = TicketDailyTiming.squash_batched(batch_size=3, max_batches=1)
+
+        self.assertEqual(3, result["sets"])
+        self.assertEqual(1, TicketDailyTiming.get_unsquashed().values("day").distinct().count())
+
+        TicketDailyTiming.squash_batched(batch_size=3)
+
+        self.assertEqual(
+            [(date(2024, 1, 1), 2, 30), (date(2024, 1, 2), 0, 0), (date(2024, 1, 3), 1, 1), (date(2024, 1, 4), 1, 1)],
+            list(TicketDailyTiming.objects.order_by("day").values_list("day", "count", "seconds")),
+        )
+
+    def test_squash_sharded(self):
+        for day in range(1, 11):
+            for count in (1, 2):
+                ChannelCount.objects.create(channel=self.channel, count_type="IM", day=date(2024, 1, day), count=count)
+
+        results = [ChannelCount.squash_batched(shard=s, num_shards=4) for s in range(4)]
+
+        # every set belongs to exactly one shard
+        self.assertEqual(10, sum(r["sets"] for r in results))
+        self.assertEqual(10, sum(r["collapsed"] for r in results))
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+        self.assertEqual({3}, set(ChannelCount.objects.values_list("count", flat=True)))
+
+    @override_settings(SQUASH_SHARDS=2)
+    def test_schedule_squash(self):
+        # nothing to squash
+        self.assertEqual({"backlog": 0, "shards": 0, "interval": 120.0}, ChannelCount.schedule_squash())
+
+        # not due again yet
+        self.assertEqual({"skipped": True}, ChannelCount.schedule_squash())
+
+        r = get_redis_connection()
+        r.delete("squash_due")
+
+        for day in range(1, 4):
+            ChannelCount.objects.create(channel=self.channel, count_type="IM", day=date(2024, 1, day), count=1)
+            ChannelCount.objects.create(channel=self.channel, count_type="IM", day=date(2024, 1, day), count=1)
+
+        # backlog is counted in distinct sets, same as the batch size
+        self.assertEqual({"backlog": 3, "shards": 1, "interval": 240.0}, ChannelCount.schedule_squash())
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+
+        r.delete("squash_due")
+
+        # a backlog bigger than a batch is split into shards and squashed more often
+        with patch.object(ChannelCount, "squash_batch_size", 2):
+            for day in range(1, 4):
+                ChannelCount.objects.create(channel=self.channel, count_type="IM", day=date(2024, 1, day), count=1)
+
+            self.assertEqual({"backlog": 3, "shards": 2, "interval": 120.0}, ChannelCount.schedule_squash())
+
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+        self.assertEqual({3}, set(ChannelCount.objects.values_list("count", flat=True)))
+
+        # shards which are already being squashed are skipped
+        r.set("squash-lock:channels.ChannelCount:2:0", "1")
+        self.assertEqual({"skipped": True}, squash_shard("channels.ChannelCount", 0, 2))
+
+        # but a shard with the same number from a different number of shards is a different set of rows
+        self.assertEqual({"sets": 0, "collapsed": 0, "rate": 0}, squash_shard("channels.ChannelCount", 0, 1))
+
+    @patch("temba.utils.analytics.gauges")
+    def test_cached_totals(self, mock_gauges):
+        ann = self.create_contact("Ann", phone="+1234567890")
+        group1 = self.create_group("Group 1", contacts=[ann])
+        group2 = self.create_group("Group 2", contacts=[])
+
+        count_cache_stats.flush()
+        mock_gauges.reset_mock()
+
+        # see totals as they are outside of tests, where writes don't clear the cache
+        self.clear_count_cache_on_write = False
+
+        with self.assertNumQueries(1):
+            self.assertEqual({group1: 1, group2: 0}, ContactGroupCount.get_totals([group1, group2]))
+
+        r = get_redis_connection()
+        self.assertLessEqual(r.ttl(f"count_cache:contacts_contactgroupcount:{group1.id}"), 10)
+
+        # totals now come from the cache, and can be stale until they expire
+        ContactGroupCount.objects.create(group=group1, count=2)
+        group2.contacts.add(ann)
+
+        with self.assertNumQueries(0):
+            self.assertEqual({group1: 1, group2: 0}, ContactGroupCount.get_totals([group1, group2]))
+
+        r.delete(f"count_cache:contacts_contactgroupcount:{group1.id}")
+
+        with self.assertNumQueries(1):
+            self.assertEqual({group1: 3, group2: 0}, ContactGroupCount.get_totals([group1, group2]))
+
+        # squashing doesn't change totals so cached totals stay valid
+        ContactGroupCount.squash_batched()
+
+        with self.assertNumQueries(0):
+            self.assertEqual({group1: 3, group2: 0}, ContactGroupCount.get_totals([group1, group2]))
+
+        # totals which are dicts are also cached
+        with self.assertNumQueries(1):
+            totals = SystemLabelCount.get_totals(self.org)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(totals, SystemLabelCount.get_totals(self.org))
+
+        self.assertEqual(0, totals[SystemLabel.TYPE_INBOX])
+
+        # in tests, writes clear the cache so that tests don't see stale totals
+        self.clear_count_cache_on_write = True
+        ContactGroupCount.objects.create(group=group2, count=1)
+
+        with self.assertNumQueries(1):
+            self.assertEqual({group1: 3, group2: 2}, ContactGroupCount.get_totals([group1, group2]))
+
+        # hits and misses are accumulated in process and reported as gauges when flushed
+        mock_gauges.assert_not_called()
+
+        count_cache_stats.flush()
+
+        mock_gauges.assert_called_once_with(
+            {
+                "temba.count_cache_hits_contacts_contactgroupcount": 5,
+                "temba.count_cache_misses_contacts_contactgroupcount": 5,
+                "temba.count_cache_hits_msgs_systemlabelcount": 1,
+                "temba.count_cache_misses_msgs_systemlabelcount": 1,
+            }
+        )
+
+
+class DeleteInBatchesWorkersTest(TransactionTestCase):
+    # threads use their own connections so can only see committed rows
+    serialized_rollback = True
+
+    def test_delete_in_batches_with_workers(self):
+        to_keep = Group.objects.create(name="Test")
+        to_delete = [Group.objects.create(name=f"WK{i}") for i in range(10)]
+        batches = []
+
+        num_deleted = delete_in_batches(
+            Group.objects.filter(name__startswith="WK"), batch_size=2, pre_delete=batches.append, workers=2
+        )
+
+        # the pk range was split between two threads which each deleted their half in batches
+        self.assertEqual(10, num_deleted)
+        self.assertEqual([2, 2, 2, 2, 1, 1], sorted((len(b) for b in batches), reverse=True))
+        self.assertEqual(sorted(g.id for g in to_delete), sorted(id for b in batches for id in b))
+        self.assertFalse(Group.objects.filter(name__startswith="WK").exists())
+        self.assertTrue(Group.objects.filter(id=to_keep.id).exists())
+
+
+class DeletionPlanTest(TembaTest):
+    def test_stages(self):
+        plan = DeletionPlan(
+            "test",
+            [
+                DeletionStep("contacts", Contact.objects.filter(org=self.org)),
+                DeletionStep("urns", ContactURN.objects.filter(org=self.org)),
+                DeletionStep("notes", ContactNote.objects.filter(contact__org=self.org)),
+                DeletionStep("groups", Group.objects.filter(name__startswith="DP"), after=("urns",)),
+            ],
+        )
+
+        # steps are ordered so that rows are deleted before the rows they reference
+        self.assertEqual([["urns", "notes"], ["contacts", "groups"]], [[s.name for s in st] for st in plan.stages])
+
+        with self.assertRaises(ValueError):
+            DeletionPlan(
+                "test",
+                [
+                    DeletionStep("contacts", Contact.objects.all()),
+                    DeletionStep("urns", ContactURN.objects.all(), after=("contacts",)),
+                ],
+            )
+
+    def test_execute(self):
+        for i in range(5):
+            self.create_contact(f"Contact {i}", urns=[f"twitter:contact{i}"])
+
+        other = self.create_contact("Other", urns=["twitter:other"], org=self.org2)
+
+        batches = []
+
+        def delete_urns(urns):
+            if len(batches) == 2:
+                raise ValueError("boom")
+
+            ContactURN.objects.filter(id__in=[u.id for u in urns]).delete()
+            batches.append(urns)
+
+        def create_plan(delete_batch=None):
+            return DeletionPlan(
+                f"test:{self.org.id}",
+                [
+                    DeletionStep("contacts", Contact.objects.filter(org=self.org)),
+                    DeletionStep("urns", ContactURN.objects.filter(org=self.org), delete_batch=delete_batch),
+                    DeletionStep("notes", ContactNote.objects.filter(contact__org=self.org)),
+                ],
+                batch_size=2,
+            )
+
+        # interrupt the plan after the first two batches of URNs
+        with self.assertRaises(ValueError):
+            create_plan(delete_batch=delete_urns).execute()
+
+        self.assertEqual(1, ContactURN.objects.filter(org=self.org).count())
+        self.assertEqual(5, Contact.objects.filter(org=self.org).count())
+
+        # mark notes step as finished to check finished steps aren't repeated
+        get_redis_connection().hset(
+            f"deletion_plan:test:{self.org.id}", "notes", json.dumps({"deleted": 3, "last": 7, "done": True})
+        )
+
+        # resuming only deletes the remaining URNs
+        self.assertEqual({"notes": 3, "urns": 5, "contacts": 5}, create_plan().execute())
+
+        self.assertFalse(Contact.objects.filter(org=self.org).exists())
+        self.assertFalse(ContactURN.objects.filter(org=self.org).exists())
+        self.assertTrue(Contact.objects.filter(id=other.id).exists())
+
+        # checkpoints are cleared once the plan has completed
+        self.assertFalse(get_redis_connection().exists(f"deletion_plan:test:{self.org.id}"))
+        self.assertEqual({"notes": 0, "urns": 0, "contacts": 0}, create_plan().execute())
+
+    def test_execute_with_workers(self):
+        for i in range(3):
+            contact = self.create_contact(f"Contact {i}", urns=[f"twitter:contact{i}"])
+            ContactNote.objects.create(contact=contact, text="Hi", created_by=self.admin)
+
+        class InlineExecutor:
+            # threads can't see data created inside a test transaction so run each task in this thread
+            def __init__(self, max_workers):
+                self.max_workers = max_workers
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def map(self, fn, *iterables):
+                return list(map(fn, *iterables))
+
+        plan = DeletionPlan(
+            f"test:{self.org.id}",
+            [
+                DeletionStep("contacts", Contact.objects.filter(org=self.org)),
+                DeletionStep("urns", ContactURN.objects.filter(org=self.org)),
+                DeletionStep("notes", ContactNote.objects.filter(contact__org=self.org)),
+            ],
+            workers=2,
+        )
+
+        with patch("temba.utils.models.deletion.ThreadPoolExecutor", InlineExecutor):
+            with patch.object(connection, "close") as mock_close:
+                self.assertEqual({"urns": 3, "notes": 3, "contacts": 3}, plan.execute())
+
+        # urns and notes were deleted in parallel with each closing its connection, contacts on its own
+        self.assertEqual(2, mock_close.call_count)
+        self.assertFalse(Contact.objects.filter(org=self.org).exists())
+
+
+class RetentionPolicyTest(TembaTest):
+    def test_batches(self):
+        notification1 = Notification.objects.create(
+            org=self.org, user=self.admin, notification_type="incident:started", scope="1"
+        )
+        notification2 = Notification.objects.create(
+            org=self.org, user=self.admin, notification_type="incident:started", scope="2"
+        )
+        Notification.objects.filter(id=notification1.id).update(created_on=datetime(2024, 1, 1, tzinfo=tzone.utc))
+
+        retention = RetentionPolicy("notification", Notification, "created_on", inclusive=False)
+        self.assertFalse(retention.is_partitioned())
+
+        result = retention.apply(now=datetime(2024, 6, 1, tzinfo=tzone.utc))
+        self.assertEqual(1, result["deleted"])
+        self.assertGreaterEqual(result["bytes"], 0)
+        self.assertEqual({notification2}, set(Notification.objects.all()))
+
+        # nothing trimmed for tables without a retention period
+        with override_settings(RETENTION_PERIODS={"notification": None}):
+            self.assertEqual({"deleted": 0, "bytes": 0}, retention.apply())
+
+    def test_partitions(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE retention_test (id bigint, created_on timestamptz NOT NULL) PARTITION BY RANGE (created_on)"
+            )
+            cursor.execute("CREATE TABLE retention_test_default PARTITION OF retention_test DEFAULT")
+
+        model = SimpleNamespace(_meta=SimpleNamespace(db_table="retention_test"))
+
+        with override_settings(RETENTION_PERIODS={"test": timedelta(days=2)}):
+            retention = RetentionPolicy("test", model, "created_on")
+            self.assertTrue(retention.is_partitioned())
+            self.assertFalse(RetentionPolicy("test", model, "modified_on").is_partitioned())
+
+            # creates partitions for today and upcoming days
+            result = retention.apply(now=datetime(2024, 3, 1, 12, 0, tzinfo=tzone.utc))
+            self.assertEqual({"deleted": 0, "bytes": 0, "partitions_dropped": 0}, result)
+            self.assertEqual(
+                [date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 3), date(2024, 3, 4)],
+                [p[1] for p in retention.get_partitions()],
+            )
+
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO retention_test (id, created_on) VALUES (1, '2024-03-01 10:00Z'), (2, '2024-03-02 10:00Z')"
+                )
+                cursor.execute("ANALYZE retention_test")
+
+            # day of 3/1 isn't fully expired until the end of 3/3
+            result = retention.apply(now=datetime(2024, 3, 3, 12, 0, tzinfo=tzone.utc))
+            self.assertEqual(0, result["partitions_dropped"])
+
+            result = retention.apply(now=datetime(2024, 3, 4, 0, 0, tzinfo=tzone.utc))
+            self.assertEqual({"deleted": 1, "bytes": matchers.Int(min=1), "partitions_dropped": 1}, result)
+            self.assertEqual(
+                [
+                    date(2024, 3, 2),
+                    date(2024, 3, 3),
+                    date(2024, 3, 4),
+                    date(2024, 3, 5),
+                    date(2024, 3, 6),
+                    date(2024, 3, 7),
+                ],
+                [p[1] for p in retention.get_partitions()],
+            )
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id FROM retention_test")
+                self.assertEqual([(2,)], cursor.fetchall())
+
 
 class IDSliceQuerySetTest(TembaTest):
     def test_fields(self):
@@ -1,3 +1,8 @@
+import base64
+import hashlib
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable
 from urllib.parse import urlparse
 
@@ -52,3 +57,93 @@ class EventStreamReader:
 
                 for line in lines:
                     yield json.loads(line.decode("utf-8"))
+
+
+class MultipartUpload:
+    """
+    Writable stream which uploads to S3 in parts of `part_size` bytes as they fill up, with at most `max_pending` parts
+    being uploaded concurrently so memory use is bounded. The multipart upload is only started once the first part is
+    full, so callers can check `is_multipart` after writing and upload small contents with a single request instead.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, *, part_size: int, max_pending: int = 2, **upload_args):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_pending = max_pending
+        self.upload_args = upload_args
+
+        self.buffer = io.BytesIO()
+        self.upload_id = None
+        self.pending = deque()
+        self.parts = []
+        self.executor = None
+
+    @property
+    def is_multipart(self) -> bool:
+        return self.upload_id is not None
+
+    def write(self, data: bytes):
+        self.buffer.write(data)
+
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def getvalue(self) -> bytes:
+        """
+        Gets the written contents of a stream which hasn't become a multipart upload
+        """
+        assert not self.is_multipart, "contents already uploaded"
+
+        return self.buffer.getvalue()
+
+    def complete(self):
+        """
+        Uploads the last part and completes the multipart upload
+        """
+        if self.buffer.tell() > 0:
+            self._upload_part()
+
+        while self.pending:
+            self.parts.append(self.pending.popleft().result())
+
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+        self.executor.shutdown()
+
+    def abort(self):
+        """
+        Aborts the multipart upload if one was started so that S3 discards any uploaded parts
+        """
+        if self.is_multipart:
+            self.executor.shutdown(cancel_futures=True)
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def _upload_part(self):
+        if not self.is_multipart:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.upload_args)
+            self.upload_id = response["UploadId"]
+            self.executor = ThreadPoolExecutor(max_workers=self.max_pending)
+
+        # wait for earlier parts if we already have the maximum number in flight
+        while len(self.pending) >= self.max_pending:
+            self.parts.append(self.pending.popleft().result())
+
+        body = self.buffer.getvalue()
+        self.buffer = io.BytesIO()
+        part_number = len(self.parts) + len(self.pending) + 1
+
+        self.pending.append(self.executor.submit(self._send_part, part_number, body))
+
+    def _send_part(self, part_number: int, body: bytes) -> dict:
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body,
+            ContentMD5=base64.standard_b64encode(hashlib.md5(body).digest()).decode(),
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
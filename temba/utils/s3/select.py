@@ -1,6 +1,17 @@
 from datetime import datetime
 
-LOOKUPS = {"gt": ">", "gte": ">=", "lte": "<=", "lt": "<", "in": "IN", "ne": "!=", "isnull": "IS NULL"}
+import iso8601
+
+LOOKUPS = {
+    "gt": ">",
+    "gte": ">=",
+    "lte": "<=",
+    "lt": "<",
+    "in": "IN",
+    "ne": "!=",
+    "isnull": "IS NULL",
+    "contains": "CONTAINS",
+}
 
 
 def compile_select(*, fields=(), alias: str = "s", where: dict = None) -> str:
@@ -33,6 +44,10 @@ def _compile_condition(alias: str, field: str, val) -> str:
 
     if op == "IS NULL":
         return f"{column} IS NULL" if val else f"{column} IS NOT NULL"
+    elif op == "CONTAINS":
+        # first part of the field is an array, e.g. labels__uuid__contains checks the uuids of items in labels
+        array, *attr = field.split("__")
+        return f"{_compile_value(val)} IN {alias}.{'.'.join([array + '[*]'] + attr)}"
 
     value = _compile_value(val)
     return f"{column} {op} {value}"
@@ -57,3 +72,66 @@ def _compile_value(val) -> str:
     if isinstance(val, (list, tuple)):
         return f"({', '.join([_compile_value(v) for v in val])})"
     return str(val)
+
+
+def match_record(record: dict, where: dict) -> bool:
+    """
+    Evaluates the same conditions as compile_select against a record in Python. Raw conditions can't be evaluated.
+    """
+    for field, val in where.items():
+        assert field != "__raw__", "raw conditions can't be evaluated in Python"
+
+        lookup = "eq"
+        field_parts = field.split("__")
+        if field_parts[-1] in LOOKUPS:
+            lookup = field_parts[-1]
+            field_parts = field_parts[:-1]
+
+        if lookup == "contains":
+            items = record.get(field_parts[0]) or []
+            if val not in [_get_value(item, field_parts[1:]) for item in items]:
+                return False
+            continue
+
+        value = _get_value(record, field_parts)
+
+        if lookup == "isnull":
+            if (value is None) != val:
+                return False
+            continue
+
+        # like SQL, comparisons with null are never true
+        if value is None:
+            return False
+
+        if isinstance(val, datetime):
+            value = iso8601.parse_date(value)
+
+        if lookup == "eq":
+            matched = value == val
+        elif lookup == "ne":
+            matched = value != val
+        elif lookup == "in":
+            matched = value in val
+        elif lookup == "gt":
+            matched = value > val
+        elif lookup == "gte":
+            matched = value >= val
+        elif lookup == "lt":
+            matched = value < val
+        else:
+            matched = value <= val
+
+        if not matched:
+            return False
+
+    return True
+
+
+def _get_value(record: dict, path: list):
+    value = record
+    for part in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
@@ -1,7 +1,7 @@
 from datetime import datetime, timezone as tzone
 
 from temba.tests import TembaTest
-from temba.utils.s3 import compile_select, split_url
+from temba.utils.s3 import compile_select, match_record, split_url
 
 
 class S3Test(TembaTest):
@@ -56,6 +56,11 @@ class SelectTest(TembaTest):
             compile_select(where={"flow__isnull": False}),
         )
 
+        self.assertEqual(
+            "SELECT s.* FROM s3object s WHERE '1234' IN s.labels[*].uuid",
+            compile_select(where={"labels__uuid__contains": "1234"}),
+        )
+
         # a where clause can also be raw S3-select-SQL (used by search_archives command)
         self.assertEqual(
             "SELECT s.* FROM s3object s WHERE s.uuid = '2345' AND s.contact.uuid = '1234'",
@@ -65,3 +70,28 @@ class SelectTest(TembaTest):
             "SELECT s.* FROM s3object s WHERE '1ccf09f6-3fe8-4c0d-a073-981632be5a30' IN s.labels[*].uuid[*]",
             compile_select(where={"__raw__": "'1ccf09f6-3fe8-4c0d-a073-981632be5a30' IN s.labels[*].uuid[*]"}),
         )
+
+    def test_match_record(self):
+        record = {
+            "id": 123,
+            "created_on": "2021-09-28T18:27:30.123456Z",
+            "contact": {"uuid": "1234", "name": "Bob"},
+            "flow": None,
+            "labels": [{"uuid": "2345", "name": "Spam"}],
+            "responded": True,
+        }
+
+        self.assertTrue(match_record(record, {}))
+        self.assertTrue(match_record(record, {"id": 123, "contact__uuid": "1234", "responded": True}))
+        self.assertFalse(match_record(record, {"id": 123, "contact__uuid": "2345"}))
+        self.assertTrue(match_record(record, {"id__gt": 100, "id__lte": 123, "id__ne": 124}))
+        self.assertFalse(match_record(record, {"id__lt": 123}))
+        self.assertTrue(match_record(record, {"contact__uuid__in": ("1234", "2345")}))
+        self.assertFalse(match_record(record, {"contact__uuid__in": ("2345",)}))
+        self.assertTrue(match_record(record, {"flow__isnull": True, "contact__isnull": False}))
+        self.assertFalse(match_record(record, {"flow__uuid": "1234"}))  # null never matches
+        self.assertFalse(match_record(record, {"flow__uuid__ne": "1234"}))
+        self.assertTrue(match_record(record, {"labels__uuid__contains": "2345"}))
+        self.assertFalse(match_record(record, {"labels__uuid__contains": "1234"}))
+        self.assertTrue(match_record(record, {"created_on__gte": datetime(2021, 9, 28, 18, 27, 30, 123456, tzone.utc)}))
+        self.assertFalse(match_record(record, {"created_on__gt": datetime(2021, 9, 28, 18, 27, 30, 123456, tzone.utc)}))
@@ -0,0 +1,51 @@
+from celery import shared_task
+from django_redis import get_redis_connection
+
+from django.apps import apps
+
+from temba.mailroom.client.transport import LatencyHistogram
+from temba.utils import analytics
+from temba.utils.crons import cron_task
+
+SQUASH_LOCK_TIMEOUT = 900
+
+
+@shared_task
+def squash_shard(model_label: str, shard: int, num_shards: int):
+    """
+    Squashes a single shard of the unsquashed sets of a squashable model, with its own lock so that shards of the same
+    model and shards of other models can be squashed concurrently
+    """
+    model = apps.get_model(model_label)
+
+    r = get_redis_connection()
+    lock_key = f"squash-lock:{model_label}:{num_shards}:{shard}"
+
+    if r.get(lock_key):
+        return {"skipped": True}
+
+    with r.lock(lock_key, timeout=SQUASH_LOCK_TIMEOUT):
+        return model.squash_batched(shard=shard, num_shards=num_shards)
+
+
+@cron_task()
+def report_mailroom_latency():
+    """
+    Reports the number of requests to each mailroom endpoint since the last report and their p50/p99 latencies
+    """
+
+    stats = LatencyHistogram.pop_stats()
+    gauges = {}
+    for endpoint, endpoint_stats in stats.items():
+        name = endpoint.replace("/", "_")
+        gauges[f"temba.mailroom_requests_{name}"] = endpoint_stats["count"]
+
+        # percentiles beyond the largest bucket have no upper bound to report
+        for p in ("p50", "p99"):
+            if endpoint_stats[f"{p}_ms"] is not None:
+                gauges[f"temba.mailroom_latency_{p}_{name}"] = endpoint_stats[f"{p}_ms"]
+
+    if gauges:
+        analytics.gauges(gauges)
+
+    return stats
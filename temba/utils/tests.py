@@ -20,7 +20,9 @@ from temba.utils import json, uuid
 from temba.utils.compose import compose_serialize
 
 from . import (
+    FingerprintSet,
     chunk_list,
+    connected_components,
     countries,
     format_number,
     get_nested_key,
@@ -132,6 +134,40 @@ class InitTest(TembaTest):
 
         self.assertEqual(curr, 100)
 
+    def test_connected_components(self):
+        graph = {"a": {"b"}, "b": {"a", "c"}, "c": {"b"}, "d": set(), "e": {"f"}, "f": {"e"}}
+
+        self.assertEqual(
+            [{"a", "b", "c"}, {"d"}, {"e", "f"}], sorted(connected_components(graph), key=lambda c: sorted(c))
+        )
+        self.assertEqual([], connected_components({}))
+
+        # long chains don't hit the recursion limit
+        chain = {i: {i + 1} for i in range(10_000)}
+        self.assertEqual([set(range(10_001))], connected_components(chain))
+
+    def test_fingerprint_set(self):
+        fingerprints = FingerprintSet(capacity=4)
+
+        self.assertTrue(fingerprints.add("tel:+250788382382"))
+        self.assertTrue(fingerprints.add("tel:+250788383383"))
+        self.assertFalse(fingerprints.add("tel:+250788382382"))
+        self.assertIn("tel:+250788383383", fingerprints)
+        self.assertNotIn("tel:+250788383384", fingerprints)
+        self.assertEqual(2, len(fingerprints))
+
+        # grows as values are added
+        for i in range(1000):
+            self.assertTrue(fingerprints.add(f"twitter:user{i}"))
+
+        self.assertEqual(1002, len(fingerprints))
+        self.assertEqual(2048, len(fingerprints._slots))
+        self.assertTrue(all(f"twitter:user{i}" in fingerprints for i in range(1000)))
+        self.assertFalse(fingerprints.add("twitter:user999"))
+
+        with self.assertRaises(AssertionError):
+            FingerprintSet(capacity=1000)
+
     def test_nested_keys(self):
         nested = {}
 
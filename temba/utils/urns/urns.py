@@ -1,4 +1,5 @@
 from enum import Enum
+from functools import lru_cache
 
 import phonenumbers
 
@@ -36,6 +37,15 @@ class State(Enum):
 
 
 def parse_urn(urn):
+    # fast path for the common case of URNs without a query, fragment or escapes
+    if "?" not in urn and "#" not in urn and "%" not in urn:
+        scheme, _, path = urn.partition(":")
+        if not scheme:
+            raise ValueError("scheme cannot be empty")
+        if not path:
+            raise ValueError("path cannot be empty")
+        return ParsedURN(scheme, path, "", "")
+
     state = State.scheme
 
     buffers = {State.scheme: [], State.path: [], State.query: [], State.fragment: []}
@@ -83,9 +93,11 @@ def unescape(s):
     return s
 
 
+@lru_cache(maxsize=50_000)
 def parse_number(s: str, country_code: str) -> str:
     """
-    Tries to parse the given string as a phone number and if successful returns it as E164
+    Tries to parse the given string as a phone number and if successful returns it as E164. Successful results are
+    memoized since the same numbers are typically parsed repeatedly, e.g. normalized on import and then validated.
     """
     try:
         parsed = phonenumbers.parse(s, country_code or None)